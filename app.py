@@ -32,25 +32,25 @@ def main():
         # 1. Validation (The Brain)
         from src import brain, analyst, writer
         
-        is_valid, message = brain.validate_file(uploaded_file)
+        is_valid, message, dataset = brain.validate_file(uploaded_file)
         
         if not is_valid:
             st.error(message)
         else:
             st.success("File validated successfully!")
             
-            # 2. Ingestion (Analyst)
-            df = analyst.load_data(uploaded_file)
+            # 2. Ingestion already happened during validation
+            df = dataset.df
             
             # Brain: Determine Context
-            report_type = brain.determine_report_type(df)
+            report_type = brain.determine_report_type(dataset)
             st.info(f"💡 AI Suggestion: This looks like a **{report_type}**.")
 
             st.dataframe(df.head(), use_container_width=True)
             
             # 3. Analysis (Analyst)
             with st.spinner("Crunching numbers..."):
-                stats = analyst.generate_summary(df)
+                stats = analyst.generate_summary_v2(dataset)
             
             with st.expander("View Calculated Statistics (The Analyst)"):
                 st.json(stats)
@@ -0,0 +1,393 @@
+"""
+Headless batch reports for a directory or glob of data files.
+
+Every file goes through the same pipeline as an upload followed by a
+report: validation (brain), summary (analyst), charts (plotter) and
+narrative (writer). The CPU-bound stages run in a process pool, one file
+per worker, so throughput scales with cores. Narratives are requested
+from the main process with at most --llm-concurrency calls in flight,
+however many workers there are, to stay within the model quotas.
+
+Results go to --out: one folder per file with report.md, stats.json and
+links to its charts (PNGs in <out>/plots, shared and named by content
+hash), plus manifest.json. The manifest records each file's status and
+per-stage seconds, keyed by content hash, and is saved after every file.
+Files it lists as finished are skipped, so an interrupted run picks up
+where it stopped; --force redoes them. Copies of the same content are
+analysed once.
+
+Run from the backend folder:
+    python batch.py "exports/*.csv" --out reports
+    python batch.py exports/ --out reports --workers 8 --llm-concurrency 2
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+from werkzeug.datastructures import FileStorage
+
+from src import analyst, brain, ingest, plot_store, plotter, serialize, writer
+
+# Load env variables
+dotenv_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.env')
+load_dotenv(dotenv_path)
+
+# Same default as the server: larger CSV/JSON-lines files are summarised in chunks
+STREAMING_THRESHOLD_BYTES = int(os.getenv("STREAMING_THRESHOLD_BYTES", 512 * 1024 * 1024))
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+# Statuses that are not retried on the next run; invalid files would
+# fail the same way again
+FINISHED = ('done', 'invalid')
+STAGES = ('hash', 'validate', 'analyze', 'plots', 'narrative', 'write')
+
+
+def find_files(inputs):
+    """
+    Data files named by inputs: directories (their files), glob patterns
+    (** matches subfolders) or plain paths. Sorted, without duplicates
+    or unsupported formats.
+    """
+    paths = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            matches = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+        else:
+            matches = glob.glob(pattern, recursive=True) or [pattern]
+        for path in matches:
+            if os.path.isfile(path) and ingest.detect_format(path) is not None:
+                paths.add(os.path.abspath(path))
+    return sorted(paths)
+
+
+def _stat_paths(paths):
+    """
+    {path: [size, mtime_ns]}, for telling later whether a file changed.
+    """
+    stats = {}
+    for path in paths:
+        st = os.stat(path)
+        stats[path] = [st.st_size, st.st_mtime_ns]
+    return stats
+
+
+def hash_path(path):
+    """
+    (content hash, seconds taken) of a file.
+    """
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        digest = ingest.hash_file(FileStorage(stream=f, filename=os.path.basename(path)))
+    return digest, round(time.perf_counter() - start, 4)
+
+
+def output_name(path, digest):
+    """
+    Folder name for a file's report: readable stem plus content hash.
+    """
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return f"{re.sub(r'[^A-Za-z0-9_-]', '_', stem)[:48]}-{digest[:12]}"
+
+
+class Manifest:
+    """
+    manifest.json of an output folder: one entry per file content hash.
+    Saved (atomically) after every change so a crash loses at most the
+    file being written.
+    """
+
+    def __init__(self, out_dir):
+        self.path = os.path.join(out_dir, MANIFEST_NAME)
+        self.files = {}
+        self.runs = []
+        self._lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            self.files = data.get("files", {})
+            self.runs = data.get("runs", [])
+
+    def finished(self, digest):
+        """
+        True if the content needs no work.
+        """
+        with self._lock:
+            return self.files.get(digest, {}).get("status") in FINISHED
+
+    def unchanged(self, path):
+        """
+        Content hash of path if a finished entry lists it with the same
+        size and modification time, so the file need not be hashed again.
+        """
+        st = os.stat(path)
+        with self._lock:
+            for digest, entry in self.files.items():
+                if (entry.get("status") in FINISHED
+                        and entry.get("paths", {}).get(path) == [st.st_size, st.st_mtime_ns]):
+                    return digest
+        return None
+
+    def add_paths(self, digest, paths):
+        """
+        Records more copies of an entry's content.
+        """
+        with self._lock:
+            entry = self.files[digest]
+            entry["paths"] = {**entry.get("paths", {}), **_stat_paths(paths)}
+            self._save()
+
+    def record(self, digest, entry):
+        with self._lock:
+            self.files[digest] = entry
+            self._save()
+
+    def add_run(self, summary):
+        with self._lock:
+            self.runs.append(summary)
+            self._save()
+
+    def _save(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(serialize.dumps({"version": MANIFEST_VERSION, "files": self.files, "runs": self.runs}))
+        os.replace(temp_path, self.path)
+
+
+# --- CPU-bound stages (worker processes) ---
+
+def _init_worker():
+    # Each worker renders its own charts; a nested chart pool per worker
+    # would only oversubscribe the cores
+    plotter.PLOT_WORKERS = 0
+
+
+@contextmanager
+def _timed(timings, name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round(time.perf_counter() - start, 4)
+
+
+def analyse_file(path, digest, plot_dir):
+    """
+    Validate, summarise and chart one file. Runs in a worker.
+    Returns a result dict with "status": 'invalid', 'failed' or
+    'analysed' (with stats and plots).
+    """
+    timings = {}
+    result = {"path": path, "digest": digest, "timings": timings}
+    try:
+        with open(path, 'rb') as f:
+            file = FileStorage(stream=f, filename=os.path.basename(path))
+            with _timed(timings, 'validate'):
+                chunked = ingest.can_stream(file) and ingest.file_size(file) > STREAMING_THRESHOLD_BYTES
+                is_valid, message, dataset = brain.validate_file(
+                    file, head_rows=ingest.DEFAULT_CHUNK_SIZE if chunked else None)
+            if not is_valid:
+                result.update(status='invalid', error=message)
+                return result
+
+            with _timed(timings, 'analyze'):
+                stats = analyst.generate_summary_chunked(file) if chunked else analyst.generate_summary_v2(dataset)
+                report_type = brain.determine_report_type(dataset)
+            if "error" in stats:
+                result.update(status='failed', error=stats["error"])
+                return result
+
+            # Charts of chunked files come from the first chunk, as in the server
+            with _timed(timings, 'plots'):
+                store = plot_store.PlotStore(plot_dir, max_bytes=0, ttl_seconds=0, gc_interval_seconds=0)
+                plots = plotter.generate_plots(dataset, store)
+
+        result.update(status='analysed', stats=serialize.clean(stats), report_type=report_type, plots=plots,
+                      analysis_mode="chunked" if chunked else "in_memory")
+    except Exception as e:
+        result.update(status='failed', error=f"{type(e).__name__}: {e}")
+    return result
+
+
+# --- Narrative and output (main process) ---
+
+def write_report(result, out_dir, instruction):
+    """
+    Requests the narrative for an analysed file and writes its report
+    folder. Runs on the LLM thread pool, whose size bounds the number of
+    concurrent LLM calls. Returns the manifest entry.
+    """
+    timings = result["timings"]
+    entry = {"status": 'failed', "report_type": result["report_type"], "analysis_mode": result["analysis_mode"],
+             "rows": result["stats"].get("basic_info", {}).get("rows")}
+    with _timed(timings, 'narrative'):
+        narrative = writer.generate_narrative(result["stats"], instruction)
+    # The writer reports failures as text instead of raising
+    if narrative.startswith("Error"):
+        entry["error"] = narrative
+        return entry
+
+    with _timed(timings, 'write'):
+        name = output_name(result["path"], result["digest"])
+        folder = os.path.join(out_dir, name)
+        os.makedirs(folder, exist_ok=True)
+        charts = "\n\n".join(f"![{p['title']}](../plots/{p['file']})" for p in result["plots"])
+        with open(os.path.join(folder, "report.md"), 'w', encoding='utf-8') as f:
+            f.write(f"{narrative.rstrip()}\n\n## Charts\n\n{charts}\n")
+        with open(os.path.join(folder, "stats.json"), 'w', encoding='utf-8') as f:
+            f.write(serialize.dumps({"report_type": result["report_type"], "stats": result["stats"],
+                                     "plots": result["plots"]}))
+    entry.update(status='done', output=name)
+    return entry
+
+
+def _entry(result, paths, entry=None):
+    """
+    Manifest entry for a finished file: its paths (all copies of the
+    content), timings and status, plus entry (from write_report) if it
+    got that far.
+    """
+    timings = result["timings"]
+    entry = dict(entry or {"status": result["status"]})
+    if result.get("error") and "error" not in entry:
+        entry["error"] = result["error"]
+    entry.update(path=result["path"], paths=_stat_paths(paths), timings=timings,
+                 seconds=round(sum(timings.values()), 4), finished_at=time.time())
+    return entry
+
+
+def run(args):
+    """
+    Processes every input file and returns the run summary.
+    """
+    out_dir = os.path.abspath(args.out)
+    plot_dir = os.path.join(out_dir, "plots")
+    os.makedirs(plot_dir, exist_ok=True)
+    manifest = Manifest(out_dir)
+    paths = find_files(args.inputs)
+
+    counts = {"done": 0, "skipped": 0, "invalid": 0, "failed": 0}
+    stage_seconds = dict.fromkeys(STAGES, 0.0)
+    progress = {"n": 0}
+    progress_lock = threading.Lock()
+
+    def report(path, status, seconds=None):
+        with progress_lock:
+            counts[status] += 1
+            progress["n"] += 1
+            took = f" {seconds:.2f}s" if seconds is not None else ""
+            print(f"[{progress['n']}/{len(paths)}] {status:<8}{took} {path}", flush=True)
+
+    start = time.perf_counter()
+    # Hashing is I/O bound and hashlib releases the GIL, so it runs on threads
+    to_hash = []
+    for path in paths:
+        if not args.force and manifest.unchanged(path) is not None:
+            report(path, 'skipped')
+        else:
+            to_hash.append(path)
+    with ThreadPoolExecutor(max_workers=min(8, args.workers * 2)) as hash_pool:
+        hashed = list(zip(to_hash, hash_pool.map(hash_path, to_hash)))
+
+    copies = {} # digest -> paths, first one analysed
+    hash_seconds = {}
+    for path, (digest, seconds) in hashed:
+        if not args.force and manifest.finished(digest):
+            manifest.add_paths(digest, [path])
+            report(path, 'skipped')
+            continue
+        if digest in copies:
+            report(path, 'skipped')
+        copies.setdefault(digest, []).append(path)
+        hash_seconds.setdefault(digest, seconds)
+
+    print(f"{len(paths)} files, {len(copies)} to process with {args.workers} workers "
+          f"and up to {args.llm_concurrency} concurrent LLM calls", flush=True)
+
+    def finish(result, entry=None):
+        result["timings"] = {"hash": hash_seconds[result["digest"]], **result["timings"]}
+        entry = _entry(result, copies[result["digest"]], entry)
+        manifest.record(result["digest"], entry)
+        with progress_lock:
+            for stage, seconds in entry["timings"].items():
+                stage_seconds[stage] += seconds
+        report(result["path"], entry["status"], entry["seconds"])
+
+    def narrate(result):
+        try:
+            finish(result, write_report(result, out_dir, args.instruction))
+        except Exception as e:
+            finish(result, {"status": 'failed', "error": f"{type(e).__name__}: {e}"})
+
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker) as pool, \
+            ThreadPoolExecutor(max_workers=args.llm_concurrency, thread_name_prefix="batch-llm") as llm_pool:
+        futures = {pool.submit(analyse_file, group[0], digest, plot_dir): (group[0], digest)
+                   for digest, group in copies.items()}
+        narratives = []
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e: # The worker process died
+                path, digest = futures[future]
+                result = {"path": path, "digest": digest, "status": 'failed', "timings": {},
+                          "error": f"{type(e).__name__}: {e}"}
+            if result["status"] == 'analysed':
+                # The pool keeps analysing while earlier files wait for the LLM
+                narratives.append(llm_pool.submit(narrate, result))
+            else:
+                finish(result)
+        for future in narratives:
+            future.result()
+
+    wall = time.perf_counter() - start
+    processed = counts["done"] + counts["invalid"] + counts["failed"]
+    summary = {
+        "started_at": time.time() - wall,
+        "seconds": round(wall, 3),
+        "workers": args.workers,
+        "llm_concurrency": args.llm_concurrency,
+        "files": len(paths),
+        **counts,
+        "files_per_minute": round(processed / wall * 60, 2) if wall > 0 and processed else None,
+        "stage_seconds": {stage: round(seconds, 3) for stage, seconds in stage_seconds.items()},
+    }
+    manifest.add_run(summary)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="+", help="data files, directories or glob patterns")
+    parser.add_argument("--out", "-o", default="reports", help="output folder (holds the manifest)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="processes for the CPU-bound stages")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="maximum concurrent LLM calls")
+    parser.add_argument("--instruction", default="", help="extra instruction for every narrative")
+    parser.add_argument("--force", action="store_true", help="redo files the manifest lists as finished")
+    args = parser.parse_args()
+    if args.workers < 1 or args.llm_concurrency < 1:
+        parser.error("--workers and --llm-concurrency must be at least 1")
+
+    summary = run(args)
+
+    print(f"\n{summary['files']} files in {summary['seconds']:.1f}s: {summary['done']} done, "
+          f"{summary['skipped']} skipped, {summary['invalid']} invalid, {summary['failed']} failed")
+    print(f"  {'stage':<12} {'total (s)':>10}")
+    for stage, seconds in summary["stage_seconds"].items():
+        print(f"  {stage:<12} {seconds:>10.2f}")
+    if summary["files_per_minute"]:
+        print(f"  {summary['files_per_minute']} files/minute")
+    print(f"Manifest: {os.path.join(os.path.abspath(args.out), MANIFEST_NAME)}")
+    sys.exit(1 if summary["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
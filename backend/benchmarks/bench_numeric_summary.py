@@ -0,0 +1,87 @@
+"""
+Scaling benchmark for the numeric section of generate_summary_v2.
+
+Compares the old per-column pandas loop with the batched
+analyst.numeric_summary for an increasing number of columns.
+
+Run from the backend folder:
+    python -m benchmarks.bench_numeric_summary --rows 10000 --cols 10 100 500 2000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src import analyst
+
+
+def per_column_summary(df, numeric_cols):
+    """
+    The original implementation: five pandas reductions per column.
+    """
+    def clean_val(val):
+        if pd.isna(val) or np.isinf(val):
+            return None
+        if isinstance(val, (np.integer, int)):
+            return int(val)
+        if isinstance(val, (np.floating, float)):
+            return float(val)
+        return val
+
+    stats = {}
+    for col in numeric_cols:
+        stats[col] = {
+            "mean": clean_val(round(df[col].mean(), 2)),
+            "median": clean_val(round(df[col].median(), 2)),
+            "max": clean_val(df[col].max()),
+            "min": clean_val(df[col].min()),
+            "std_dev": clean_val(round(df[col].std(), 2))
+        }
+    return stats
+
+
+def make_frame(rows, cols, seed=0):
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i in range(cols):
+        if i % 4 == 0:
+            data[f"int_{i}"] = rng.integers(0, 10_000, rows)
+        else:
+            column = rng.normal(100, 15, rows)
+            column[rng.random(rows) < 0.05] = np.nan
+            data[f"float_{i}"] = column
+    return pd.DataFrame(data)
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--cols", type=int, nargs="+", default=[10, 100, 500, 1000, 2000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'columns':>8} {'per-column (s)':>15} {'batched (s)':>12} {'speedup':>8}  match")
+    for cols in args.cols:
+        df = make_frame(args.rows, cols)
+        numeric_cols = df.columns
+        legacy = best_of(lambda: per_column_summary(df, numeric_cols), args.repeat)
+        batched = best_of(lambda: analyst.numeric_summary(df, numeric_cols), args.repeat)
+        match = per_column_summary(df, numeric_cols) == analyst.numeric_summary(df, numeric_cols)
+        print(f"{cols:>8} {legacy:>15.4f} {batched:>12.4f} {legacy / batched:>7.1f}x  {match}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Synthetic datasets for the benchmarks.
+
+Generates a DataFrame with a chosen number of rows and columns, mix of
+column kinds, missing-value ratio and categorical cardinality, and
+writes it as CSV, Excel, JSON or JSON-lines. The same arguments and seed
+always give the same file.
+
+Run from the backend folder:
+    python -m benchmarks.datagen --rows 100000 --cols 20 --mix numeric=3,categorical=2,datetime=1 -o data.csv
+"""
+import argparse
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+KINDS = ('numeric', 'integer', 'categorical', 'datetime', 'text', 'boolean')
+DEFAULT_MIX = {"numeric": 4, "integer": 2, "categorical": 2, "datetime": 1, "text": 1}
+FORMATS = ('csv', 'excel', 'json', 'jsonl')
+EXTENSIONS = {"csv": ".csv", "excel": ".xlsx", "json": ".json", "jsonl": ".jsonl"}
+
+
+def parse_mix(text):
+    """
+    "numeric=3,categorical=1" -> {"numeric": 3.0, "categorical": 1.0}
+    """
+    mix = {}
+    for part in filter(None, (p.strip() for p in text.split(','))):
+        kind, _, weight = part.partition('=')
+        if kind not in KINDS:
+            raise ValueError(f"Unknown column kind '{kind}'. Use one of {KINDS}.")
+        mix[kind] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise ValueError("The column mix needs at least one positive weight.")
+    return mix
+
+
+def column_kinds(cols, mix=None):
+    """
+    Assigns a kind to each of `cols` columns in proportion to the mix
+    weights (largest remainder), interleaved so every kind appears early.
+    """
+    mix = mix or DEFAULT_MIX
+    total = sum(mix.values())
+    exact = {kind: cols * weight / total for kind, weight in mix.items()}
+    counts = {kind: int(n) for kind, n in exact.items()}
+    for kind in sorted(exact, key=lambda k: exact[k] - counts[k], reverse=True)[:cols - sum(counts.values())]:
+        counts[kind] += 1
+
+    kinds = []
+    while len(kinds) < cols:
+        for kind in mix:
+            if counts[kind]:
+                kinds.append(kind)
+                counts[kind] -= 1
+    return kinds
+
+
+def _column(kind, rows, cardinality, rng):
+    if kind == 'numeric':
+        return rng.normal(100, 25, rows).round(3)
+    if kind == 'integer':
+        return rng.integers(0, 10_000, rows)
+    if kind == 'categorical':
+        labels = np.array([f"cat_{i}" for i in range(max(1, cardinality))], dtype=object)
+        # Zipf-like frequencies, as in real category columns
+        weights = 1 / np.arange(1, len(labels) + 1)
+        return labels[rng.choice(len(labels), rows, p=weights / weights.sum())]
+    if kind == 'datetime':
+        start = np.datetime64('2020-01-01')
+        days = rng.integers(0, 5 * 365, rows).astype('timedelta64[D]')
+        return np.datetime_as_string(start + days, unit='D').astype(object)
+    if kind == 'text':
+        return np.char.add('item-', rng.integers(0, max(rows, 1) * 10, rows).astype(str)).astype(object)
+    return rng.random(rows) < 0.5
+
+
+def make_dataset(rows, cols, mix=None, missing=0.05, cardinality=20, seed=0):
+    """
+    A DataFrame of `rows` x `cols` synthetic columns named after their
+    kind (e.g. "numeric_0", "categorical_3"). A `missing` share of the
+    cells in every column is blanked.
+    """
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i, kind in enumerate(column_kinds(cols, mix)):
+        values = _column(kind, rows, cardinality, rng)
+        if missing > 0:
+            blank = rng.random(rows) < missing
+            if blank.any():
+                values = values.astype('float64' if kind in ('numeric', 'integer') else object)
+                values[blank] = np.nan if kind in ('numeric', 'integer') else None
+        data[f"{kind}_{i}"] = values
+    return pd.DataFrame(data)
+
+
+def to_bytes(df, file_format):
+    """
+    Encodes a DataFrame the way a user would upload it.
+    """
+    if file_format == 'csv':
+        return df.to_csv(index=False).encode('utf-8')
+    if file_format == 'jsonl':
+        return df.to_json(orient='records', lines=True).encode('utf-8')
+    if file_format == 'json':
+        return df.to_json(orient='records').encode('utf-8')
+    if file_format == 'excel':
+        buffer = io.BytesIO()
+        df.to_excel(buffer, index=False)
+        return buffer.getvalue()
+    raise ValueError(f"Unknown format '{file_format}'. Use one of {FORMATS}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--cols", type=int, default=10)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help=f"kind=weight list; kinds: {', '.join(KINDS)}")
+    parser.add_argument("--missing", type=float, default=0.05, help="share of blank cells per column")
+    parser.add_argument("--cardinality", type=int, default=20, help="distinct values per categorical column")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", choices=FORMATS, help="defaults to the output file extension")
+    parser.add_argument("-o", "--output", required=True)
+    args = parser.parse_args()
+
+    file_format = args.format
+    if file_format is None:
+        ext = os.path.splitext(args.output)[1].lower()
+        file_format = next((f for f, e in EXTENSIONS.items() if e == ext or (f == 'excel' and ext == '.xls')), 'csv')
+
+    df = make_dataset(args.rows, args.cols, args.mix, args.missing, args.cardinality, args.seed)
+    with open(args.output, 'wb') as f:
+        f.write(to_bytes(df, file_format))
+    print(f"Wrote {args.rows} rows x {args.cols} columns ({file_format}) to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
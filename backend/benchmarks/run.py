@@ -0,0 +1,221 @@
+"""
+End-to-end pipeline benchmark on synthetic data.
+
+Times each stage of an upload: validate_file, load_data,
+determine_report_type, generate_summary_v2, chart_data and
+generate_plots (chart data plus PNG rendering). It also
+times the full /api/upload pipeline (with its hash, validate, analyze,
+plots and serialize stages), the same upload in fast mode
+(upload_sampled, without the refine job) and report generation against the fake LLM
+backend, so no API key or network is needed. Each stage is timed
+`--repeat` times on a fresh Dataset. The best and median times are
+reported, plus the peak memory of one extra run under tracemalloc.
+tracemalloc sees NumPy and Python allocations but not Arrow's memory
+pool.
+
+Results can be saved as JSON and compared with an earlier run. Any stage
+slower (or hungrier) than the baseline by more than --tolerance is
+reported, and the exit status is 1.
+
+Run from the backend folder:
+    python -m benchmarks.run --rows 10000 100000 --save benchmarks/baseline.json
+    python -m benchmarks.run --rows 10000 100000 --baseline benchmarks/baseline.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Deterministic, offline and cache-free before the server module reads its settings
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("FAKE_LLM_LATENCY", "0")
+os.environ.setdefault("LLM_CACHE_PATH", "")
+os.environ.setdefault("COLUMNAR_STORE_DIR", "")
+os.environ.setdefault("SESSION_SPILL_DIR", "")
+os.environ.setdefault("PLOT_WORKERS", "0")
+
+import numpy as np
+import pandas as pd
+from werkzeug.datastructures import FileStorage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks import datagen
+from src import analyst, brain, ingest, jobs, plot_store, plotter, writer
+
+# Differences below these are noise, never regressions
+MIN_SECONDS = 0.005
+MIN_BYTES = 1024 * 1024
+
+
+def upload(raw, filename):
+    return FileStorage(stream=io.BytesIO(raw), filename=filename)
+
+
+def pipeline_stages(raw, filename, plot_dir):
+    """
+    (name, fn) pairs; each fn does one timed unit of work from scratch.
+    """
+    import server
+    # Keep /api/upload's plot files out of the source tree
+    store = plot_store.PlotStore(plot_dir, gc_interval_seconds=0)
+    server.chart_store = store
+    # The drill-down index build would run in the background during timings
+    server._prepare_queries = lambda dataset: None
+    server.SAMPLE_REFINE = False
+
+    dataset = brain.validate_file(upload(raw, filename))[2]
+    df = dataset.df
+    stats = analyst.generate_summary_v2(ingest.Dataset(df, filename, dataset.format))
+
+    def fresh():
+        # A new Dataset has no cached profile, so profiling is timed too
+        return ingest.Dataset(df, filename, dataset.format)
+
+    def run_upload(fast=False):
+        # Every run analyses the file and renders its charts instead of
+        # reusing the cached response and stored plots
+        server.result_cache.clear()
+        store.clear()
+        job = jobs.Job('upload', server.UPLOAD_STAGES)
+        status, body = server.run_upload(upload(raw, filename), job, fast=fast)
+        if status != 200:
+            raise RuntimeError(json.loads(body).get("error"))
+        return {name: stage["seconds"] for name, stage in job.stages.items()}
+
+    return [
+        ("validate_file", lambda: brain.validate_file(upload(raw, filename))),
+        ("load_data", lambda: analyst.load_data(upload(raw, filename))),
+        ("determine_report_type", lambda: brain.determine_report_type(fresh())),
+        ("generate_summary_v2", lambda: analyst.generate_summary_v2(fresh())),
+        ("chart_data", lambda: plotter.chart_data(fresh())),
+        ("generate_plots", lambda: (store.clear(), plotter.generate_plots(fresh(), store))),
+        ("upload", run_upload),
+        ("upload_sampled", lambda: run_upload(fast=True)),
+        ("generate_narrative", lambda: writer.generate_narrative(stats, use_cache=False)),
+    ]
+
+
+def measure(fn, repeat, memory=True):
+    """
+    Best/median wall time over `repeat` runs, and the tracemalloc peak of
+    one more run. Returns (result dict, return value of the last run).
+    """
+    times = []
+    value = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = fn()
+        times.append(time.perf_counter() - start)
+    result = {"best": round(min(times), 4), "median": round(statistics.median(times), 4)}
+    if memory:
+        tracemalloc.start()
+        try:
+            fn()
+            result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result, value
+
+
+def run(args):
+    results = {}
+    with tempfile.TemporaryDirectory() as plot_dir:
+        for rows in args.rows:
+            df = datagen.make_dataset(rows, args.cols, args.mix, args.missing, args.cardinality, args.seed)
+            raw = datagen.to_bytes(df, args.format)
+            filename = f"bench{datagen.EXTENSIONS[args.format]}"
+            label = f"{args.format}:{rows}x{args.cols}"
+            print(f"\n{label} ({len(raw) / 1e6:.1f} MB)")
+            print(f"  {'stage':<28} {'best (s)':>9} {'median (s)':>11} {'peak MB':>9}")
+
+            dataset_results = results[label] = {}
+            for name, fn in pipeline_stages(raw, filename, plot_dir):
+                if args.stages and name not in args.stages:
+                    continue
+                result, value = measure(fn, args.repeat, memory=not args.no_memory)
+                dataset_results[name] = result
+                peak = f"{result['peak_bytes'] / 1e6:>9.1f}" if "peak_bytes" in result else f"{'-':>9}"
+                print(f"  {name:<28} {result['best']:>9.4f} {result['median']:>11.4f} {peak}")
+                if name.startswith('upload'):
+                    # Per-stage seconds of the last /api/upload run
+                    for stage, seconds in value.items():
+                        if seconds is not None:
+                            dataset_results[f"{name}.{stage}"] = {"best": seconds}
+                            print(f"    {stage:<26} {seconds:>9.4f}")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns a list of regressions (stage slower or using more memory than
+    the baseline by more than `tolerance`, beyond the noise floors).
+    """
+    regressions = []
+    for label, stages in results.items():
+        for name, current in stages.items():
+            before = baseline.get(label, {}).get(name)
+            if not before:
+                continue
+            for key, floor in (("best", MIN_SECONDS), ("peak_bytes", MIN_BYTES)):
+                if key not in current or key not in before:
+                    continue
+                old, new = before[key], current[key]
+                if new - old > floor and new > old * (1 + tolerance):
+                    regressions.append(f"{label} {name} {key}: {old} -> {new} ({new / old:.2f}x)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--cols", type=int, default=10)
+    parser.add_argument("--mix", type=datagen.parse_mix, default=datagen.DEFAULT_MIX)
+    parser.add_argument("--missing", type=float, default=0.05)
+    parser.add_argument("--cardinality", type=int, default=20)
+    parser.add_argument("--format", choices=datagen.FORMATS, default="csv")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--stages", nargs="+", help="only run these stages")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc run")
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="compare with results saved by --save")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown, e.g. 0.25 = 25%%")
+    args = parser.parse_args()
+
+    results = run(args)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                "environment": {
+                    "python": platform.python_version(),
+                    "pandas": pd.__version__,
+                    "numpy": np.__version__,
+                    "machine": platform.machine(),
+                    "cpus": os.cpu_count(),
+                },
+                "settings": {k: v for k, v in vars(args).items() if k not in ("save", "baseline")},
+                "results": results,
+            }, f, indent=2)
+        print(f"\nSaved results to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) against {args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions against {args.baseline} (tolerance {args.tolerance:.0%}).")
+
+
+if __name__ == "__main__":
+    main()
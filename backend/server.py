@@ -1,8 +1,16 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g, send_from_directory, abort
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from werkzeug.datastructures import FileStorage
 import pandas as pd
-from src import brain, analyst, writer
+from src import brain, analyst, writer, ingest, cache, jobs, llm, llm_cache, sessions, columnar, query, profiler, telemetry, serialize, plot_store, sampling, exporter
+import io
+import logging
 import os
+import json
+import shutil
+import tempfile
+import time
 from dotenv import load_dotenv
 
 # Load env variables
@@ -10,10 +18,162 @@ from dotenv import load_dotenv
 dotenv_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.env')
 load_dotenv(dotenv_path)
 
+# Level of the server's and pipeline's (src.*) log messages; other
+# libraries only log warnings. DEBUG shows per-stage detail.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+for name in ("server", "src"):
+    logging.getLogger(name).setLevel(LOG_LEVEL)
+logger = logging.getLogger("server")
+
+class JSONProvider(DefaultJSONProvider):
+    """
+    jsonify and request.get_json through src.serialize (orjson when
+    installed, NaN/NumPy/date handling built in).
+    """
+    def dumps(self, obj, **kwargs):
+        return serialize.dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return serialize.loads(s)
+
 app = Flask(__name__)
+app.json = JSONProvider(app)
 # Allow CORS for React app (usually runs on localhost:5173)
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
+# Upload responses keyed by content hash (see RESULT_CACHE_* env vars)
+result_cache = cache.from_env()
+
+# CSV/JSON-lines uploads larger than this are analysed in chunks
+STREAMING_THRESHOLD_BYTES = int(os.getenv("STREAMING_THRESHOLD_BYTES", 512 * 1024 * 1024))
+
+# Upload limits; 0 disables a limit. Oversized requests are refused with
+# 413 as soon as the limit is crossed instead of after the whole body.
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+UPLOAD_MAX_ROWS = int(os.getenv("UPLOAD_MAX_ROWS", 0))
+app.config['MAX_CONTENT_LENGTH'] = UPLOAD_MAX_BYTES or None
+
+# Convert parsed uploads to compact dtypes (categories, Arrow strings,
+# downcast numbers, parsed dates) before analysis
+OPTIMIZE_DTYPES = os.getenv("OPTIMIZE_DTYPES", "0").lower() in ("1", "true", "yes")
+
+# Uploads larger than this are first answered from a sample (fast mode),
+# with error bounds; 0 disables. ?fast=1 / ?fast=0 overrides it per
+# upload. Sample size and stratification: see SAMPLE_* env vars.
+SAMPLE_THRESHOLD_BYTES = int(os.getenv("SAMPLE_THRESHOLD_BYTES", 0))
+# Follow a sampled answer with the exact analysis in a background job
+SAMPLE_REFINE = os.getenv("SAMPLE_REFINE", "1").lower() in ("1", "true", "yes")
+
+# Background analysis/report jobs (see JOB_* env vars)
+job_manager = jobs.from_env()
+# Queued uploads are kept in memory up to this size, then spilled to a temp file
+SPOOL_MAX_MEMORY = 16 * 1024 * 1024
+
+# Parsed uploads saved as memory-mapped Arrow files by content hash, so
+# the same data is never parsed twice (see COLUMNAR_STORE_* env vars).
+# None when pyarrow is not installed.
+columnar_store = columnar.from_env()
+
+# Parsed datasets and stats of analysed uploads (see SESSION_* env vars)
+session_store = sessions.from_env(columnar_store)
+
+# Rendered charts, named by content hash and garbage collected (see
+# PLOT_STORE_* env vars). Served from /plots/ with long-lived cache headers.
+chart_store = plot_store.from_env()
+PLOT_URL_PATH = '/plots/'
+# 'data': uploads return chart series the frontend draws, and PNGs are
+# only rendered on request (GET /api/sessions/<id>/plots?format=png).
+# 'image': uploads render PNGs, as before.
+PLOT_MODE = os.getenv("PLOT_MODE", "data").lower()
+PLOT_MAX_AGE = 365 * 24 * 3600
+# Origin used in plot URLs, e.g. https://narrator.example.com. Defaults to
+# the host the request was sent to.
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip('/')
+
+# PDF/HTML exports of reports, rendered in a process pool and kept by
+# content hash (see EXPORT_* env vars). Served from /exports/.
+report_exporter = exporter.from_env()
+EXPORT_URL_PATH = '/exports/'
+
+# --- Telemetry ---
+
+# Scrapes and trace lookups are not traced themselves
+UNTRACED_ENDPOINTS = ('metrics', 'traces', 'static', 'plot_file', 'export_file')
+
+telemetry.REGISTRY.gauge("datanarrator_session_memory_bytes", "Memory held by session DataFrames.",
+                         fn=lambda: session_store.stats()["memory_bytes"])
+telemetry.REGISTRY.gauge("datanarrator_sessions", "Live upload sessions.",
+                         fn=lambda: session_store.stats()["sessions"])
+telemetry.REGISTRY.gauge("datanarrator_jobs_queued", "Background jobs waiting for a worker.",
+                         fn=lambda: job_manager.stats()["queued"])
+telemetry.REGISTRY.gauge("datanarrator_jobs_running", "Background jobs running.",
+                         fn=lambda: job_manager.stats()["running"])
+telemetry.REGISTRY.gauge("datanarrator_result_cache_bytes", "Memory used by cached upload responses.",
+                         fn=lambda: result_cache.stats()["bytes"])
+
+def _endpoint_label():
+    # The route pattern, not the path, so ids do not explode label cardinality
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+@app.before_request
+def start_request_trace():
+    if request.endpoint not in UNTRACED_ENDPOINTS:
+        g.trace = telemetry.start_trace(f"{request.method} {_endpoint_label()}")
+
+@app.after_request
+def tag_request_trace(response):
+    trace = telemetry.current_trace()
+    if trace is not None:
+        g.status = response.status_code
+        response.headers['X-Trace-Id'] = trace.id
+    return response
+
+def _finish_request_trace(token, status):
+    trace = telemetry.end_trace(token, status)
+    endpoint = _endpoint_label()
+    telemetry.REQUEST_SECONDS.observe(trace.seconds, method=request.method, endpoint=endpoint, status=status)
+    if trace.memory_growth is not None:
+        telemetry.REQUEST_MEMORY.observe(trace.memory_growth, endpoint=endpoint)
+
+@app.teardown_request
+def end_request_trace(exc):
+    token = g.pop('trace', None)
+    if token is not None:
+        _finish_request_trace(token, 500 if exc is not None else g.get('status', 500))
+
+# --- Response compression ---
+
+@app.after_request
+def compress_response(response):
+    """
+    Gzip (or brotli, when installed) for JSON and text bodies the client
+    accepts compressed. Files and streamed responses are sent as is.
+    """
+    if (response.direct_passthrough or response.is_streamed or response.status_code in (204, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in serialize.COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = serialize.choose_encoding(request.accept_encodings)
+    data = response.get_data()
+    if encoding is None or len(data) < serialize.COMPRESSION_MIN_BYTES:
+        return response
+    with telemetry.span("compress", encoding=encoding):
+        response.set_data(serialize.compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(telemetry.REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/traces', methods=['GET'])
+def traces():
+    limit = request.args.get('limit', 20, type=int)
+    min_seconds = request.args.get('min_seconds', 0, type=float)
+    return jsonify(telemetry.recent_traces(limit, min_seconds))
+
 @app.route('/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "ok", "message": "Backend is running"})
@@ -23,75 +183,519 @@ def index():
     return "<h1>Backend is active! 🚀</h1><p>This is the API server. Please open the Frontend at <a href='http://localhost:5173'>http://localhost:5173</a> to use the app.</p>"
 
 
-@app.route('/api/upload', methods=['POST'])
-def upload_file():
-    if 'file' not in request.files:
-        return jsonify({"error": "No file part"}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({"error": "No selected file"}), 400
+UPLOAD_STAGES = ('hash', 'validate', 'analyze', 'plots', 'serialize')
+REFINE_STAGES = ('analyze', 'plots', 'serialize')
+
+def run_upload(file, job=None, fast=None, stratify=None):
+    """
+    The upload pipeline shared by /api/upload and background upload jobs.
+    With fast (by default for uploads over SAMPLE_THRESHOLD_BYTES, or
+    when stratify names a column) the stats and charts come from a
+    sample, stratified by that column if given, and a background job
+    computes the exact results afterwards (see SAMPLE_REFINE).
+    Returns (status_code, JSON text).
+    """
+    # 0. Repeat uploads are answered from the content-addressed cache
+    with jobs.stage(job, 'hash'):
+        digest = ingest.hash_file(file)
+        cache_key = f"{digest}:{ingest.detect_format(file.filename)}"
+        if fast is None:
+            fast = bool(stratify) or bool(SAMPLE_THRESHOLD_BYTES) and ingest.file_size(file) > SAMPLE_THRESHOLD_BYTES
+        # Exact results are preferred; sampled ones are cached apart
+        for key in (cache_key, f"{cache_key}:sample") if fast else (cache_key,):
+            cached = result_cache.get(key)
+            body = _cached_upload(cached, digest, file.filename) if cached is not None else None
+            if body is not None:
+                if job is not None:
+                    job.skip_pending()
+                return 200, body
 
     # 1. Validation (Brain)
-    # 1. Validation (Brain)
-    is_valid, message = brain.validate_file(file)
+    # Huge files are only parsed up to the first chunk here; the full
+    # file is then summarised out-of-core. Sampled uploads only parse
+    # the leading rows for validation and the preview.
+    with jobs.stage(job, 'validate'):
+        # Content parsed before is memory-mapped from the columnar store
+        dataset = columnar_store.load_dataset(digest, file.filename) if columnar_store is not None else None
+        if dataset is not None:
+            chunked, is_valid = False, True
+        else:
+            chunked = ingest.can_stream(file) and (fast or ingest.file_size(file) > STREAMING_THRESHOLD_BYTES)
+            head_rows = (sampling.HEAD_ROWS if fast else ingest.DEFAULT_CHUNK_SIZE) if chunked else None
+            is_valid, message, dataset = brain.validate_file(file, head_rows=head_rows)
     if not is_valid:
-        return jsonify({"error": message}), 400
+        return 400, app.json.dumps({"error": message})
+    if UPLOAD_MAX_ROWS and not chunked and len(dataset.df) > UPLOAD_MAX_ROWS:
+        return 413, app.json.dumps({"error": f"Upload exceeds the {UPLOAD_MAX_ROWS} row limit."})
+    if stratify and stratify not in dataset.df.columns:
+        return 400, app.json.dumps({"error": f"Cannot stratify by '{stratify}': no such column."})
+    dataset.digest = digest
 
-    # 2. Ingestion & Analysis (Analyst)
+    # 2. Analysis (Analyst) on the already parsed dataset
     try:
-        df = analyst.load_data(file)
-        stats = analyst.generate_summary_v2(df)
-        
-        # Determine preview (first 5 rows)
-        preview = df.head().to_dict(orient='records')
-        
-        # 3. Static Plot Generation (Plotter)
+        with jobs.stage(job, 'analyze'):
+            memory = None
+            sampled = _draw_sample(file, dataset, chunked, stratify) if fast else None
+            if sampled is not None and sampled.sample is None:
+                # The sample held every row; analyse them as usual
+                dataset, chunked, sampled = sampled, False, None
+            if sampled is not None:
+                stats = analyst.generate_summary_sampled(sampled)
+            elif chunked:
+                stats = analyst.generate_summary_chunked(file)
+            else:
+                if OPTIMIZE_DTYPES:
+                    _, memory = analyst.optimize_dtypes(dataset)
+                stats = analyst.generate_summary_v2(dataset)
+
+        if sampled is not None:
+            refine = None
+            if SAMPLE_REFINE:
+                upload = _keep_upload(file) if chunked else None
+                refine = lambda session_id: _refine(dataset, sampled, upload, cache_key, session_id)
+            return _finish_upload(dataset, stats, f"{cache_key}:sample", "sampled", keep_data=not chunked,
+                                  job=job, charted=sampled, refine=refine)
+        return _finish_upload(dataset, stats, cache_key, "chunked" if chunked else "in_memory",
+                              keep_data=not chunked, job=job, memory=memory)
+    except jobs.JobCancelled:
+        raise
+    except Exception as e:
+        logger.exception(f"Upload failed: {e}")
+        return 500, app.json.dumps({"error": f"Error processing file: {str(e)}"})
+
+def _draw_sample(file, dataset, chunked, stratify):
+    """
+    A Dataset of sampled rows (with .sample set) for a fast-mode upload.
+    dataset is what validation parsed: the whole upload, or only its
+    leading rows when chunked. Unstratified CSV/JSON-lines files are
+    sampled by seeking to random blocks, so the time taken does not grow
+    with the file; otherwise rows are sampled while the file is parsed
+    in chunks. If the sample holds every row, they are returned as a
+    plain Dataset instead.
+    """
+    if not chunked:
+        sample = sampling.sample_frame(dataset.df, stratify=stratify)
+    else:
+        sample = sampling.sample_blocks(file) if not stratify else None
+        if sample is None:
+            try:
+                sample = sampling.sample_chunks(ingest.iter_chunks(file), stratify=stratify)
+            finally:
+                file.seek(0)
+    if sample.complete and not chunked:
+        return dataset
+    sampled = ingest.Dataset(sample.df, dataset.filename, dataset.format, dataset.encoding)
+    sampled.digest = dataset.digest
+    if not sample.complete:
+        sampled.sample = sample
+    logger.info(f"Sampled {sample.rows} of {sample.population_rows} rows ({sample.method})")
+    return sampled
+
+def _keep_upload(file):
+    """
+    A FileStorage over the same bytes as file that stays readable after
+    the request (or upload job) has closed it, for the refine job. Uploads
+    spooled to disk are shared through a duplicated file descriptor
+    instead of being copied.
+    """
+    try:
+        stream = os.fdopen(os.dup(file.stream.fileno()), 'rb')
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        stream = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+        file.seek(0)
+        shutil.copyfileobj(file.stream, stream)
+    stream.seek(0)
+    return FileStorage(stream=stream, filename=file.filename)
+
+def _refine(head, sampled, upload, cache_key, session_id):
+    """
+    Queues the exact analysis that follows a sampled upload. head is the
+    Dataset validation parsed: the whole upload, or only its leading rows
+    when upload (see _keep_upload) has to be read again. The exact stats
+    and charts replace the session's and are cached for later uploads of
+    the same content; the job's result is the exact upload response.
+    Returns the Job, or None if the queue is full.
+    """
+    def work(job):
+        try:
+            dataset, keep_data, charted, memory = head, True, None, None
+            with job.stage('analyze'):
+                if upload is None:
+                    stats = analyst.generate_summary_v2(dataset)
+                elif ingest.file_size(upload) > STREAMING_THRESHOLD_BYTES:
+                    # Too big to keep; the charts stay those of the sample
+                    stats = analyst.generate_summary_chunked(upload)
+                    keep_data, charted = False, sampled
+                else:
+                    is_valid, message, dataset = brain.validate_file(upload)
+                    if not is_valid:
+                        raise RuntimeError(message)
+                    dataset.digest = head.digest
+                    if OPTIMIZE_DTYPES:
+                        _, memory = analyst.optimize_dtypes(dataset)
+                    stats = analyst.generate_summary_v2(dataset)
+            with app.app_context():
+                status, body = _finish_upload(dataset, stats, cache_key, "in_memory" if keep_data else "chunked",
+                                              keep_data, job=job, memory=memory, charted=charted,
+                                              session_id=session_id)
+            return body
+        finally:
+            if upload is not None:
+                upload.close()
+
+    weight = ingest.file_size(upload) if upload is not None else int(head.df.memory_usage(index=False).sum())
+    try:
+        return job_manager.submit('refine', work, REFINE_STAGES, weight=weight)
+    except RuntimeError:
+        logger.warning("Job queue full, sampled upload will not be refined")
+        if upload is not None:
+            upload.close()
+        return None
+
+def _charts_stored(response):
+    """
+    True if every chart file of a cached upload response (JSON text or
+    dict) is still in the chart store.
+    """
+    if isinstance(response, (str, bytes)):
+        response = serialize.loads(response)
+    return all(chart_store.exists(p["file"]) for p in response.get("plots") or [] if "file" in p)
+
+def _cached_upload(cached, digest, filename):
+    """
+    Response for an upload answered from the result cache, with a new
+    session of its own. The session shares the parsed data of live
+    sessions of the same content, if any; generate and chat only need
+    the stats. None if any of its charts has been garbage collected
+    since; the upload is then analysed again.
+    """
+    response = serialize.loads(cached)
+    if not _charts_stored(response):
+        return None
+    session = session_store.create(None, response.get("stats"), response.get("plots"),
+                                   response.get("report_type"), digest=digest, filename=filename)
+    return _with_session(cached, session.id)
+
+def _finish_upload(dataset, stats, cache_key, analysis_mode, keep_data, job=None, memory=None,
+                   charted=None, session_id=None, refine=None):
+    """
+    Plots, serialisation, caching and the session for an analysed upload.
+    With keep_data False, dataset only holds the leading rows (used for
+    the preview and plots) and the session keeps just the stats.
+    memory is the optimize_dtypes report, if that ran. charted is the
+    Dataset to chart when it is not dataset (sampled rows). With
+    session_id, that session gets the results instead of a new one (exact
+    results following a sampled answer). refine(session_id) may start a
+    job whose id is added to the response.
+    Returns (status_code, JSON text).
+    """
+    if "error" in stats:
+        # A failed analysis must not be cached as the answer for this content
+        raise RuntimeError(f"Analysis failed: {stats['error']}")
+    digest = dataset.digest
+    # Determine preview (first 5 rows)
+    # Dates parsed by optimize_dtypes are shown as uploaded
+    preview = serialize.preview(profiler.restore_frame(dataset.df.head(5), profiler.get_profile(dataset)))
+    report_type = brain.determine_report_type(dataset)
+
+    # 3. Charts (Plotter): JSON series, or rendered PNGs in image mode
+    with jobs.stage(job, 'plots'):
         from src import plotter
-        static_folder = os.path.join(app.root_path, 'static', 'plots')
-        plot_objects = plotter.generate_plots(df, static_folder)
-        # Convert filenames to URLs (and keep metadata)
-        plot_urls = []
-        for p in plot_objects:
-            p['url'] = f"http://127.0.0.1:5000/static/plots/{p['file']}"
-            plot_urls.append(p)
-        
-        # Robust Recursive Serialization Helper
-        import numpy as np
-        def safe_cleanup(obj):
-            if isinstance(obj, dict):
-                return {k: safe_cleanup(v) for k, v in obj.items()}
-            if isinstance(obj, list):
-                return [safe_cleanup(i) for i in obj]
-            if isinstance(obj, (np.integer, int)):
-                return int(obj)
-            if isinstance(obj, (np.floating, float)):
-                if np.isnan(obj) or np.isinf(obj):
-                    return None
-                return float(obj)
-            if pd.isna(obj): # Handle pandas NaT/NaN
-                return None
-            return obj
+        charted = charted if charted is not None else dataset
+        if PLOT_MODE == 'image':
+            plots = _with_urls(plotter.generate_plots(charted, chart_store))
+        else:
+            plots = plotter.chart_data(charted)
 
+    with jobs.stage(job, 'serialize'), telemetry.span("serialize"):
         response_data = {
             "message": "File analyzed successfully",
-            "stats": safe_cleanup(stats),
-            "report_type": brain.determine_report_type(df),
-            "preview": safe_cleanup(preview),
-            "plots": plot_urls
+            "stats": serialize.clean(stats),
+            "report_type": report_type,
+            "preview": preview,
+            "plots": plots,
+            "analysis_mode": analysis_mode
         }
+        if memory is not None:
+            response_data["memory"] = memory
+
+        body = result_cache.put(cache_key, app.json.dumps(response_data))
+        # Sampled answers leave the full copy to the refine job
+        if columnar_store is not None and keep_data and analysis_mode != "sampled":
+            # Parsed date columns are written back as text; other dtypes from
+            # optimize_dtypes (categories, Arrow strings, downcasts) are kept
+            columnar_store.write(digest, profiler.restore_frame(dataset.df, profiler.get_profile(dataset)))
+
+    # Keep the parsed data server-side so generate/chat and drill-downs
+    # can work from a session id. Chunked analysis only parsed the first
+    # chunk, so no DataFrame is kept for it.
+    session = None
+    if session_id is not None:
+        session = session_store.update(session_id, response_data["stats"], plots, dataset if keep_data else None)
+    if session is None:
+        session = session_store.create(dataset if keep_data else None, response_data["stats"], plots,
+                                       report_type, digest=digest, filename=dataset.filename)
+    if keep_data:
+        _prepare_queries(dataset)
+    refine_job = refine(session.id) if refine is not None else None
+    return 200, _with_session(body, session.id, refine_job)
+
+def _prepare_queries(dataset):
+    """
+    Builds the drill-down indexes for a new session in the background, so
+    the first /api/query does not pay for encoding the categorical columns.
+    """
+    try:
+        job_manager.submit('index', lambda job: query.get_engine(dataset, build_indexes=True).stats())
+    except RuntimeError:
+        pass # Queue full; indexes are built on the first query instead
+
+def _with_session(body, session_id, refine_job=None):
+    """
+    Adds session_id (and the id of a refine job, if any) to an encoded
+    upload response. Cached bodies are shared by every upload of the same
+    content, so the ids are spliced into the JSON object text rather than
+    stored in the cache.
+    """
+    fields = f'"session_id": {json.dumps(session_id)}, '
+    if refine_job is not None:
+        fields += f'"refine_job_id": {json.dumps(refine_job.id)}, '
+    return f'{{{fields}{body.lstrip()[1:]}'
+
+def _with_urls(plots):
+    """
+    Adds host-relative URLs to rendered plots, so cached responses can be
+    shared; they are made absolute per request by _public_urls.
+    """
+    for p in plots:
+        p['url'] = f"{PLOT_URL_PATH}{p['file']}"
+    return plots
+
+def _public_urls(body):
+    """
+    Makes the plot and export URLs in an encoded response absolute, with
+    PUBLIC_BASE_URL or the origin of the current request.
+    """
+    base = PUBLIC_BASE_URL or request.host_url.rstrip('/')
+    for path in (PLOT_URL_PATH, EXPORT_URL_PATH):
+        body = body.replace(f'"url":"{path}', f'"url":"{base}{path}')
+    return body
+
+def _request_stats(data):
+    """
+    Stats for a generate/chat request: from the session named by
+    session_id, else as posted in the body (older clients).
+    Returns (stats, error response).
+    """
+    session_id = data.get('session_id')
+    if session_id:
+        session = session_store.get(session_id)
+        if session is None:
+            return None, (jsonify({"error": "Unknown or expired session. Please upload the file again."}), 404)
+        return session.stats, None
+    return data.get('stats'), None
+
+def _get_upload():
+    """
+    Returns (file, None) for a valid multipart upload, else (None, error response).
+    """
+    if 'file' not in request.files:
+        return None, (jsonify({"error": "No file part"}), 400)
+
+    file = request.files['file']
+    if file.filename == '':
+        return None, (jsonify({"error": "No selected file"}), 400)
+    return file, None
+
+def _upload_options():
+    """
+    run_upload's fast and stratify arguments from the query string:
+    ?fast=1 or ?fast=0 (else SAMPLE_THRESHOLD_BYTES decides) and
+    ?stratify=<column>.
+    """
+    fast = request.args.get('fast')
+    if fast is not None:
+        fast = fast.lower() in ('1', 'true', 'yes')
+    return fast, request.args.get('stratify') or None
+
+@app.route('/api/upload', methods=['POST'])
+def upload_file():
+    file, error = _get_upload()
+    if error:
+        return error
+
+    fast, stratify = _upload_options()
+    status, body = run_upload(file, fast=fast, stratify=stratify)
+    return app.response_class(_public_urls(body), status=status, mimetype='application/json')
+
+@app.route('/api/upload/stream', methods=['POST'])
+def upload_stream():
+    """
+    Upload of a raw CSV or JSON-lines request body (not multipart), named
+    by ?filename= or the X-Filename header. The body is parsed and
+    summarised while it arrives, so the response is ready soon after the
+    last byte, and memory does not grow with the upload size.
+    A client that sends the body's SHA-256 (X-Content-SHA256 header or
+    ?sha256=) gets a repeat upload answered from the result cache: the
+    body is then only hashed to confirm it, not parsed.
+    """
+    filename = request.args.get('filename') or request.headers.get('X-Filename')
+    claimed = (request.headers.get('X-Content-SHA256') or request.args.get('sha256') or '').lower()
+    file_format = ingest.detect_format(filename)
+    if file_format not in ('csv', 'jsonl'):
+        return jsonify({"error": "Streaming uploads must be CSV or JSON-lines. Pass the name as ?filename=."}), 400
+    if UPLOAD_MAX_BYTES and (request.content_length or 0) > UPLOAD_MAX_BYTES:
+        return jsonify({"error": f"Upload exceeds the {UPLOAD_MAX_BYTES} byte limit."}), 413
 
-        return jsonify(response_data)
+    start = time.perf_counter()
+    upload = ingest.UploadStream(request.stream, UPLOAD_MAX_BYTES)
+    # Exact stats from an earlier /api/upload take precedence; stats
+    # computed here use sketches for medians, so they are cached apart
+    cache_keys = lambda digest: (f"{digest}:{file_format}", f"{digest}:{file_format}:stream")
+
+    if claimed:
+        cached = next((c for c in map(result_cache.get, cache_keys(claimed)) if c is not None), None)
+        if cached is not None and _charts_stored(cached):
+            try:
+                upload.drain()
+            except ingest.UploadTooLarge as e:
+                return jsonify({"error": str(e)}), 413
+            if upload.hexdigest() != claimed:
+                return jsonify({"error": "The body does not match its X-Content-SHA256 hash."}), 400
+            body = _cached_upload(cached, claimed, filename)
+            if body is None: # Charts collected since the check; the body is gone
+                return jsonify({"error": "The cached result expired. Please upload the file again."}), 409
+            logger.info(f"Repeat upload of '{filename}' answered from cache in {time.perf_counter() - start:.2f}s")
+            return app.response_class(_public_urls(body), mimetype='application/json')
+
+    try:
+        chunks = ingest.iter_stream_chunks(upload, file_format, max_rows=UPLOAD_MAX_ROWS)
+        stats, df, complete = analyst.generate_summary_stream(chunks, keep_bytes=STREAMING_THRESHOLD_BYTES)
+        upload.drain()
+    except ingest.UploadTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    except pd.errors.EmptyDataError:
+        return jsonify({"error": "File is empty."}), 400
+    except ValueError as e: # Parser errors, undecodable JSON
+        logger.warning(f"Streaming upload failed: {e}")
+        return jsonify({"error": f"Could not parse '{filename}': {e}"}), 400
     except Exception as e:
-        print(f"DEBUG: Upload Error: {e}") # DEBUG
-        import traceback
-        traceback.print_exc()
+        logger.warning(f"Streaming upload failed: {e}")
         return jsonify({"error": f"Error processing file: {str(e)}"}), 500
+    logger.info(f"Streamed {upload.bytes_read} bytes of '{filename}' in {time.perf_counter() - start:.2f}s")
+
+    digest = upload.hexdigest()
+    for key in cache_keys(digest):
+        cached = result_cache.get(key)
+        body = _cached_upload(cached, digest, filename) if cached is not None else None
+        if body is not None:
+            return app.response_class(_public_urls(body), mimetype='application/json')
+    cache_key = f"{digest}:{file_format}"
+
+    if df.empty:
+        return jsonify({"error": "File is empty."}), 400
+    dataset = ingest.Dataset(df, filename, file_format)
+    dataset.digest = digest
+    try:
+        memory = None
+        if OPTIMIZE_DTYPES and complete:
+            _, memory = analyst.optimize_dtypes(dataset)
+        status, body = _finish_upload(dataset, stats, f"{cache_key}:stream", "streamed",
+                                      keep_data=complete, memory=memory)
+    except Exception as e:
+        logger.exception(f"Upload failed: {e}")
+        return jsonify({"error": f"Error processing file: {str(e)}"}), 500
+    return app.response_class(_public_urls(body), status=status, mimetype='application/json')
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({"error": f"Upload exceeds the {UPLOAD_MAX_BYTES} byte limit."}), 413
+
+@app.route(f'{PLOT_URL_PATH}<name>', methods=['GET'])
+def plot_file(name):
+    """
+    A stored chart. Names are content hashes, so a name always refers to
+    the same image: the name is the ETag and browsers and proxies may
+    cache the file for good.
+    """
+    if name.startswith('.'): # Renders in progress
+        abort(404)
+    response = send_from_directory(chart_store.directory, name, max_age=PLOT_MAX_AGE, etag=False, conditional=False)
+    response.set_etag(name)
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+@app.route('/api/sessions/<session_id>/plots', methods=['GET'])
+def session_plots(session_id):
+    """
+    The session's charts. With ?format=png they are rendered to PNG
+    files (or reused from the chart store) and returned with URLs.
+    """
+    session = session_store.get(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown or expired session"}), 404
+    plots = session.plots
+    if request.args.get('format') == 'png':
+        plots = _rendered_plots(plots)
+    body = app.json.dumps({"session_id": session_id, "plots": plots})
+    return app.response_class(_public_urls(body), mimetype='application/json')
+
+def _rendered_plots(plots):
+    """
+    plots as PNG files in the chart store, with URLs. Image-mode plots
+    are already files; chart data is rendered (or reused).
+    """
+    from src import plotter
+    images = [p for p in plots if "file" in p and chart_store.exists(p["file"])]
+    charts = [p for p in plots if "file" not in p]
+    return images + _with_urls(plotter.render_charts(charts, chart_store))
+
+@app.route('/api/plots/stats', methods=['GET'])
+def plot_stats():
+    return jsonify(chart_store.stats())
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+@app.route('/api/sessions', methods=['GET'])
+def session_stats():
+    stats = session_store.stats()
+    stats["columnar_store"] = columnar_store.stats() if columnar_store is not None else None
+    return jsonify(stats)
+
+@app.route('/api/sessions/<session_id>', methods=['GET'])
+def session_info(session_id):
+    session = session_store.get(session_id)
+    if session is None:
+        return jsonify({"error": "Unknown or expired session"}), 404
+    return jsonify(session.to_dict())
+
+@app.route('/api/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    if not session_store.delete(session_id):
+        return jsonify({"error": "Unknown or expired session"}), 404
+    return jsonify({"session_id": session_id, "deleted": True})
+
+@app.route('/api/llm/stats', methods=['GET'])
+def llm_stats():
+    """
+    Per-model call counts, latency and circuit breaker state, plus LLM
+    response cache counters.
+    """
+    response_cache = llm_cache.get_cache()
+    try:
+        models = llm.get_router().stats()
+    except llm.MissingAPIKey as e:
+        models = {"error": str(e)}
+    return jsonify({"models": models, "cache": response_cache.stats() if response_cache else None})
 
 @app.route('/api/generate', methods=['POST'])
 def generate_report():
     data = request.json
-    stats = data.get('stats')
+    stats, error = _request_stats(data)
+    if error:
+        return error
     instruction = data.get('instruction', '')
     
     if not stats:
@@ -99,30 +703,367 @@ def generate_report():
 
     # 3. Narrative Generation (Writer)
     try:
-        print(f"--> RECEIVED /api/generate request. Stats keys: {list(stats.keys())}") # DEBUG
-        report = writer.generate_narrative(stats, instruction)
-        print(f"<-- REPORT GENERATED. Length: {len(report)}") # DEBUG
+        logger.debug(f"Generating report, stats keys: {list(stats.keys())}")
+        report = writer.generate_narrative(stats, instruction, use_cache=data.get('cache', True))
+        logger.info(f"Report generated ({len(report)} characters)")
         return jsonify({"report": report})
     except Exception as e:
-        print(f"!!! SERVER ERROR in /api/generate: {e}") # DEBUG
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Report generation failed: {e}")
         return jsonify({"error": f"Error generating report: {str(e)}"}), 500
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
     data = request.json
-    stats = data.get('stats')
+    stats, error = _request_stats(data)
+    if error:
+        return error
     history = data.get('history', [])
     
     if not stats:
         return jsonify({"error": "No dataframe stats context"}), 400
         
     try:
-        response_text = writer.chat_with_data(history, stats)
+        response_text = writer.chat_with_data(history, stats, use_cache=data.get('cache', True))
         return jsonify({"response": response_text})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# --- Streaming (Server-Sent Events) ---
+
+def _sse(data, event=None):
+    """
+    Formats one Server-Sent Events message.
+    """
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {app.json.dumps(data)}\n\n"
+
+def _stream_events(events, label):
+    """
+    Relays writer stream events as SSE. A client disconnect closes this
+    generator, which closes the upstream model stream with it.
+    """
+    start = time.monotonic()
+    first_token = None
+    try:
+        for event in events:
+            if event["type"] == "token" and first_token is None:
+                first_token = time.monotonic() - start
+                logger.debug(f"{label} first token after {first_token:.3f}s")
+            if event["type"] == "done":
+                event = dict(event, ttft=None if first_token is None else round(first_token, 3),
+                             seconds=round(time.monotonic() - start, 3))
+            yield _sse(event, event=event["type"])
+    except GeneratorExit:
+        logger.info(f"{label} client disconnected after {time.monotonic() - start:.3f}s")
+        events.close()
+        raise
+    except Exception as e:
+        logger.exception(f"{label} stream failed: {e}")
+        yield _sse({"type": "error", "message": str(e)}, event="error")
+
+def _traced_stream(body):
+    """
+    Keeps the request trace open until a streamed body has been sent.
+    Flask tears the request down as soon as the view returns.
+    """
+    token = g.pop('trace', None)
+    if token is None:
+        return body
+
+    def traced():
+        status = 200
+        try:
+            with telemetry.attach(token[0]):
+                yield from body
+        except GeneratorExit:
+            status = 499 # Client disconnected
+            raise
+        finally:
+            _finish_request_trace(token, status)
+    return traced()
+
+def _sse_response(events, label):
+    return Response(stream_with_context(_traced_stream(_stream_events(events, label))), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/api/generate/stream', methods=['POST'])
+def generate_report_stream():
+    """
+    Like /api/generate, but streams the report as it is written.
+    Events: model (which model answered, time to first token), token
+    (append text), reset (discard text so far, another model takes over),
+    done, error.
+    """
+    data = request.json
+    stats, error = _request_stats(data)
+    if error:
+        return error
+    instruction = data.get('instruction', '')
+
+    if not stats:
+        return jsonify({"error": "No statistics provided"}), 400
+
+    return _sse_response(writer.stream_narrative(stats, instruction, use_cache=data.get('cache', True)),
+                         "/api/generate/stream")
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Like /api/chat, but streams the reply (same events as /api/generate/stream).
+    """
+    data = request.json
+    stats, error = _request_stats(data)
+    if error:
+        return error
+    history = data.get('history', [])
+
+    if not stats:
+        return jsonify({"error": "No dataframe stats context"}), 400
+
+    return _sse_response(writer.stream_chat(history, stats, use_cache=data.get('cache', True)),
+                         "/api/chat/stream")
+
+# --- Export ---
+
+def _export_request(data):
+    """
+    (format, report, title, plots) for an export request, or
+    (None, error response). The charts come from the session named by
+    session_id, if any.
+    """
+    report = data.get('report')
+    if not isinstance(report, str) or not report.strip():
+        return None, (jsonify({"error": "No report provided"}), 400)
+    fmt = str(data.get('format', 'pdf')).lower()
+    if fmt not in exporter.FORMATS:
+        return None, (jsonify({"error": f"Unsupported export format '{fmt}'. Available: {', '.join(exporter.FORMATS)}."}), 400)
+
+    plots, title = [], None
+    session_id = data.get('session_id')
+    if session_id:
+        session = session_store.get(session_id)
+        if session is None:
+            return None, (jsonify({"error": "Unknown or expired session"}), 404)
+        plots = session.plots
+        title = f"{session.filename} Report" if session.filename else None
+    title = data.get('title') or title or "DataNarrator Report"
+    return (fmt, report, title, plots), None
+
+def _run_export(fmt, report, title, plots):
+    """
+    Renders (or reuses) an export, with the charts as PNGs from the chart
+    store. Returns (status_code, JSON text).
+    """
+    try:
+        images = [(p["title"], chart_store.path(p["file"])) for p in _rendered_plots(plots)]
+        name, cached = report_exporter.export(fmt, report, title, images)
+    except TimeoutError as e:
+        return 504, app.json.dumps({"error": str(e)})
+    except Exception as e:
+        logger.exception(f"Export failed: {e}")
+        return 500, app.json.dumps({"error": f"Error exporting report: {str(e)}"})
+    return 200, app.json.dumps({"format": fmt, "file": name, "url": f"{EXPORT_URL_PATH}{name}", "cached": cached})
+
+@app.route('/api/export', methods=['POST'])
+def export_report():
+    """
+    Renders a generated report and its session's charts as a PDF or HTML
+    document and returns its URL. The rendering runs in the exporter's
+    process pool; see /api/jobs/export to not wait for it.
+    """
+    request_args, error = _export_request(request.json or {})
+    if error:
+        return error
+    status, body = _run_export(*request_args)
+    return app.response_class(_public_urls(body), status=status, mimetype='application/json')
+
+@app.route(f'{EXPORT_URL_PATH}<name>', methods=['GET'])
+def export_file(name):
+    """
+    Serves an exported document. Names are content hashes, so documents
+    never change and are cached like the charts.
+    """
+    if name.startswith('.'): # Renders in progress
+        abort(404)
+    fmt = name.rsplit('.', 1)[-1]
+    response = send_from_directory(report_exporter.store.directory, name, max_age=PLOT_MAX_AGE, etag=False,
+                                   conditional=False, mimetype=exporter.MIMETYPES.get(fmt),
+                                   as_attachment=True, download_name=f"report.{fmt}")
+    response.set_etag(name)
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+@app.route('/api/export/stats', methods=['GET'])
+def export_stats():
+    return jsonify(report_exporter.stats())
+
+# --- Drill-down queries ---
+
+@app.route('/api/query', methods=['POST'])
+def run_query():
+    data = request.json or {}
+    session_id = data.get('session_id')
+    if not session_id:
+        return jsonify({"error": "session_id is required"}), 400
+    if session_store.get(session_id) is None:
+        return jsonify({"error": "Unknown or expired session. Please upload the file again."}), 404
+
+    try:
+        columns = query.referenced_columns(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # Data that is no longer in memory is read back for these columns only
+    dataset = session_store.dataset(session_id, columns=columns)
+    if dataset is None:
+        return jsonify({"error": "The data for this session is no longer available. Please upload the file again."}), 409
+
+    try:
+        result = query.get_engine(dataset).run(data)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result)
+
+@app.route('/api/sessions/<session_id>/query/stats', methods=['GET'])
+def query_stats(session_id):
+    dataset = session_store.dataset(session_id)
+    if dataset is None:
+        return jsonify({"error": "Unknown session or no data available"}), 404
+    return jsonify(query.get_engine(dataset).stats())
+
+# --- Background jobs ---
+
+def _job_accepted(job):
+    return jsonify({
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.id}",
+        "events_url": f"/api/jobs/{job.id}/events",
+        "result_url": f"/api/jobs/{job.id}/result"
+    }), 202
+
+@app.route('/api/jobs/upload', methods=['POST'])
+def submit_upload_job():
+    file, error = _get_upload()
+    if error:
+        return error
+
+    # The request stream is closed once we return, so keep our own copy
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+    file.save(spooled)
+    size = spooled.tell()
+    spooled.seek(0)
+    upload = FileStorage(stream=spooled, filename=file.filename)
+    fast, stratify = _upload_options()
+
+    def work(job):
+        try:
+            with app.app_context():
+                status, body = run_upload(upload, job, fast=fast, stratify=stratify)
+            if status != 200:
+                raise RuntimeError(json.loads(body).get("error", "Upload failed"))
+            return body
+        finally:
+            spooled.close()
+
+    try:
+        job = job_manager.submit('upload', work, UPLOAD_STAGES, weight=size)
+    except RuntimeError as e:
+        spooled.close()
+        return jsonify({"error": str(e)}), 429
+    return _job_accepted(job)
+
+@app.route('/api/jobs/generate', methods=['POST'])
+def submit_generate_job():
+    data = request.json
+    stats, error = _request_stats(data)
+    if error:
+        return error
+    instruction = data.get('instruction', '')
+
+    if not stats:
+        return jsonify({"error": "No statistics provided"}), 400
+
+    def work(job):
+        with job.stage('narrative'):
+            return {"report": writer.generate_narrative(stats, instruction, use_cache=data.get('cache', True))}
+
+    try:
+        job = job_manager.submit('generate', work, ('narrative',))
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 429
+    return _job_accepted(job)
+
+@app.route('/api/jobs/export', methods=['POST'])
+def submit_export_job():
+    request_args, error = _export_request(request.json or {})
+    if error:
+        return error
+
+    def work(job):
+        with job.stage('export'):
+            status, body = _run_export(*request_args)
+        if status != 200:
+            raise RuntimeError(json.loads(body).get("error", "Export failed"))
+        return body
+
+    try:
+        job = job_manager.submit('export', work, ('export',))
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 429
+    return _job_accepted(job)
+
+@app.route('/api/jobs', methods=['GET'])
+def job_stats():
+    return jsonify(job_manager.stats())
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    if job.status == 'failed':
+        return jsonify({"error": job.error}), 500
+    if job.status != 'done':
+        return jsonify(job.to_dict()), 409
+    if isinstance(job.result, str):
+        return app.response_class(_public_urls(job.result), mimetype='application/json')
+    return jsonify(job.result)
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+
+    def stream():
+        version = None
+        while True:
+            current = job.version
+            if current != version:
+                version = current
+                yield _sse(job.to_dict(), event=job.status if job.finished else 'progress')
+            else:
+                yield ": keep-alive\n\n"
+            if job.finished:
+                return
+            job.wait_for_change(version, timeout=15)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
@@ -1,51 +1,242 @@
+import logging
+import math
 import pandas as pd
 import numpy as np
-import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from . import ingest, correlation, profiler, sampling, telemetry
+from .streaming import SummaryAccumulator
 
-def load_data(file):
+logger = logging.getLogger(__name__)
+
+def load_data(file, store=None, optimize=False):
     """
     Loads CSV, Excel, or JSON data into a Pandas DataFrame.
+    Prefer brain.validate_file, which returns the parsed Dataset directly.
+    With a columnar.ColumnarStore, the parsed data is saved under the
+    file's content hash and later loads of the same content come from
+    the memory-mapped copy instead of the parser. With optimize, the
+    frame goes through optimize_dtypes before it is returned (the store
+    keeps it as parsed).
+    """
+    if store is None:
+        df = ingest.read_dataset(file).df
+    else:
+        digest = ingest.hash_file(file)
+        df = store.read(digest)
+        if df is None:
+            df = ingest.read_dataset(file).df
+            store.write(digest, df)
+    if optimize:
+        df, _ = optimize_dtypes(df)
+    return df
+
+# String columns with at most this share of distinct values become categories
+CATEGORY_MAX_RATIO = 0.5
+
+def _arrow_string_dtype():
+    """
+    Arrow-backed string dtype with NaN for missing values (like the
+    pandas 3 default), or None when pyarrow is not installed.
     """
-    filename = file.filename.lower()
-    
     try:
-        if filename.endswith('.csv'):
-            encodings = ['utf-8', 'latin-1', 'cp1252', 'ISO-8859-1']
-            for encoding in encodings:
-                try:
-                    file.seek(0)
-                    return pd.read_csv(file, encoding=encoding)
-                except UnicodeDecodeError:
-                    continue
-            file.seek(0)
-            raise ValueError(f"Unable to decode CSV. Supported encodings: {encodings}")
-            
-        elif filename.endswith(('.xls', '.xlsx')):
-            file.seek(0)
-            return pd.read_excel(file)
-            
-        elif filename.endswith('.json'):
-            file.seek(0)
-            return pd.read_json(file)
-            
-        else:
-            # Fallback for unknown extensions, try CSV then Excel
-            try:
-                file.seek(0)
-                return pd.read_csv(file)
-            except:
-                file.seek(0)
-                return pd.read_excel(file)
+        import pyarrow # noqa: F401
+    except ImportError:
+        return None
+    try:
+        return pd.StringDtype("pyarrow", na_value=np.nan)
+    except TypeError: # pandas < 2.3 has no na_value; missing values become pd.NA
+        return pd.StringDtype("pyarrow")
 
-    except Exception as e:
-        raise ValueError(f"Failed to load file '{file.filename}': {str(e)}")
+def _optimize_column(series, col_profile, string_dtype):
+    """
+    The column in a more compact dtype, or None to keep it. Conversions
+    never lose information: values that would not survive are a reason
+    to keep the original.
+    """
+    dtype = series.dtype
+    if pd.api.types.is_bool_dtype(dtype) or isinstance(dtype, pd.CategoricalDtype):
+        return None
+
+    if pd.api.types.is_integer_dtype(dtype) and isinstance(dtype, np.dtype):
+        converted = pd.to_numeric(series, downcast='integer')
+        return converted if converted.dtype.itemsize < dtype.itemsize else None
+
+    if dtype == np.float64:
+        values = series.to_numpy()
+        narrowed = values.astype(np.float32)
+        with np.errstate(over='ignore', invalid='ignore'):
+            exact = np.array_equal(narrowed.astype(np.float64), values, equal_nan=True)
+        return series.astype(np.float32) if exact else None
+
+    if not profiler._is_string_like_dtype(dtype):
+        return None
+    if pd.api.types.infer_dtype(series, skipna=True) != 'string':
+        return None # Mixed types cannot be sorted into categories or stored as Arrow strings
+    if col_profile is not None and col_profile.kind == 'datetime' and col_profile.datetime_format is not None:
+        # Parsed once, distinct values only, with the format found by the
+        # profiler; kept as text unless every value formats back exactly
+        # (profiler.restore_text relies on that)
+        fmt = col_profile.datetime_format
+        codes, uniques = pd.factorize(series)
+        try:
+            parsed = pd.to_datetime(uniques, format=fmt)
+        except (TypeError, ValueError):
+            parsed = None
+        if parsed is not None and np.array_equal(parsed.strftime(fmt).to_numpy(dtype=object),
+                                                 np.asarray(uniques, dtype=object)):
+            values = np.append(parsed.to_numpy(), np.datetime64('NaT'))[codes]
+            return pd.Series(values, index=series.index, name=series.name)
+
+    # The profile sample rules out mostly-distinct columns without hashing them all
+    if col_profile is None or col_profile.sample_unique <= CATEGORY_MAX_RATIO * col_profile.sample_size:
+        codes, uniques = pd.factorize(series, sort=True)
+        if len(uniques) <= CATEGORY_MAX_RATIO * len(series):
+            return pd.Series(pd.Categorical.from_codes(codes, uniques), index=series.index, name=series.name)
+    if string_dtype is not None and dtype != string_dtype:
+        return series.astype(string_dtype)
+    return None
+
+@telemetry.span("optimize_dtypes")
+def optimize_dtypes(data):
+    """
+    Shrinks a DataFrame (or a Dataset's frame) without changing any value:
+    low-cardinality strings become categories, other strings Arrow
+    strings, integers and floats are downcast when every value fits, and
+    date columns detected by the profiler are parsed once when they have
+    a single format that reproduces the original text (the summary,
+    charts and preview show them as that text). A Dataset gets the new
+    frame; its cached profile is updated to the new dtypes.
+    Returns (df, report) where report holds the memory footprint before
+    and after plus the conversions made.
+    """
+    start = time.perf_counter()
+    df = ingest.as_frame(data)
+    profile = profiler.get_profile(data)
+    string_dtype = _arrow_string_dtype()
+
+    optimized = df.copy(deep=False)
+    conversions = {}
+    before = after = 0
+    for i, col in enumerate(df.columns):
+        series = df.iloc[:, i]
+        size = int(series.memory_usage(index=False, deep=True))
+        before += size
+        col_profile = profile.columns.get(col)
+        try:
+            converted = _optimize_column(series, col_profile, string_dtype)
+        except (TypeError, ValueError) as e: # e.g. unhashable cells from JSON
+            logger.warning(f"Could not optimise column {col}: {e}")
+            converted = None
+        if converted is None:
+            after += size
+            continue
+        optimized.isetitem(i, converted)
+        after += int(converted.memory_usage(index=False, deep=True))
+        conversions[str(col)] = f"{series.dtype} -> {converted.dtype}"
+        if col_profile is not None:
+            # The kind (categorical, datetime, numeric...) is unchanged
+            col_profile.dtype = converted.dtype
+
+    report = {
+        "bytes_before": before,
+        "bytes_after": after,
+        "conversions": conversions,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+    logger.info(f"Optimised dtypes: {before} -> {after} bytes in {report['seconds']}s")
+
+    if isinstance(data, ingest.Dataset):
+        data.df = optimized
+        data.query_engine = None
+    return optimized, report
+
+# Cells per block when summarising numeric columns (~64 MB of float64)
+NUMERIC_BLOCK_CELLS = 8 * 1024 * 1024
+
+def _json_floats(values):
+    """
+    Converts a float array to a list of Python floats, with NaN/inf as None.
+    """
+    out = values.astype(object)
+    out[~np.isfinite(values)] = None
+    return out.tolist()
+
+def _numeric_block(df, cols):
+    frame = df[cols]
+    values = frame.to_numpy(dtype='float64', na_value=np.nan)
+    mask = ~np.isnan(values)
+    count = mask.sum(axis=0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(mask, values, 0.0).sum(axis=0) / count
+        deviations = np.where(mask, values - mean, 0.0)
+        std = np.sqrt((deviations * deviations).sum(axis=0) / (count - 1))
+    std[count < 2] = np.nan
+
+    # One column-wise sort gives min, max and median together (NaNs sort last)
+    ordered = np.sort(values, axis=0) if len(values) else np.full((1, len(cols)), np.nan)
+    positions = np.arange(len(cols))
+    last = np.maximum(count - 1, 0)
+    empty = count == 0
+    median = (ordered[last // 2, positions] + ordered[count // 2 - empty, positions]) / 2
+    median[empty] = np.nan
+    mins = ordered[0, positions]
+    maxs = ordered[last, positions]
+    mins[empty] = np.nan
+    maxs[empty] = np.nan
+    mins, maxs = _json_floats(mins), _json_floats(maxs)
+
+    # Integer columns report exact integer extremes, as pandas would
+    int_positions = [i for i, dtype in enumerate(frame.dtypes) if pd.api.types.is_integer_dtype(dtype)]
+    if int_positions:
+        int_frame = frame.iloc[:, int_positions]
+        for i, lo, hi in zip(int_positions, int_frame.min().tolist(), int_frame.max().tolist()):
+            mins[i] = None if pd.isna(lo) else int(lo)
+            maxs[i] = None if pd.isna(hi) else int(hi)
+
+    means = _json_floats(np.round(mean, 2))
+    medians = _json_floats(np.round(median, 2))
+    stds = _json_floats(np.round(std, 2))
+    return {
+        col: {"mean": means[i], "median": medians[i], "max": maxs[i], "min": mins[i], "std_dev": stds[i]}
+        for i, col in enumerate(cols)
+    }
+
+def numeric_summary(df, numeric_cols):
+    """
+    Mean, median, max, min and std_dev for all numeric columns at once.
+    Columns are processed as float64 blocks with vectorised NumPy
+    reductions instead of five pandas calls per column; NaN/inf
+    sanitising and rounding are applied to whole arrays.
+    """
+    cols = list(numeric_cols)
+    stats = {}
+    step = max(1, NUMERIC_BLOCK_CELLS // max(1, len(df)))
+    for start in range(0, len(cols), step):
+        block = cols[start:start + step]
+        try:
+            stats.update(_numeric_block(df, block))
+        except Exception as e:
+            logger.warning(f"Batched numeric stats failed ({e}), retrying per column")
+            for col in block:
+                try:
+                    stats.update(_numeric_block(df, [col]))
+                except Exception as e:
+                    logger.warning(f"Error processing col {col}: {e}")
+    return stats
 
-def generate_summary_v2(df):
+@telemetry.span("summary")
+def generate_summary_v2(data, top_correlations=None, correlation_method=None):
     """
-    Calculates detailed statistical summary of the DataFrame.
+    Calculates detailed statistical summary of a Dataset or DataFrame.
+    top_correlations / correlation_method default to the correlation
+    module settings (3 strongest pairs, Pearson).
     Returns a dictionary of stats optimized for LLM consumption.
     """
-    print(f"DEBUG: Starting analysis on {len(df)} rows and {len(df.columns)} columns...", file=sys.stderr)
+    df = ingest.as_frame(data)
+    profile = profiler.get_profile(data)
+    logger.debug(f"Starting analysis on {len(df)} rows and {len(df.columns)} columns...")
     
     try:
         summary = {
@@ -69,52 +260,183 @@ def generate_summary_v2(df):
             return val
 
         # Numeric Analysis
-        numeric_cols = df.select_dtypes(include=[np.number]).columns
-        print(f"DEBUG: Found numeric cols: {list(numeric_cols)}", file=sys.stderr)
+        numeric_cols = profile.numeric_columns()
+        logger.debug(f"Found numeric cols: {list(numeric_cols)}")
         
-        for col in numeric_cols:
-            try:
-                summary["numeric_stats"][col] = {
-                    "mean": clean_val(round(df[col].mean(), 2)),
-                    "median": clean_val(round(df[col].median(), 2)),
-                    "max": clean_val(df[col].max()),
-                    "min": clean_val(df[col].min()),
-                    "std_dev": clean_val(round(df[col].std(), 2))
-                }
-            except Exception as e:
-                print(f"DEBUG: Error processing col {col}: {e}", file=sys.stderr)
-                continue
+        summary["numeric_stats"] = numeric_summary(df, numeric_cols)
 
         # Categorical Analysis (New)
         summary["categorical_stats"] = {}
-        categorical_cols = df.select_dtypes(include=['object', 'category']).columns
-        print(f"DEBUG: Found categorical cols: {list(categorical_cols)}", file=sys.stderr)
+        categorical_cols = profile.categorical_columns()
+        logger.debug(f"Found categorical cols: {list(categorical_cols)}")
         
         for col in categorical_cols:
             try:
                 # Top 10 most frequent values
-                top_counts = df[col].value_counts().head(10).to_dict()
+                top_counts = profiler.restore_text(df[col], profile.columns.get(col)).value_counts().head(10).to_dict()
                 summary["categorical_stats"][col] = {k: int(v) for k, v in top_counts.items()}
             except Exception as e:
-                 print(f"DEBUG: Error processing cat col {col}: {e}", file=sys.stderr)
+                 logger.warning(f"Error processing cat col {col}: {e}")
 
 
         # Correlation Analysis
         if len(numeric_cols) > 1:
             try:
-                corr_matrix = df[numeric_cols].corr().abs()
-                sol = (corr_matrix.where(np.triu(np.ones(corr_matrix.shape), k=1).astype(bool))
-                    .stack()
-                    .sort_values(ascending=False))
-                
-                top_corr = sol.head(3).to_dict()
-                summary["correlation"] = {f"{k[0]} vs {k[1]}": clean_val(round(v, 2)) for k, v in top_corr.items()}
+                pairs = correlation.top_pairs(df, numeric_cols, n=top_correlations, method=correlation_method)
+                summary["correlation"] = {f"{a} vs {b}": clean_val(round(abs(r), 2)) for a, b, r in pairs}
             except Exception as e:
-                print(f"DEBUG: Correlation failed: {e}", file=sys.stderr)
+                logger.warning(f"Correlation failed: {e}")
 
-        print("DEBUG: Analysis complete. Returning summary.", file=sys.stderr)
+        logger.debug("Analysis complete. Returning summary.")
         return summary
     
     except Exception as e:
-        print(f"DEBUG: CRITICAL ERROR inside generate_summary_v2: {e}", file=sys.stderr)
+        logger.exception(f"Summary failed: {e}")
+        return {"error": str(e), "basic_info": {"rows": 0}} # Fallback
+
+
+@telemetry.span("summary", mode="chunked")
+def generate_summary_chunked(file, chunksize=ingest.DEFAULT_CHUNK_SIZE, workers=1, top_correlations=None):
+    """
+    Out-of-core version of generate_summary_v2 for CSV and JSON-lines files.
+    Reads the file in chunks and feeds mergeable accumulators, so memory
+    stays bounded regardless of file size. With workers > 1, chunks are
+    summarised in parallel and the partial results merged.
+    Median and top categories are approximate once a column exceeds the
+    sketch capacities; everything else is exact.
+    """
+    logger.debug(f"Starting chunked analysis of '{file.filename}' (chunksize={chunksize}, workers={workers})...")
+    summary = SummaryAccumulator()
+
+    try:
+        chunks = ingest.iter_chunks(file, chunksize)
+        first = next(chunks, None)
+        if first is None:
+            return summary.result(top_correlations)
+        summary.update(first)
+
+        if workers <= 1:
+            for chunk in chunks:
+                summary.update(chunk)
+        else:
+            # Bound in-flight chunks so memory stays at ~2 chunks per worker
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                pending = []
+                for chunk in chunks:
+                    pending.append(pool.submit(summary.spawn().update, chunk))
+                    if len(pending) >= workers * 2:
+                        summary.merge(pending.pop(0).result())
+                for future in pending:
+                    summary.merge(future.result())
+
+        logger.debug(f"Chunked analysis complete ({summary.rows} rows).")
+        return summary.result(top_correlations)
+
+    except Exception as e:
+        logger.exception(f"Chunked summary failed: {e}")
         return {"error": str(e), "basic_info": {"rows": 0}} # Fallback
+    finally:
+        file.seek(0)
+
+
+@telemetry.span("summary", mode="streamed")
+def generate_summary_stream(chunks, keep_bytes=0, top_correlations=None):
+    """
+    Summarises DataFrame chunks as they are parsed from an upload that is
+    still arriving (see ingest.iter_stream_chunks), so the stats are ready
+    when the last byte is. Parsed chunks are also kept while they total at
+    most keep_bytes, giving the full DataFrame for small uploads.
+    Returns (stats, df, complete): df is the whole dataset when complete,
+    else just the first chunk. Parse errors and ingest.UploadTooLarge are
+    raised to the caller.
+    """
+    summary = SummaryAccumulator()
+    kept = []
+    kept_bytes = 0
+    complete = True
+    for chunk in chunks:
+        summary.update(chunk)
+        if complete:
+            kept.append(chunk)
+            kept_bytes += int(chunk.memory_usage(deep=True).sum())
+            if kept_bytes > keep_bytes and len(kept) > 1:
+                complete = False
+                del kept[1:]
+    logger.debug(f"Streamed analysis complete ({summary.rows} rows).")
+
+    if not kept:
+        return summary.result(top_correlations), pd.DataFrame(), True
+    if not complete:
+        return summary.result(top_correlations), kept[0], False
+    df = kept[0] if len(kept) == 1 else pd.concat(kept, ignore_index=True)
+    return summary.result(top_correlations), df, True
+
+
+def _margins(values):
+    """
+    Margins of error as JSON floats, rounded up to the 2 decimals the
+    stats are shown with so a real error never reads as 0.
+    """
+    return _json_floats(np.ceil(np.asarray(values, dtype='float64') * 100) / 100)
+
+
+@telemetry.span("summary", mode="sampled")
+def generate_summary_sampled(data, top_correlations=None, correlation_method=None):
+    """
+    generate_summary_v2 for a Dataset of sampled rows (data.sample set,
+    see sampling), scaled back to the whole dataset: rows, missing values
+    and top category counts are estimates for all rows, and means,
+    medians and standard deviations are weighted by how many rows each
+    sampled row stands for. A "sampling" section holds the sample size
+    and method and the error bounds at sampling.CONFIDENCE: a margin for
+    every mean and count and an interval for every median. Min, max and
+    correlations are those of the sample.
+    """
+    sample = data.sample
+    summary = generate_summary_v2(data, top_correlations, correlation_method)
+    if "error" in summary:
+        return summary
+    df = sample.df
+    bounds = {}
+
+    try:
+        summary["basic_info"]["rows"] = sample.population_rows
+        if sample.rows_margin is not None:
+            bounds["rows"] = math.ceil(sample.rows_margin)
+        columns = list(df.columns)
+        missing, margins = sampling.estimate_totals(sample, df.isnull().to_numpy())
+        summary["basic_info"]["missing_values"] = {col: int(round(v)) for col, v in zip(columns, missing)}
+        bounds["missing_values"] = {col: math.ceil(m) for col, m in zip(columns, margins)}
+
+        numeric_cols = list(summary["numeric_stats"])
+        if numeric_cols:
+            values = df[numeric_cols].apply(pd.to_numeric, errors='coerce').to_numpy(dtype='float64', na_value=np.nan)
+            means, mean_margins = sampling.estimate_means(sample, values)
+            medians, lows, highs = sampling.estimate_medians(sample, values)
+            stds = sampling.weighted_std(sample, values, means)
+            means, medians, stds = (_json_floats(np.round(v, 2)) for v in (means, medians, stds))
+            mean_margins, lows, highs = _margins(mean_margins), _json_floats(lows), _json_floats(highs)
+            bounds["numeric_stats"] = {}
+            for i, col in enumerate(numeric_cols):
+                summary["numeric_stats"][col].update(mean=means[i], median=medians[i], std_dev=stds[i])
+                bounds["numeric_stats"][col] = {"mean": mean_margins[i], "median": [lows[i], highs[i]]}
+
+        bounds["categorical_stats"] = {}
+        weights = pd.Series(sample.weights, index=df.index)
+        profile = profiler.get_profile(data)
+        for col in summary["categorical_stats"]:
+            try:
+                values = profiler.restore_text(df[col], profile.columns.get(col))
+                top = weights.groupby(values, observed=True).sum().nlargest(10)
+                indicators = np.column_stack([(values == value).to_numpy() for value in top.index]) \
+                    if len(top) else np.zeros((len(df), 0))
+                counts, margins = sampling.estimate_totals(sample, indicators)
+                summary["categorical_stats"][col] = {k: int(round(v)) for k, v in zip(top.index, counts)}
+                bounds["categorical_stats"][col] = {k: math.ceil(m) for k, m in zip(top.index, margins)}
+            except Exception as e:
+                logger.warning(f"Error estimating cat col {col}: {e}")
+    except Exception as e:
+        logger.warning(f"Sampled estimates failed, reporting sample stats: {e}")
+
+    summary["sampling"] = {**sample.info(), "error_bounds": bounds}
+    return summary
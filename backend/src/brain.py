@@ -1,79 +1,51 @@
-import pandas as pd
+from . import ingest, profiler, telemetry
 
-def validate_file(file):
+@telemetry.span("validate")
+def validate_file(file, head_rows=None):
     """
     Checks if the uploaded file is valid and not empty.
-    Supports CSV, Excel, and JSON.
-    Returns (bool, message).
+    Supports CSV, Excel, JSON, and JSON-lines.
+    The file is parsed once here and the resulting Dataset is handed on,
+    so the analyst and plotter never re-read the upload. With head_rows,
+    only that many leading rows are parsed (for files analysed in chunks).
+    Returns (bool, message, dataset); dataset is None when invalid.
     """
-    filename = file.filename.lower()
-    
-    try:
-        if filename.endswith('.csv'):
-            encodings = ['utf-8', 'latin-1', 'cp1252', 'ISO-8859-1']
-            for encoding in encodings:
-                try:
-                    file.seek(0)
-                    df = pd.read_csv(file, encoding=encoding)
-                    if df.empty:
-                        return False, "File is empty."
-                    file.seek(0)
-                    return True, "File is valid."
-                except UnicodeDecodeError:
-                    continue
-                except Exception:
-                    continue
-            return False, "Unable to decode CSV file."
-
-        elif filename.endswith(('.xls', '.xlsx')):
-            try:
-                file.seek(0)
-                df = pd.read_excel(file)
-                if df.empty:
-                    return False, "File is empty."
-                file.seek(0)
-                return True, "File is valid."
-            except Exception as e:
-                return False, f"Invalid Excel file: {str(e)}"
+    file_format = ingest.detect_format(file.filename)
+    if file_format is None:
+        return False, "Unsupported file type. Please upload CSV, Excel, or JSON.", None
 
-        elif filename.endswith('.json'):
-            try:
-                file.seek(0)
-                df = pd.read_json(file)
-                if df.empty:
-                    return False, "File is empty."
-                file.seek(0)
-                return True, "File is valid."
-            except Exception as e:
-                return False, f"Invalid JSON file: {str(e)}"
-        
+    try:
+        if head_rows:
+            dataset = ingest.read_head(file, head_rows)
         else:
-            return False, "Unsupported file type. Please upload CSV, Excel, or JSON."
-
+            dataset = ingest.read_dataset(file)
+    except ValueError as e:
+        cause = e.__cause__ or e
+        if file_format == 'csv':
+            return False, "Unable to decode CSV file.", None
+        if file_format == 'excel':
+            return False, f"Invalid Excel file: {str(cause)}", None
+        if file_format == 'jsonl':
+            return False, f"Invalid JSON-lines file: {str(cause)}", None
+        return False, f"Invalid JSON file: {str(cause)}", None
     except Exception as e:
-        return False, f"Validation error: {str(e)}"
+        return False, f"Validation error: {str(e)}", None
     finally:
         # Always reset pointer
         file.seek(0)
 
-def determine_report_type(df):
+    if dataset.empty:
+        return False, "File is empty.", None
+
+    return True, "File is valid.", dataset
+
+def determine_report_type(data):
     """
     Analyzes columns to suggest a report type.
+    Accepts a Dataset or a DataFrame. Uses the cached column profile, so
+    datetime detection looks at a bounded sample instead of every row.
     """
-    # Check for datetime columns
-    for col in df.columns:
-        if pd.api.types.is_datetime64_any_dtype(df[col]):
-            return "Time Series Analysis"
-        
-        # Try converting object cols to datetime to check
-        if df[col].dtype == 'object':
-            try:
-                # Attempt to convert to datetime, ignoring errors
-                valid_dates = pd.to_datetime(df[col], errors='coerce')
-                # If more than 80% are valid dates, consider it a time series
-                if valid_dates.notna().mean() > 0.8:
-                    return "Time Series Analysis"
-            except:
-                continue
+    if profiler.get_profile(data).datetime_columns():
+        return "Time Series Analysis"
 
     return "General Performance Analysis"
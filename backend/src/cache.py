@@ -0,0 +1,166 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """
+    Two-tier cache for analysis responses keyed by upload content hash.
+    Entries are stored as encoded JSON text. The in-memory tier is an LRU
+    bounded by total bytes; when cache_dir is set, entries are also kept
+    on disk (bounded by max_disk_bytes) so they survive restarts.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, cache_dir=None, max_disk_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, key):
+        """
+        Returns the cached JSON text for key, or None.
+        """
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return text
+
+        text = self._read_disk(key)
+        with self._lock:
+            if text is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, text)
+        return text
+
+    def put(self, key, value):
+        """
+        Caches value (a JSON-serialisable object or already encoded text).
+        Returns the encoded text.
+        """
+        text = value if isinstance(value, str) else json.dumps(value)
+        with self._lock:
+            self._store(key, text)
+        self._write_disk(key, text)
+        return text
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_evictions": self.disk_evictions,
+                "disk_enabled": bool(self.cache_dir),
+            }
+
+    # Memory tier (caller holds the lock)
+
+    def _store(self, key, text):
+        size = len(text)
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._entries[key] = text
+        self._size += size
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+
+    # Disk tier
+
+    def _path(self, key):
+        safe_key = "".join(c if c.isalnum() else "_" for c in key)
+        return os.path.join(self.cache_dir, f"{safe_key}.json")
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            os.utime(path)  # Refresh recency for disk eviction
+            return text
+        except OSError:
+            return None
+
+    def _write_disk(self, key, text):
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Result cache write failed: {e}")
+            return
+        self._trim_disk()
+
+    def _trim_disk(self):
+        try:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(self.cache_dir, name)
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+        except OSError:
+            return
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                with self._lock:
+                    self.disk_evictions += 1
+            except OSError:
+                continue
+
+
+def from_env():
+    """
+    Builds a ResultCache configured from RESULT_CACHE_* environment variables.
+    """
+    return ResultCache(
+        max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+        cache_dir=os.getenv("RESULT_CACHE_DIR") or None,
+        max_disk_bytes=int(os.getenv("RESULT_CACHE_MAX_DISK_BYTES", 512 * 1024 * 1024)),
+    )
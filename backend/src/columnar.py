@@ -0,0 +1,180 @@
+import logging
+import os
+import tempfile
+import threading
+import uuid
+from . import ingest, telemetry
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError: # Optional dependency; the store is disabled without it
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+AVAILABLE = pa is not None
+
+
+class ColumnarStore:
+    """
+    Parsed datasets saved as uncompressed Arrow IPC files, keyed by the
+    SHA-256 of the original upload. Reads memory-map the file and only
+    materialise the requested columns, so reloading a dataset never goes
+    through the CSV/Excel/JSON parser again. Oldest files are removed once
+    the directory exceeds max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=2 * 1024 * 1024 * 1024):
+        if not AVAILABLE:
+            raise RuntimeError("pyarrow is required for the columnar store")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.skipped = 0
+        self.evictions = 0
+
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, digest):
+        return os.path.join(self.directory, f"{digest}.arrow")
+
+    def has(self, digest):
+        return digest is not None and os.path.exists(self.path(digest))
+
+    def write(self, digest, df):
+        """
+        Saves df under digest. Returns False (and keeps nothing) for frames
+        Arrow cannot represent faithfully, e.g. non-string column names or
+        object columns mixing types.
+        """
+        if self.has(digest):
+            return True
+        names = list(df.columns)
+        if not all(isinstance(name, str) for name in names) or len(set(names)) != len(names):
+            self.skipped += 1
+            return False
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        except (pa.ArrowException, TypeError, ValueError) as e:
+            logger.warning(f"Columnar store skipped {digest[:12]}: {e}")
+            self.skipped += 1
+            return False
+
+        # Write to a temporary name and rename, so readers never see a partial file
+        tmp_path = os.path.join(self.directory, f".{digest}.{uuid.uuid4().hex}.tmp")
+        try:
+            with pa.OSFile(tmp_path, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(tmp_path, self.path(digest))
+        except OSError as e:
+            logger.warning(f"Columnar store write failed: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        with self._lock:
+            self.writes += 1
+        self._trim()
+        return True
+
+    def columns(self, digest):
+        """
+        Column names of a stored dataset (schema only), or None.
+        """
+        try:
+            with pa.memory_map(self.path(digest), 'r') as source:
+                return pa.ipc.open_file(source).schema.names
+        except (OSError, pa.ArrowException):
+            return None
+
+    def read(self, digest, columns=None):
+        """
+        Loads a stored dataset (or just `columns` of it) as a DataFrame,
+        or returns None if it is not stored.
+        """
+        try:
+            with pa.memory_map(self.path(digest), 'r') as source:
+                table = pa.ipc.open_file(source).read_all()
+                if columns is not None:
+                    table = table.select(list(columns))
+                df = table.to_pandas(split_blocks=True)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        except (OSError, pa.ArrowException, KeyError) as e:
+            logger.warning(f"Columnar store read failed for {digest[:12]}: {e}")
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        # Mark as recently used for trimming
+        try:
+            os.utime(self.path(digest))
+        except OSError:
+            pass
+        return df
+
+    @telemetry.span("load", source="columnar")
+    def load_dataset(self, digest, filename, columns=None):
+        """
+        A Dataset rebuilt from the store, or None.
+        """
+        df = self.read(digest, columns)
+        if df is None:
+            return None
+        dataset = ingest.Dataset(df, filename, ingest.detect_format(filename) if filename else None)
+        dataset.digest = digest
+        return dataset
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "skipped": self.skipped,
+                "evictions": self.evictions,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _trim(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.arrow'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+
+def from_env():
+    """
+    Builds a ColumnarStore from COLUMNAR_STORE_* environment variables.
+    Returns None when pyarrow is missing or COLUMNAR_STORE_DIR is set to an
+    empty value.
+    """
+    directory = os.getenv("COLUMNAR_STORE_DIR", os.path.join(tempfile.gettempdir(), "datanarrator_columnar"))
+    if not AVAILABLE or not directory:
+        return None
+    return ColumnarStore(directory, max_bytes=int(os.getenv("COLUMNAR_STORE_MAX_BYTES", 2 * 1024 * 1024 * 1024)))
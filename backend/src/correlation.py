@@ -0,0 +1,157 @@
+import os
+import numpy as np
+
+# Defaults, overridable per call
+TOP_PAIRS = int(os.getenv("CORRELATION_TOP_PAIRS", 3))
+METHOD = os.getenv("CORRELATION_METHOD", "pearson")
+HEATMAP_MAX_COLUMNS = int(os.getenv("HEATMAP_MAX_COLUMNS", 10))
+# Columns per block; memory per block product is BLOCK_SIZE**2 floats
+BLOCK_SIZE = 256
+
+METHODS = ('pearson', 'spearman')
+
+
+def _prepare(df, columns, method):
+    """
+    Returns the columns as a standardised float64 matrix (missing cells
+    zeroed) plus the missing-value mask. Spearman is Pearson on per-column
+    ranks; with missing values the ranks are taken once per column rather
+    than per pair as pandas does, so results can differ slightly.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unsupported correlation method '{method}'. Use one of {METHODS}.")
+    frame = df[list(columns)]
+    if method == 'spearman':
+        frame = frame.rank()
+    values = frame.to_numpy(dtype='float64', na_value=np.nan)
+    mask = ~np.isnan(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        count = mask.sum(axis=0)
+        mean = np.where(mask, values, 0.0).sum(axis=0) / count
+        centered = np.where(mask, values - mean, 0.0)
+        std = np.sqrt((centered * centered).sum(axis=0) / count)
+        # Pearson is shift/scale invariant, so standardising once keeps
+        # every block product well conditioned
+        z = np.where(std > 0, centered / std, 0.0)
+    return z, mask
+
+
+def _block_corr(z, mask, rows, cols, complete):
+    """
+    Correlation of column block `rows` against column block `cols`.
+    """
+    zr, zc = z[:, rows], z[:, cols]
+    if complete:
+        n = z.shape[0]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std_r = np.sqrt((zr * zr).sum(axis=0) / n)
+            std_c = np.sqrt((zc * zc).sum(axis=0) / n)
+            corr = (zr.T @ zc) / n / np.outer(std_r, std_c)
+        if n < 2:
+            corr[:] = np.nan
+        return corr
+
+    # Pairwise-complete observations, from masked sums
+    mr, mc = mask[:, rows].astype('float64'), mask[:, cols].astype('float64')
+    n = mr.T @ mc
+    sx, sy = zr.T @ mc, mr.T @ zc
+    sxx, syy = (zr * zr).T @ mc, mr.T @ (zc * zc)
+    sxy = zr.T @ zc
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corr = (n * sxy - sx * sy) / np.sqrt((n * sxx - sx * sx) * (n * syy - sy * sy))
+    corr[n < 2] = np.nan
+    return corr
+
+
+def _select(values, rows, cols, n):
+    """
+    Keeps the n largest |r| candidates (ties broken by column position).
+    """
+    if len(values) > n:
+        keep = np.argpartition(-np.abs(values), n - 1)[:n]
+        values, rows, cols = values[keep], rows[keep], cols[keep]
+    order = np.lexsort((cols, rows, -np.abs(values)))
+    return values[order], rows[order], cols[order]
+
+
+def top_pairs(df, columns, n=None, method=None, block_size=BLOCK_SIZE):
+    """
+    Finds the n most strongly correlated column pairs without keeping the
+    full k x k matrix: the matrix is computed in column blocks and only the
+    best n candidates survive each block (partial selection, no full sort).
+    Returns a list of (column_a, column_b, r) ordered by |r| descending.
+    """
+    n = TOP_PAIRS if n is None else n
+    method = METHOD if method is None else method
+    columns = list(columns)
+    if n <= 0 or len(columns) < 2:
+        return []
+
+    z, mask = _prepare(df, columns, method)
+    complete = bool(mask.all())
+    k = len(columns)
+
+    best_values, best_rows, best_cols = np.empty(0), np.empty(0, dtype=int), np.empty(0, dtype=int)
+    for r0 in range(0, k, block_size):
+        rows = np.arange(r0, min(r0 + block_size, k))
+        for c0 in range(r0, k, block_size):
+            cols = np.arange(c0, min(c0 + block_size, k))
+            corr = _block_corr(z, mask, rows, cols, complete)
+            # Upper triangle only: global column index must exceed the row's
+            ri, ci = np.nonzero(cols[None, :] > rows[:, None])
+            values = corr[ri, ci]
+            valid = ~np.isnan(values)
+            best_values, best_rows, best_cols = _select(
+                np.concatenate([best_values, values[valid]]),
+                np.concatenate([best_rows, rows[ri[valid]]]),
+                np.concatenate([best_cols, cols[ci[valid]]]),
+                n
+            )
+
+    return [(columns[i], columns[j], float(v)) for v, i, j in zip(best_values, best_rows, best_cols)]
+
+
+def top_pairs_from_matrix(corr, columns, n=None):
+    """
+    Same selection as top_pairs, for an already computed correlation
+    matrix (e.g. from the streaming accumulators).
+    """
+    n = TOP_PAIRS if n is None else n
+    corr = np.asarray(corr, dtype='float64')
+    rows, cols = np.triu_indices(len(columns), k=1)
+    values = corr[rows, cols]
+    valid = ~np.isnan(values)
+    if n <= 0 or not valid.any():
+        return []
+    values, rows, cols = _select(values[valid], rows[valid], cols[valid], n)
+    return [(columns[i], columns[j], float(v)) for v, i, j in zip(values, rows, cols)]
+
+
+def top_columns(df, columns, limit=None, method=None):
+    """
+    Picks up to `limit` columns taking part in the strongest correlations,
+    in their original order. Used to keep the heatmap small and readable.
+    """
+    limit = HEATMAP_MAX_COLUMNS if limit is None else limit
+    columns = list(columns)
+    if len(columns) <= limit:
+        return columns
+
+    chosen = set()
+    for a, b, _ in top_pairs(df, columns, n=limit * limit, method=method):
+        for col in (a, b):
+            if len(chosen) < limit:
+                chosen.add(col)
+        if len(chosen) >= limit:
+            break
+    return [col for col in columns if col in chosen]
+
+
+def matrix(df, columns, method=None):
+    """
+    Full correlation matrix for a (small) set of columns.
+    """
+    method = METHOD if method is None else method
+    if method not in METHODS:
+        raise ValueError(f"Unsupported correlation method '{method}'. Use one of {METHODS}.")
+    return df[list(columns)].corr(method=method)
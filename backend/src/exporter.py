@@ -0,0 +1,460 @@
+import base64
+import copy
+import hashlib
+import html
+import io
+import logging
+import os
+import re
+import string
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from . import plot_store, telemetry
+from .workers import WorkerPool
+
+try:
+    from fpdf import FPDF
+except ImportError: # Optional dependency (fpdf2); only HTML export is available without it
+    FPDF = None
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('html', 'pdf') if FPDF is not None else ('html',)
+MIMETYPES = {"html": "text/html", "pdf": "application/pdf"}
+# Part of every document's cache key; bump when the layout changes so
+# documents rendered by older code are not reused
+EXPORT_VERSION = 1
+# Chart PNGs kept in memory per worker; charts are named by content, so
+# a cached image never goes stale
+IMAGE_CACHE_ITEMS = 64
+
+# Typographic characters the PDF core fonts (latin-1) cannot show
+LATIN1_REPLACEMENTS = str.maketrans({
+    '–': '-', '—': '--', '‘': "'", '’': "'",
+    '“': '"', '”': '"', '•': '*', '…': '...',
+})
+# DejaVu ships with matplotlib and covers far more than latin-1
+PDF_FONTS = (('', 'DejaVuSans.ttf'), ('B', 'DejaVuSans-Bold.ttf'),
+             ('I', 'DejaVuSans-Oblique.ttf'), ('BI', 'DejaVuSans-BoldOblique.ttf'))
+
+HTML_TEMPLATE = string.Template("""<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>$title</title>
+<style>
+body { font-family: -apple-system, "Segoe UI", Helvetica, Arial, sans-serif; color: #1f2937;
+       max-width: 52rem; margin: 2rem auto; padding: 0 1rem; line-height: 1.6; }
+h1, h2, h3, h4 { color: #111827; line-height: 1.25; }
+table { border-collapse: collapse; margin: 1rem 0; }
+th, td { border: 1px solid #d1d5db; padding: 0.3rem 0.6rem; text-align: left; }
+code { background: #f3f4f6; padding: 0 0.2rem; border-radius: 3px; }
+figure { margin: 1.5rem 0; text-align: center; }
+figure img { max-width: 100%; }
+figcaption { color: #6b7280; font-size: 0.9rem; }
+</style>
+</head>
+<body>
+<h1>$title</h1>
+$body
+</body>
+</html>
+""")
+
+_HEADING = re.compile(r'^(#{1,6})\s+(.*?)\s*#*$')
+_BULLET = re.compile(r'^\s*[-*+]\s+(.*)$')
+_NUMBERED = re.compile(r'^\s*(\d+)[.)]\s+(.*)$')
+_TABLE_RULE = re.compile(r'^\|?[\s:|-]+\|?$')
+_RULE = re.compile(r'^([-*_])(\s*\1){2,}$')
+_INLINE = re.compile(r'(\*\*.+?\*\*|__.+?__|\*[^*\s][^*]*?\*|`[^`]+`)')
+
+
+def sanitize_text(text):
+    """
+    text with typographic quotes, dashes and bullets replaced, and
+    anything else outside latin-1 as '?', for the PDF core fonts.
+    """
+    return text.translate(LATIN1_REPLACEMENTS).encode('latin-1', 'replace').decode('latin-1')
+
+
+def parse_markdown(text):
+    """
+    The block structure of a report's markdown, as far as the exporters
+    render it: ("heading", level, text), ("item", marker, text) with
+    marker None for bullets, ("table", None, rows of cells) and
+    ("paragraph", None, text).
+    """
+    blocks = []
+    paragraph = []
+
+    def flush():
+        if paragraph:
+            blocks.append(("paragraph", None, " ".join(paragraph)))
+            paragraph.clear()
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped or _RULE.match(stripped):
+            flush()
+            continue
+        heading = _HEADING.match(stripped)
+        bullet = _BULLET.match(line)
+        numbered = _NUMBERED.match(line)
+        if heading:
+            flush()
+            blocks.append(("heading", len(heading.group(1)), heading.group(2)))
+        elif bullet:
+            flush()
+            blocks.append(("item", None, bullet.group(1)))
+        elif numbered:
+            flush()
+            blocks.append(("item", numbered.group(1), numbered.group(2)))
+        elif stripped.startswith('|'):
+            flush()
+            if _TABLE_RULE.match(stripped):
+                continue
+            cells = [cell.strip() for cell in stripped.strip('|').split('|')]
+            if blocks and blocks[-1][0] == "table":
+                blocks[-1][2].append(cells)
+            else:
+                blocks.append(("table", None, [cells]))
+        else:
+            paragraph.append(stripped)
+    flush()
+    return blocks
+
+
+def inline_spans(text):
+    """
+    (style, text) pieces of a line: style 'B' (bold), 'I' (italic),
+    'code' or '' (plain).
+    """
+    spans = []
+    for piece in _INLINE.split(text):
+        if not piece:
+            continue
+        if piece.startswith('**') or piece.startswith('__'):
+            spans.append(('B', piece[2:-2]))
+        elif piece.startswith('`'):
+            spans.append(('code', piece[1:-1]))
+        elif piece.startswith('*') and len(piece) > 2:
+            spans.append(('I', piece[1:-1]))
+        else:
+            spans.append(('', piece))
+    return spans
+
+
+# --- Renderers (run in the worker processes) ---
+
+_images = OrderedDict()
+_pdf_template = None
+
+
+def _image(path):
+    """
+    PNG bytes of a chart, from this worker's cache when rendered before.
+    """
+    data = _images.get(path)
+    if data is None:
+        with open(path, 'rb') as f:
+            data = f.read()
+        _images[path] = data
+        if len(_images) > IMAGE_CACHE_ITEMS:
+            _images.popitem(last=False)
+    else:
+        _images.move_to_end(path)
+    return data
+
+
+def _init_worker():
+    # Load the fonts once per worker rather than once per document
+    if FPDF is not None:
+        _new_pdf()
+
+
+def _html_inline(text):
+    parts = []
+    for style, piece in inline_spans(text):
+        piece = html.escape(piece)
+        if style == 'B':
+            piece = f"<strong>{piece}</strong>"
+        elif style == 'I':
+            piece = f"<em>{piece}</em>"
+        elif style == 'code':
+            piece = f"<code>{piece}</code>"
+        parts.append(piece)
+    return "".join(parts)
+
+
+def render_html(title, report, images, path):
+    """
+    Writes a self-contained HTML document (charts embedded as data URIs)
+    to path. images are (caption, PNG path) pairs.
+    """
+    out = []
+    open_list = None
+    for kind, arg, content in parse_markdown(report):
+        tag = ('ol' if arg else 'ul') if kind == "item" else None
+        if open_list != tag:
+            if open_list:
+                out.append(f"</{open_list}>")
+            if tag:
+                out.append(f"<{tag}>")
+            open_list = tag
+        if kind == "heading":
+            level = min(arg + 1, 6) # The document title is the only h1
+            out.append(f"<h{level}>{_html_inline(content)}</h{level}>")
+        elif kind == "item":
+            out.append(f"<li>{_html_inline(content)}</li>")
+        elif kind == "table":
+            head, *rows = content
+            out.append("<table><thead><tr>" + "".join(f"<th>{_html_inline(c)}</th>" for c in head) + "</tr></thead>")
+            out.append("<tbody>" + "".join(
+                "<tr>" + "".join(f"<td>{_html_inline(c)}</td>" for c in row) + "</tr>" for row in rows
+            ) + "</tbody></table>")
+        else:
+            out.append(f"<p>{_html_inline(content)}</p>")
+    if open_list:
+        out.append(f"</{open_list}>")
+
+    if images:
+        out.append("<h2>Charts</h2>")
+    for caption, image_path in images:
+        data = base64.b64encode(_image(image_path)).decode('ascii')
+        caption = html.escape(caption)
+        out.append(f'<figure><img src="data:image/png;base64,{data}" alt="{caption}">'
+                   f'<figcaption>{caption}</figcaption></figure>')
+
+    document = HTML_TEMPLATE.substitute(title=html.escape(title), body="\n".join(out))
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(document)
+
+
+def _new_pdf():
+    """
+    A blank FPDF document with the report fonts loaded. The fonts are
+    parsed once per process; later documents are copies of the first.
+    Returns (pdf, font family, text filter).
+    """
+    global _pdf_template
+    if _pdf_template is None:
+        pdf = FPDF()
+        family, clean = "Helvetica", sanitize_text
+        try:
+            import matplotlib
+            font_dir = os.path.join(matplotlib.get_data_path(), 'fonts', 'ttf')
+            for style, name in PDF_FONTS:
+                pdf.add_font("DejaVu", style, os.path.join(font_dir, name))
+            family, clean = "DejaVu", str
+        except Exception as e:
+            logger.warning(f"Export fonts unavailable, using Helvetica: {e}")
+            pdf = FPDF()
+        pdf.set_auto_page_break(True, margin=15)
+        _pdf_template = (pdf, family, clean)
+    pdf, family, clean = _pdf_template
+    return copy.deepcopy(pdf), family, clean
+
+
+def render_pdf(title, report, images, path):
+    """
+    Writes the report as a PDF to path. images are (caption, PNG path)
+    pairs, placed after the narrative.
+    """
+    pdf, family, clean = _new_pdf()
+    pdf.add_page()
+
+    def write(text, size, height=6):
+        for span_style, piece in inline_spans(clean(text)):
+            pdf.set_font(family, 'I' if span_style == 'code' else span_style, size)
+            pdf.write(height, piece)
+        pdf.ln(height)
+
+    pdf.set_font(family, 'B', 18)
+    pdf.multi_cell(0, 10, clean(title), align='C', new_x="LMARGIN", new_y="NEXT")
+    pdf.ln(4)
+    for kind, arg, content in parse_markdown(report):
+        if kind == "heading":
+            pdf.ln(3)
+            pdf.set_font(family, 'B', max(16 - 2 * arg, 11))
+            pdf.multi_cell(0, 8, clean(re.sub(r'[*_`]', '', content)), new_x="LMARGIN", new_y="NEXT")
+        elif kind == "item":
+            pdf.set_font(family, '', 11)
+            marker = f"{arg}." if arg else "-"
+            pdf.set_x(pdf.l_margin + 4)
+            pdf.write(6, f"{marker} ")
+            # Wrapped lines stay indented under the item
+            margin = pdf.l_margin
+            pdf.set_left_margin(pdf.get_x())
+            write(content, 11)
+            pdf.set_left_margin(margin)
+        elif kind == "table":
+            pdf.set_font(family, '', 9)
+            with pdf.table(first_row_as_headings=True) as table:
+                for cells in content:
+                    row = table.row()
+                    for cell in cells:
+                        row.cell(clean(re.sub(r'[*_`]', '', cell)))
+            pdf.ln(2)
+        else:
+            write(content, 11)
+            pdf.ln(2)
+
+    if images:
+        pdf.ln(4)
+        pdf.set_font(family, 'B', 14)
+        pdf.multi_cell(0, 8, "Charts", new_x="LMARGIN", new_y="NEXT")
+    for caption, image_path in images:
+        data = _image(image_path)
+        width = pdf.epw * 0.9
+        # PNG size from its header; the caption moves to the next page
+        # with the chart rather than being left behind
+        pixels_wide, pixels_high = struct.unpack('>II', data[16:24])
+        if pdf.get_y() + 8 + width * pixels_high / pixels_wide > pdf.page_break_trigger:
+            pdf.add_page()
+        pdf.set_font(family, 'B', 11)
+        pdf.multi_cell(0, 8, clean(caption), new_x="LMARGIN", new_y="NEXT")
+        pdf.image(io.BytesIO(data), x='C', w=width)
+        pdf.ln(4)
+    pdf.output(path)
+
+
+RENDERERS = {"html": render_html, "pdf": render_pdf}
+
+
+def _render(fmt, title, report, images, temp_path, path):
+    """
+    Renders to temp_path, then moves the document into place, so it is
+    published before whoever waits for the render hears back.
+    """
+    RENDERERS[fmt](title, report, images, temp_path)
+    os.replace(temp_path, path)
+
+
+# --- Service ---
+
+class Exporter:
+    """
+    Renders reports (narrative markdown plus chart PNGs) to HTML or PDF
+    in a process pool, off the API threads. Finished documents are kept
+    in a PlotStore named by a hash of the report, format, title and chart
+    files, so exporting the same report again is a file lookup, and
+    concurrent exports of the same document share one render.
+    With workers 0, documents render in the calling thread.
+    """
+
+    def __init__(self, store, workers=2, timeout=60.0):
+        self.store = store
+        self.workers = workers
+        self.timeout = timeout
+        self._pool = WorkerPool(workers, initializer=_init_worker)
+        self._lock = threading.RLock()
+        self._pending = {} # document name -> future of its render
+        self.renders = 0
+        self.failures = 0
+
+    def name(self, fmt, report, title, images):
+        """
+        Store name of a document; images are (caption, PNG path) pairs.
+        Chart files are named by content, so their names stand for them.
+        """
+        report_hash = hashlib.sha256(report.encode('utf-8')).hexdigest()
+        key = [EXPORT_VERSION, fmt, title, report_hash, [[c, os.path.basename(p)] for c, p in images]]
+        return self.store.name("report", key, suffix=f".{fmt}")
+
+    @telemetry.span("export")
+    def export(self, fmt, report, title, images):
+        """
+        Renders (or reuses) a document. Returns (name in the store,
+        cached). Raises ValueError for an unavailable format and
+        TimeoutError when the render takes over timeout seconds.
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported export format '{fmt}'. Available: {', '.join(FORMATS)}.")
+        name = self.name(fmt, report, title, images)
+        if self.store.exists(name):
+            return name, True
+
+        if self.workers <= 0:
+            self._render_here(fmt, title, report, images, name)
+            return name, False
+
+        with self._lock:
+            future = self._pending.get(name)
+            if future is None:
+                if self.store.exists(name): # Finished since the check above
+                    return name, True
+                temp_path = self.store.temp_path(name)
+                future = self._pending[name] = self._pool.submit(
+                    _render, fmt, title, report, images, temp_path, self.store.path(name))
+                future.add_done_callback(lambda f: self._finish(f, name, temp_path))
+        try:
+            future.result(timeout=self.timeout)
+        except FutureTimeout:
+            logger.warning(f"Export {name} timed out after {self.timeout}s")
+            with self._lock:
+                # The next export of this document starts a fresh render
+                if self._pending.get(name) is future:
+                    del self._pending[name]
+            # Replaces the pool without cutting short other exports
+            self._pool.retire([future])
+            raise TimeoutError(f"Export did not finish within {self.timeout:g} seconds.")
+        except BrokenProcessPool as e:
+            raise RuntimeError(f"Export worker died: {e}") from e
+        return name, False
+
+    def _render_here(self, fmt, title, report, images, name):
+        temp_path = self.store.temp_path(name)
+        try:
+            _render(fmt, title, report, images, temp_path, self.store.path(name))
+        except Exception:
+            self.store.discard(temp_path)
+            with self._lock:
+                self.failures += 1
+            raise
+        self.store.record_write()
+        with self._lock:
+            self.renders += 1
+
+    def _finish(self, future, name, temp_path):
+        """
+        Bookkeeping for a finished render (the worker published the
+        document) or clean-up of a failed one; runs once per render,
+        whoever is waiting on it.
+        """
+        ok = not future.cancelled() and future.exception() is None
+        if ok:
+            self.store.record_write()
+        else:
+            self.store.discard(temp_path)
+        with self._lock:
+            if self._pending.get(name) is future:
+                del self._pending[name]
+            if ok:
+                self.renders += 1
+            else:
+                self.failures += 1
+
+    def stats(self):
+        stats = self.store.stats()
+        with self._lock:
+            stats.update(formats=list(FORMATS), workers=self.workers, renders=self.renders,
+                         failures=self.failures, in_progress=len(self._pending))
+        return stats
+
+
+def from_env():
+    """
+    Builds an Exporter from EXPORT_* environment variables.
+    """
+    store = plot_store.PlotStore(
+        os.getenv("EXPORT_STORE_DIR") or os.path.join(tempfile.gettempdir(), "datanarrator_exports"),
+        max_bytes=int(os.getenv("EXPORT_STORE_MAX_BYTES", 256 * 1024 * 1024)),
+        ttl_seconds=int(os.getenv("EXPORT_STORE_TTL_SECONDS", plot_store.DEFAULT_TTL_SECONDS)),
+        gc_interval_seconds=int(os.getenv("EXPORT_STORE_GC_INTERVAL_SECONDS", 600)),
+    )
+    return Exporter(store, workers=int(os.getenv("EXPORT_WORKERS", min(2, os.cpu_count() or 1))),
+                    timeout=float(os.getenv("EXPORT_TIMEOUT_SECONDS", 60)))
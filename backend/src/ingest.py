@@ -0,0 +1,342 @@
+import codecs
+import hashlib
+import io
+import pandas as pd
+from . import telemetry
+
+# Bytes inspected to guess the text encoding of CSV uploads
+SAMPLE_SIZE = 64 * 1024
+# Read size used when hashing uploads
+HASH_CHUNK_SIZE = 1024 * 1024
+
+CSV_EXTENSIONS = ('.csv',)
+EXCEL_EXTENSIONS = ('.xls', '.xlsx')
+JSON_EXTENSIONS = ('.json',)
+JSON_LINES_EXTENSIONS = ('.jsonl', '.ndjson')
+
+# Rows per chunk when a file is streamed instead of loaded whole
+DEFAULT_CHUNK_SIZE = 100_000
+# Bytes requested from the client per read when parsing a request body
+STREAM_READ_SIZE = 256 * 1024
+
+
+class UploadTooLarge(ValueError):
+    """
+    An upload exceeded the configured byte or row limit.
+    """
+
+
+class Dataset:
+    """
+    A parsed upload, shared by the brain, analyst and plotter so the
+    file is only read once per request.
+    """
+
+    def __init__(self, df, filename, file_format, encoding=None):
+        self.df = df
+        self.filename = filename
+        self.format = file_format
+        self.encoding = encoding
+        # SHA-256 of the raw upload, set by callers that hashed it
+        self.digest = None
+        # Column profile, filled lazily by profiler.get_profile
+        self.profile = None
+        # Drill-down query engine, built lazily by query.get_engine
+        self.query_engine = None
+        # The sampling.Sample these rows were drawn as, for fast-mode uploads
+        self.sample = None
+
+    @property
+    def empty(self):
+        return self.df.empty
+
+    def __repr__(self):
+        return f"<Dataset {self.filename!r} {self.format} {self.df.shape}>"
+
+
+def as_frame(data):
+    """
+    Returns the DataFrame behind a Dataset, or the argument itself if it
+    already is a DataFrame.
+    """
+    if isinstance(data, Dataset):
+        return data.df
+    return data
+
+
+def detect_format(filename):
+    """
+    Maps a filename to 'csv', 'excel', 'json', 'jsonl' or None.
+    """
+    filename = (filename or '').lower()
+    if filename.endswith(CSV_EXTENSIONS):
+        return 'csv'
+    if filename.endswith(EXCEL_EXTENSIONS):
+        return 'excel'
+    if filename.endswith(JSON_EXTENSIONS):
+        return 'json'
+    if filename.endswith(JSON_LINES_EXTENSIONS):
+        return 'jsonl'
+    return None
+
+
+def detect_encoding(sample):
+    """
+    Guesses the text encoding from a leading byte sample.
+    UTF-8 is preferred; cp1252 and finally latin-1 (which never fails)
+    cover legacy spreadsheet exports.
+    """
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+
+    # The sample may end in the middle of a multi-byte character,
+    # so decode incrementally without flushing.
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+
+    try:
+        sample.decode('cp1252')
+        return 'cp1252'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+
+@telemetry.span("hash")
+def hash_file(file):
+    """
+    Returns the SHA-256 hex digest of the file contents, read in chunks.
+    Leaves the file pointer at the start.
+    """
+    sha = hashlib.sha256()
+    file.seek(0)
+    while True:
+        chunk = file.read(HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        sha.update(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+    file.seek(0)
+    return sha.hexdigest()
+
+
+def sniff_encoding(file):
+    """
+    Reads a sample from the start of the file and detects its encoding.
+    Leaves the file pointer at the start.
+    """
+    file.seek(0)
+    sample = file.read(SAMPLE_SIZE)
+    file.seek(0)
+    if isinstance(sample, str):
+        return None
+    return detect_encoding(sample)
+
+
+def _binary_stream(file):
+    """
+    The byte stream behind an upload. pandas does not recognise Werkzeug's
+    FileStorage as a binary file and decodes it as UTF-8 whatever encoding
+    it is given; the stream underneath is read with the requested one.
+    """
+    return getattr(file, 'stream', file)
+
+
+def _read_csv(file):
+    encoding = sniff_encoding(file)
+    stream = _binary_stream(file)
+    try:
+        return pd.read_csv(stream, encoding=encoding), encoding
+    except UnicodeDecodeError:
+        # The sample looked fine but a later byte did not; latin-1 maps
+        # every byte to a character, so decoding cannot fail again.
+        stream.seek(0)
+        return pd.read_csv(stream, encoding='latin-1'), 'latin-1'
+
+
+@telemetry.span("load")
+def read_dataset(file):
+    """
+    Parses an uploaded CSV, Excel, or JSON file exactly once.
+    Returns a Dataset. Raises ValueError if the file cannot be parsed.
+    """
+    file_format = detect_format(file.filename)
+
+    try:
+        file.seek(0)
+        if file_format == 'csv':
+            df, encoding = _read_csv(file)
+            return Dataset(df, file.filename, 'csv', encoding)
+
+        if file_format == 'excel':
+            return Dataset(pd.read_excel(file), file.filename, 'excel')
+
+        if file_format == 'json':
+            return Dataset(pd.read_json(file), file.filename, 'json')
+
+        if file_format == 'jsonl':
+            return Dataset(pd.read_json(file, lines=True), file.filename, 'jsonl')
+
+        # Fallback for unknown extensions, try CSV then Excel
+        try:
+            df, encoding = _read_csv(file)
+            return Dataset(df, file.filename, 'csv', encoding)
+        except Exception:
+            file.seek(0)
+            return Dataset(pd.read_excel(file), file.filename, 'excel')
+
+    except Exception as e:
+        raise ValueError(f"Failed to load file '{file.filename}': {str(e)}") from e
+    finally:
+        file.seek(0)
+
+
+def file_size(file):
+    """
+    Returns the size in bytes of a seekable upload.
+    """
+    file.seek(0, 2)
+    size = file.tell()
+    file.seek(0)
+    return size
+
+
+def can_stream(file):
+    """
+    True if the file's format can be parsed chunk by chunk.
+    """
+    return detect_format(file.filename) in ('csv', 'jsonl')
+
+
+def iter_chunks(file, chunksize=DEFAULT_CHUNK_SIZE):
+    """
+    Yields DataFrame chunks of a CSV or JSON-lines file without loading
+    the whole file into memory.
+    """
+    file_format = detect_format(file.filename)
+    file.seek(0)
+    if file_format == 'csv':
+        # A bad byte past the sniffed sample cannot restart a stream that is
+        # half consumed; it becomes U+FFFD instead of failing the upload
+        reader = pd.read_csv(_binary_stream(file), encoding=sniff_encoding(file), encoding_errors='replace',
+                             chunksize=chunksize)
+    elif file_format == 'jsonl':
+        reader = pd.read_json(file, lines=True, chunksize=chunksize)
+    else:
+        raise ValueError(f"Cannot stream '{file.filename}'. Only CSV and JSON-lines files can be read in chunks.")
+
+    with reader:
+        for chunk in reader:
+            yield chunk
+
+
+@telemetry.span("load", partial=True)
+def read_head(file, nrows):
+    """
+    Parses only the first nrows rows of a streamable file into a Dataset.
+    """
+    file_format = detect_format(file.filename)
+    try:
+        file.seek(0)
+        if file_format == 'csv':
+            encoding = sniff_encoding(file)
+            df = pd.read_csv(_binary_stream(file), encoding=encoding, encoding_errors='replace', nrows=nrows)
+            return Dataset(df, file.filename, 'csv', encoding)
+        if file_format == 'jsonl':
+            return Dataset(pd.read_json(file, lines=True, nrows=nrows), file.filename, 'jsonl')
+        raise ValueError("Only CSV and JSON-lines files can be read partially.")
+    except Exception as e:
+        raise ValueError(f"Failed to load file '{file.filename}': {str(e)}") from e
+    finally:
+        file.seek(0)
+
+
+class UploadStream(io.RawIOBase):
+    """
+    Read-only view of a request body that hashes and counts bytes as the
+    parser pulls them, and stops with UploadTooLarge as soon as max_bytes
+    is exceeded. Nothing is buffered beyond the parser's read size, except
+    the leading sample kept by sample() for encoding detection.
+    """
+
+    def __init__(self, stream, max_bytes=None):
+        self.stream = stream
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+        self._sha = hashlib.sha256()
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def _pull(self, size):
+        data = self.stream.read(size)
+        if data:
+            self.bytes_read += len(data)
+            if self.max_bytes and self.bytes_read > self.max_bytes:
+                raise UploadTooLarge(f"Upload exceeds the {self.max_bytes} byte limit.")
+            self._sha.update(data)
+        return data
+
+    def sample(self, size=SAMPLE_SIZE):
+        """
+        Returns up to size leading bytes without consuming them.
+        """
+        while len(self._pending) < size:
+            data = self._pull(size - len(self._pending))
+            if not data:
+                break
+            self._pending += data
+        return self._pending[:size]
+
+    def readinto(self, buffer):
+        size = len(buffer)
+        if self._pending:
+            data, self._pending = self._pending[:size], self._pending[size:]
+        else:
+            data = self._pull(min(size, STREAM_READ_SIZE))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def hexdigest(self):
+        """
+        SHA-256 of the bytes read so far (the whole upload once drained).
+        """
+        return self._sha.hexdigest()
+
+    def drain(self):
+        """
+        Reads whatever the parser left unread, so the digest covers the
+        whole body.
+        """
+        while self._pending or self._pull(STREAM_READ_SIZE):
+            self._pending = b''
+
+
+def iter_stream_chunks(stream, file_format, chunksize=DEFAULT_CHUNK_SIZE, max_rows=None):
+    """
+    Parses a CSV or JSON-lines UploadStream chunk by chunk while it is
+    still arriving. Raises UploadTooLarge once more than max_rows rows
+    have been parsed, and ValueError for other formats.
+    """
+    if file_format not in ('csv', 'jsonl'):
+        raise ValueError("Only CSV and JSON-lines files can be uploaded as a stream.")
+
+    encoding = detect_encoding(stream.sample())
+    buffered = io.BufferedReader(stream, buffer_size=STREAM_READ_SIZE)
+    # Bytes cannot be re-read, so undecodable ones are replaced instead of
+    # restarting with another encoding as _read_csv does
+    if file_format == 'csv':
+        reader = pd.read_csv(buffered, encoding=encoding, encoding_errors='replace', chunksize=chunksize)
+    else:
+        text = io.TextIOWrapper(buffered, encoding=encoding, errors='replace')
+        reader = pd.read_json(text, lines=True, chunksize=chunksize)
+
+    rows = 0
+    with reader:
+        for chunk in reader:
+            rows += len(chunk)
+            if max_rows and rows > max_rows:
+                raise UploadTooLarge(f"Upload exceeds the {max_rows} row limit.")
+            yield chunk
@@ -0,0 +1,274 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from . import telemetry
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATES = ('done', 'failed', 'cancelled')
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """
+    A unit of background work made of named stages.
+    Progress and status changes bump `version` and wake any waiters, which
+    lets the status endpoints long-poll or stream Server-Sent Events.
+    """
+
+    def __init__(self, kind, stages, weight=0):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.weight = weight
+        self.status = 'queued'
+        self.stages = {name: {"status": "pending", "progress": 0.0, "seconds": None} for name in stages}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.version = 0
+        self._cancel = threading.Event()
+        self._changed = threading.Condition()
+        self._stage_started = {}
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def finished(self):
+        return self.status in TERMINAL_STATES
+
+    def check_cancelled(self):
+        """
+        Raises JobCancelled if cancellation was requested. Long-running
+        stages call this between units of work.
+        """
+        if self._cancel.is_set():
+            raise JobCancelled()
+
+    @contextmanager
+    def stage(self, name):
+        self.check_cancelled()
+        self._stage_started[name] = time.time()
+        self._update_stage(name, status="running")
+        try:
+            yield
+        except JobCancelled:
+            self._update_stage(name, status="cancelled")
+            raise
+        except Exception:
+            self._update_stage(name, status="failed")
+            raise
+        self._update_stage(name, status="done", progress=1.0)
+
+    def skip_pending(self):
+        """
+        Marks stages that never ran (e.g. after a cache hit) as skipped.
+        """
+        for name, stage in self.stages.items():
+            if stage["status"] == "pending":
+                stage["status"] = "skipped"
+                stage["progress"] = 1.0
+        self._notify()
+
+    def set_progress(self, name, fraction):
+        self._update_stage(name, progress=max(0.0, min(1.0, float(fraction))))
+
+    def _update_stage(self, name, status=None, progress=None):
+        stage = self.stages.setdefault(name, {"status": "pending", "progress": 0.0, "seconds": None})
+        if status is not None:
+            stage["status"] = status
+            if status in ('done', 'failed', 'cancelled') and name in self._stage_started:
+                stage["seconds"] = round(time.time() - self._stage_started[name], 3)
+        if progress is not None:
+            stage["progress"] = progress
+        self._notify()
+
+    def _set_status(self, status):
+        self.status = status
+        if status == 'running':
+            self.started_at = time.time()
+        elif status in TERMINAL_STATES:
+            self.finished_at = time.time()
+        self._notify()
+
+    def _notify(self):
+        with self._changed:
+            self.version += 1
+            self._changed.notify_all()
+
+    def wait_for_change(self, version, timeout=None):
+        """
+        Blocks until the job changes past `version` (or timeout).
+        Returns the current version.
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version or self.finished, timeout)
+            return self.version
+
+    def progress(self):
+        if not self.stages:
+            return 1.0 if self.finished else 0.0
+        return round(sum(s["progress"] for s in self.stages.values()) / len(self.stages), 3)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress(),
+            "stages": {name: dict(stage) for name, stage in self.stages.items()},
+            "error": self.error,
+            "version": self.version,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """
+    Runs jobs on a bounded thread pool.
+    Jobs whose weight (e.g. upload size in bytes) exceeds heavy_threshold
+    are additionally limited to max_heavy at a time, so a single huge file
+    cannot occupy every worker. Heavy jobs wait in the queue without
+    holding a worker, and light jobs queued behind them still start.
+    """
+
+    def __init__(self, max_workers=4, max_heavy=1, heavy_threshold=100 * 1024 * 1024,
+                 max_queued=64, ttl_seconds=3600):
+        self.max_workers = max_workers
+        self.max_heavy = max_heavy
+        self.heavy_threshold = heavy_threshold
+        self.max_queued = max_queued
+        self.ttl_seconds = ttl_seconds
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._queue = deque()
+        self._running = 0
+        self._running_heavy = 0
+
+    def submit(self, kind, fn, stages=(), weight=0):
+        """
+        Queues fn(job) and returns the Job immediately.
+        Raises RuntimeError if the queue is full.
+        """
+        job = Job(kind, stages, weight)
+        with self._lock:
+            self._prune()
+            if len(self._queue) >= self.max_queued:
+                raise RuntimeError("Too many queued jobs. Please try again shortly.")
+            self._jobs[job.id] = job
+            self._queue.append((job, fn))
+            self._dispatch()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancels a queued job immediately, or asks a running one to stop at
+        its next stage boundary. Returns the job, or None if unknown.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return job
+            job._cancel.set()
+            for i, (queued, _) in enumerate(self._queue):
+                if queued is job:
+                    del self._queue[i]
+                    job._set_status('cancelled')
+                    break
+        return job
+
+    def stats(self):
+        with self._lock:
+            return {
+                "running": self._running,
+                "running_heavy": self._running_heavy,
+                "queued": len(self._queue),
+                "max_workers": self.max_workers,
+                "max_heavy": self.max_heavy,
+            }
+
+    def _is_heavy(self, job):
+        return job.weight > self.heavy_threshold
+
+    def _dispatch(self):
+        # Caller holds the lock
+        i = 0
+        while self._running < self.max_workers and i < len(self._queue):
+            job, fn = self._queue[i]
+            heavy = self._is_heavy(job)
+            if heavy and self._running_heavy >= self.max_heavy:
+                i += 1
+                continue
+            del self._queue[i]
+            self._running += 1
+            if heavy:
+                self._running_heavy += 1
+            self._pool.submit(self._run, job, fn)
+
+    def _run(self, job, fn):
+        token = telemetry.start_trace(f"job:{job.kind}")
+        try:
+            job.check_cancelled()
+            job._set_status('running')
+            job.result = fn(job)
+            job._set_status('done')
+        except JobCancelled:
+            job._set_status('cancelled')
+        except Exception as e:
+            logger.exception(f"Job {job.id} ({job.kind}) failed: {e}")
+            job.error = str(e)
+            job._set_status('failed')
+        finally:
+            telemetry.end_trace(token, job.status)
+            with self._lock:
+                self._running -= 1
+                if self._is_heavy(job):
+                    self._running_heavy -= 1
+                self._dispatch()
+
+    def _prune(self):
+        # Caller holds the lock
+        cutoff = time.time() - self.ttl_seconds
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+def stage(job, name):
+    """
+    job.stage(name) when running as a job, otherwise a no-op context, so
+    pipeline code can be shared by synchronous and background callers.
+    """
+    return job.stage(name) if job is not None else nullcontext()
+
+
+def from_env():
+    """
+    Builds a JobManager configured from JOB_* environment variables.
+    """
+    return JobManager(
+        max_workers=int(os.getenv("JOB_WORKERS", 4)),
+        max_heavy=int(os.getenv("JOB_MAX_HEAVY", 1)),
+        heavy_threshold=int(os.getenv("JOB_HEAVY_BYTES", 100 * 1024 * 1024)),
+        max_queued=int(os.getenv("JOB_MAX_QUEUED", 64)),
+        ttl_seconds=int(os.getenv("JOB_TTL_SECONDS", 3600)),
+    )
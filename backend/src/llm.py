@@ -0,0 +1,471 @@
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from . import prompting, telemetry
+
+logger = logging.getLogger(__name__)
+
+
+class LLMError(Exception):
+    pass
+
+
+class MissingAPIKey(LLMError):
+    pass
+
+
+class CircuitOpen(LLMError):
+    """
+    A model was skipped because its circuit breaker refused the call.
+    """
+
+
+class AllModelsFailed(LLMError):
+    def __init__(self, last_error):
+        super().__init__(str(last_error))
+        self.last_error = last_error
+
+
+# --- Backends ---
+
+class GeminiBackend:
+    """
+    Long-lived Gemini client: the SDK is configured once and a
+    GenerativeModel is kept per model name.
+    """
+
+    def __init__(self, api_key):
+        import google.generativeai as genai
+        self._genai = genai
+        genai.configure(api_key=api_key)
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _model(self, model_name):
+        with self._lock:
+            model = self._models.get(model_name)
+            if model is None:
+                model = self._models[model_name] = self._genai.GenerativeModel(model_name)
+            return model
+
+    def generate(self, model_name, prompt):
+        return self._model(model_name).generate_content(prompt).text
+
+    def stream(self, model_name, prompt):
+        response = self._model(model_name).generate_content(prompt, stream=True)
+        for chunk in response:
+            text = chunk.text
+            if text:
+                yield text
+
+
+class FakeBackend:
+    """
+    Local stand-in for Gemini, for development, tests and benchmarks.
+    `latency` is seconds per call (a number or a {model: seconds} dict);
+    models listed in `failing` always raise a rate-limit style error, and
+    models in `fail_mid_stream` fail after streaming part of the reply.
+    """
+
+    def __init__(self, latency=0.05, failing=(), reply=None, fail_mid_stream=(), token_delay=0.0):
+        self.latency = latency
+        self.failing = set(failing)
+        self.reply = reply
+        self.fail_mid_stream = set(fail_mid_stream)
+        self.token_delay = token_delay
+        self.calls = []
+
+    def _latency(self, model_name):
+        if isinstance(self.latency, dict):
+            return self.latency.get(model_name, 0.0)
+        return self.latency
+
+    def generate(self, model_name, prompt):
+        self.calls.append(model_name)
+        time.sleep(self._latency(model_name))
+        if model_name in self.failing:
+            raise RuntimeError(f"429 Resource has been exhausted (fake backend, {model_name})")
+        if self.reply is not None:
+            return self.reply
+        return f"# Report\n\nFake response from {model_name} for a {len(prompt)}-character prompt."
+
+    def stream(self, model_name, prompt):
+        text = self.generate(model_name, prompt)
+        tokens = text.split(' ')
+        for i, token in enumerate(tokens):
+            if model_name in self.fail_mid_stream and i == len(tokens) // 2:
+                raise RuntimeError(f"503 Stream interrupted (fake backend, {model_name})")
+            time.sleep(self.token_delay)
+            yield token if i == 0 else ' ' + token
+
+
+# --- Health tracking ---
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls
+    for `cooldown` seconds; then lets one probe through (half-open) and
+    closes again on success.
+    """
+
+    def __init__(self, failure_threshold=3, cooldown=30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probing = False # A half-open probe is in flight
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return 'half_open'
+        return 'open'
+
+    def available(self):
+        """
+        True if allow() would let a call through, without claiming the probe.
+        """
+        state = self.state
+        return state == 'closed' or (state == 'half_open' and not self.probing)
+
+    def allow(self):
+        """
+        (allowed, probe): whether a call may go ahead, and whether it took
+        the probe. While half-open, only the first caller gets through, as
+        the probe; the others are refused until it has succeeded or failed.
+        """
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True, False
+            if state == 'open' or self.probing:
+                return False, False
+            self.probing = True
+            return True, True
+
+    def release(self):
+        """
+        Ends a probe that finished without an outcome (cancelled by the
+        client). Only the caller that took the probe may release it.
+        """
+        with self._lock:
+            self.probing = False
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+
+class ModelHealth:
+    """
+    Per-model call counters, latency (EWMA) and circuit breaker.
+    """
+
+    def __init__(self, failure_threshold, cooldown):
+        self.breaker = CircuitBreaker(failure_threshold, cooldown)
+        self.calls = 0
+        self.failures = 0
+        self.latency_ewma = None
+        self.ttft_ewma = None
+        self.last_error = None
+
+    def record_first_token(self, seconds):
+        self.ttft_ewma = seconds if self.ttft_ewma is None else 0.8 * self.ttft_ewma + 0.2 * seconds
+
+    def record(self, latency, error=None):
+        self.calls += 1
+        self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+        if error is None:
+            self.breaker.record_success()
+        else:
+            self.failures += 1
+            self.last_error = str(error)
+            self.breaker.record_failure()
+
+    def to_dict(self):
+        return {
+            "state": self.breaker.state,
+            "calls": self.calls,
+            "failures": self.failures,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "latency_ewma": None if self.latency_ewma is None else round(self.latency_ewma, 3),
+            "ttft_ewma": None if self.ttft_ewma is None else round(self.ttft_ewma, 3),
+            "last_error": self.last_error,
+        }
+
+
+# --- Router ---
+
+class ModelRouter:
+    """
+    Sends a prompt to the first healthy model of a preference list.
+    Models with an open circuit breaker are skipped (unless every model is
+    open, in which case all are probed). Failed attempts back off with
+    full jitter instead of a fixed sleep. With hedge_after set, a second
+    model is started if the first has not answered within that many
+    seconds and whichever succeeds first wins.
+    """
+
+    def __init__(self, backend, failure_threshold=3, cooldown=30.0,
+                 backoff_base=0.25, backoff_max=4.0, hedge_after=None):
+        self.backend = backend
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+        self._health = {}
+        self._lock = threading.RLock()
+        self._pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="llm")
+
+    def health(self, model_name):
+        with self._lock:
+            health = self._health.get(model_name)
+            if health is None:
+                health = self._health[model_name] = ModelHealth(self.failure_threshold, self.cooldown)
+            return health
+
+    def candidates(self, models):
+        """
+        (models to try in preference order, forced). Models whose breaker
+        is open, or half-open with its probe already in flight, are
+        skipped; if that leaves none, all are tried (forced).
+        """
+        available = [m for m in models if self.health(m).breaker.available()]
+        return (available, False) if available else (list(models), True)
+
+    def _admit(self, model_name, forced):
+        """
+        Claims a call on the model's breaker (the probe, when half-open);
+        raises CircuitOpen if another caller got there first. Returns
+        whether this call holds the probe.
+        """
+        if forced:
+            return False
+        allowed, probe = self.health(model_name).breaker.allow()
+        if not allowed:
+            raise CircuitOpen(f"Circuit breaker for {model_name} is open")
+        return probe
+
+    def _backoff(self, attempt):
+        time.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt))))
+
+    def _call(self, model_name, prompt, forced=False):
+        self._admit(model_name, forced)
+        start = time.monotonic()
+        try:
+            logger.debug(f"Trying generation with model: {model_name}")
+            text = self.backend.generate(model_name, prompt)
+        except Exception as e:
+            logger.warning(f"Model {model_name} failed: {e}")
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self.health(model_name).record(elapsed, e)
+            telemetry.llm_attempt(model_name, elapsed, "error", prompting.estimate_tokens(prompt))
+            raise
+        elapsed = time.monotonic() - start
+        with self._lock:
+            self.health(model_name).record(elapsed)
+        telemetry.llm_attempt(model_name, elapsed, "ok", prompting.estimate_tokens(prompt))
+        return text
+
+    def _hedged(self, prompt, primary, secondary, forced=False):
+        """
+        Runs primary; starts secondary if primary is slow. Returns
+        (text, model, attempted_models) or raises the last error with
+        `attempted` set on it.
+        """
+        # bind: attempts on pool threads are recorded in the caller's trace
+        futures = {self._pool.submit(telemetry.bind(self._call), primary, prompt, forced): primary}
+        done, _ = wait(futures, timeout=self.hedge_after)
+        if not done:
+            logger.info(f"{primary} slower than {self.hedge_after}s, hedging with {secondary}")
+            futures[self._pool.submit(telemetry.bind(self._call), secondary, prompt, forced)] = secondary
+
+        last_error = None
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result(), futures[future], list(futures.values())
+                except Exception as e:
+                    last_error = e
+        last_error.attempted = list(futures.values())
+        raise last_error
+
+    def generate(self, prompt, models):
+        """
+        Returns (text, model_name). Raises AllModelsFailed.
+        """
+        candidates, forced = self.candidates(models)
+        last_error = None
+        attempt = 0
+        i = 0
+        while i < len(candidates):
+            if attempt:
+                self._backoff(attempt - 1)
+            model_name = candidates[i]
+            try:
+                if self.hedge_after is not None and i + 1 < len(candidates):
+                    text, used, attempted = self._hedged(prompt, model_name, candidates[i + 1], forced)
+                    return text, used
+                return self._call(model_name, prompt, forced), model_name
+            except CircuitOpen as e: # Skipped without calling it, no need to back off
+                last_error = e
+                i += 1
+            except Exception as e:
+                last_error = e
+                i += len(getattr(e, 'attempted', [model_name]))
+                attempt += 1
+        raise AllModelsFailed(last_error)
+
+    def stream(self, prompt, models):
+        """
+        Streams a reply as event dicts:
+          {"type": "model", "model": name}   a model starts answering
+          {"type": "token", "text": str}     next piece of the reply
+          {"type": "reset", "model": name, "error": str}
+                                             the model failed mid-stream; discard
+                                             the text received so far, the next
+                                             model starts over
+        Falls back like generate() (no hedging) and raises AllModelsFailed.
+        Closing the generator (client disconnect) closes the upstream stream
+        without counting as a model failure.
+        """
+        candidates, forced = self.candidates(models)
+        prompt_tokens = prompting.estimate_tokens(prompt)
+        last_error = None
+        attempt = 0
+        for model_name in candidates:
+            try:
+                probe = self._admit(model_name, forced)
+            except CircuitOpen as e:
+                last_error = e
+                continue
+            if attempt:
+                self._backoff(attempt - 1)
+            attempt += 1
+            logger.debug(f"Trying streaming with model: {model_name}")
+            start = time.monotonic()
+            ttft = None
+            upstream = self.backend.stream(model_name, prompt)
+            try:
+                for text in upstream:
+                    if ttft is None:
+                        ttft = time.monotonic() - start
+                        with self._lock:
+                            self.health(model_name).record_first_token(ttft)
+                        yield {"type": "model", "model": model_name, "ttft": round(ttft, 3)}
+                    yield {"type": "token", "text": text}
+            except GeneratorExit:
+                if probe: # Leave another caller's probe in flight
+                    self.health(model_name).breaker.release()
+                telemetry.llm_attempt(model_name, time.monotonic() - start, "cancelled", prompt_tokens, ttft)
+                raise
+            except Exception as e:
+                logger.warning(f"Model {model_name} failed while streaming: {e}")
+                elapsed = time.monotonic() - start
+                with self._lock:
+                    self.health(model_name).record(elapsed, e)
+                telemetry.llm_attempt(model_name, elapsed, "error", prompt_tokens, ttft)
+                last_error = e
+                if ttft is not None:
+                    yield {"type": "reset", "model": model_name, "error": str(e)}
+                continue
+            finally:
+                close = getattr(upstream, 'close', None)
+                if close is not None:
+                    close()
+            elapsed = time.monotonic() - start
+            with self._lock:
+                self.health(model_name).record(elapsed)
+            telemetry.llm_attempt(model_name, elapsed, "ok", prompt_tokens, ttft)
+            return
+        raise AllModelsFailed(last_error)
+
+    def stats(self):
+        with self._lock:
+            return {name: health.to_dict() for name, health in self._health.items()}
+
+
+# --- Shared router ---
+
+_router = None
+_router_key = None
+_router_lock = threading.Lock()
+
+
+def _api_key():
+    return os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
+
+
+def build_backend():
+    """
+    Backend selected by LLM_BACKEND: 'gemini' (default) or 'fake'.
+    """
+    if os.getenv("LLM_BACKEND", "gemini").lower() == "fake":
+        failing = [m for m in os.getenv("FAKE_LLM_FAILING_MODELS", "").split(",") if m]
+        return FakeBackend(latency=float(os.getenv("FAKE_LLM_LATENCY", 0.05)), failing=failing)
+
+    api_key = _api_key()
+    if not api_key:
+        raise MissingAPIKey("Google API Key not found. Please set 'GEMINI_API_KEY' in your .env file.")
+    return GeminiBackend(api_key)
+
+
+def get_router():
+    """
+    Returns the process-wide ModelRouter, rebuilding it only if the
+    backend or API key changed.
+    """
+    global _router, _router_key
+    key = (os.getenv("LLM_BACKEND", "gemini").lower(), _api_key())
+    with _router_lock:
+        if _router is None or _router_key != key:
+            hedge_after = os.getenv("LLM_HEDGE_AFTER_SECONDS")
+            _router = ModelRouter(
+                build_backend(),
+                failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", 3)),
+                cooldown=float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", 30)),
+                hedge_after=float(hedge_after) if hedge_after else None,
+            )
+            _router_key = key
+        return _router
+
+
+def backend_name():
+    """
+    Class name of the backend get_router() answers with, e.g.
+    'GeminiBackend', without building it.
+    """
+    key = (os.getenv("LLM_BACKEND", "gemini").lower(), _api_key())
+    with _router_lock:
+        if _router is not None and _router_key == key:
+            return type(_router.backend).__name__
+    return FakeBackend.__name__ if key[0] == "fake" else GeminiBackend.__name__
+
+
+def set_router(router):
+    """
+    Installs a router explicitly (e.g. one wrapping a FakeBackend).
+    """
+    global _router, _router_key
+    with _router_lock:
+        _router = router
+        _router_key = (os.getenv("LLM_BACKEND", "gemini").lower(), _api_key())
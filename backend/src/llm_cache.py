@@ -0,0 +1,181 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from . import prompting
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), "datanarrator_llm_cache.sqlite3")
+
+
+class ResponseCache:
+    """
+    On-disk cache of LLM responses in SQLite.
+    Entries are keyed by a canonical hash of (kind, stats fingerprint,
+    instruction, model, prompt version), expire after ttl_seconds, and the
+    least recently used entries are evicted once the stored text exceeds
+    max_bytes. Safe to share between threads and processes.
+    """
+
+    def __init__(self, path, ttl_seconds=7 * 24 * 3600, max_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expired = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(kind, stats, instruction, model, version="", backend=""):
+        """
+        Canonical key: equal stats (in any key order), instruction, model,
+        prompt version and backend always give the same key. The backend
+        keeps e.g. fake replies from being served as real ones.
+        """
+        canonical = json.dumps([kind, prompting.fingerprint(stats), instruction, model, version, backend],
+                               sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def lookup(self, kind, stats, instruction, models, version="", backend=""):
+        """
+        Returns (response, model) for the most preferred model that has a
+        live entry, or None.
+        """
+        keys = {self.make_key(kind, stats, instruction, model, version, backend): model for model in models}
+        now = time.time()
+        with self._lock:
+            placeholders = ",".join("?" * len(keys))
+            rows = self._conn.execute(
+                f"SELECT key, response, created_at FROM responses WHERE key IN ({placeholders})",
+                list(keys)
+            ).fetchall()
+            live = {}
+            for key, response, created_at in rows:
+                if now - created_at > self.ttl_seconds:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.expired += 1
+                else:
+                    live[key] = response
+            for key, model in keys.items():
+                if key in live:
+                    self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                    self._conn.commit()
+                    self.hits += 1
+                    return live[key], model
+            self._conn.commit()
+            self.misses += 1
+            return None
+
+    def store(self, kind, stats, instruction, model, response, version="", backend=""):
+        """
+        Caches a successful response. Oversized responses are not stored.
+        """
+        size = len(response.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        key = self.make_key(kind, stats, instruction, model, version, backend)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, kind, model, response, size, now, now)
+            )
+            self.stores += 1
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now):
+        # Caller holds the lock
+        cursor = self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        self.expired += cursor.rowcount
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY accessed_at").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            return {
+                "entries": entries,
+                "bytes": total,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "expired": self.expired,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def from_env():
+    """
+    Builds a ResponseCache from LLM_CACHE_* environment variables, or
+    returns None when LLM_CACHE_PATH is set to an empty string.
+    """
+    path = os.getenv("LLM_CACHE_PATH", DEFAULT_PATH)
+    if not path:
+        return None
+    return ResponseCache(
+        path,
+        ttl_seconds=int(os.getenv("LLM_CACHE_TTL_SECONDS", 7 * 24 * 3600)),
+        max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    )
+
+
+def get_cache():
+    """
+    Process-wide response cache (None if disabled).
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            try:
+                _cache = from_env() or False
+            except (sqlite3.Error, OSError) as e:
+                logger.warning(f"LLM response cache disabled: {e}")
+                _cache = False
+        return _cache or None
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Chart files not used for this long are removed by the garbage collector
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+# Renders that never finished (e.g. a killed worker) are removed after this
+STALE_TEMP_SECONDS = 3600
+
+
+class PlotStore:
+    """
+    Chart images (or exported documents) named by a hash of their
+    content, so identical uploads reuse the files rendered the first time.
+    A background thread removes files unused for ttl_seconds, then the
+    least recently used ones while the total exceeds max_bytes.
+    Reusing a file refreshes its modification time.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 gc_interval_seconds=600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.gc_interval_seconds = gc_interval_seconds
+        self._lock = threading.Lock()
+        self._gc_thread = None
+        self.hits = 0
+        self.writes = 0
+        self.removed = 0
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def name(prefix, key, label=None, suffix='.png'):
+        """
+        File name for a chart (or other document, by suffix): readable
+        prefix/label plus a hash of key, any JSON-serialisable description
+        of the content. With key None the content is unknown, so the name
+        is unique.
+        """
+        if key is None:
+            digest = uuid.uuid4().hex[:16]
+        else:
+            canonical = json.dumps(key, sort_keys=True, separators=(',', ':'), default=str)
+            digest = hashlib.sha256(canonical.encode('utf-8')).hexdigest()[:16]
+        stem = f"{prefix}_{label}" if label is not None else prefix
+        return f"{re.sub(r'[^A-Za-z0-9_-]', '_', str(stem))[:48]}_{digest}{suffix}"
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def exists(self, name):
+        """
+        True if the chart was rendered before; marks it as recently used.
+        """
+        try:
+            os.utime(self.path(name))
+        except OSError:
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def temp_path(self, name):
+        """
+        Where to render a chart before commit() publishes it, so a
+        half-written file is never served. Dot files are skipped by
+        listings and removed by the GC once stale.
+        """
+        return os.path.join(self.directory, f".{uuid.uuid4().hex[:8]}-{name}")
+
+    def commit(self, temp_path, name):
+        os.replace(temp_path, self.path(name))
+        self.record_write()
+
+    def record_write(self):
+        """
+        Counts a published file (also one another process moved into
+        place) and starts the GC.
+        """
+        with self._lock:
+            self.writes += 1
+        self.start_gc()
+
+    def discard(self, temp_path):
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+    def _entries(self):
+        """
+        (mtime, size, path, is_temp) for every file in the store.
+        """
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    if entry.is_file():
+                        entries.append((st.st_mtime, st.st_size, entry.path, entry.name.startswith('.')))
+        except OSError:
+            pass
+        return entries
+
+    def gc(self):
+        """
+        Removes stale temp files, charts unused for ttl_seconds, then the
+        least recently used charts until the total fits max_bytes.
+        Returns the number of files removed.
+        """
+        now = time.time()
+        kept, removed = [], 0
+        for mtime, size, path, is_temp in sorted(self._entries()):
+            limit = STALE_TEMP_SECONDS if is_temp else self.ttl_seconds
+            if limit and now - mtime > limit:
+                removed += self._remove(path)
+            elif not is_temp:
+                kept.append((size, path))
+
+        total = sum(size for size, _ in kept)
+        for size, path in kept: # Oldest first
+            if not self.max_bytes or total <= self.max_bytes:
+                break
+            removed += self._remove(path)
+            total -= size
+        if removed:
+            logger.info(f"Plot store GC removed {removed} files")
+        return removed
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            return 0
+        with self._lock:
+            self.removed += 1
+        return 1
+
+    def start_gc(self):
+        """
+        Starts the background GC thread (once).
+        """
+        if self.gc_interval_seconds <= 0 or self._gc_thread is not None:
+            return
+        with self._lock:
+            if self._gc_thread is None:
+                self._gc_thread = threading.Thread(target=self._run_gc, name="plot-gc", daemon=True)
+                self._gc_thread.start()
+
+    def _run_gc(self):
+        while True:
+            try:
+                self.gc()
+            except Exception as e:
+                logger.warning(f"Plot store GC failed: {e}")
+            time.sleep(self.gc_interval_seconds)
+
+    def clear(self):
+        for _, _, path, _ in self._entries():
+            self._remove(path)
+
+    def stats(self):
+        entries = [e for e in self._entries() if not e[3]]
+        with self._lock:
+            return {
+                "files": len(entries),
+                "bytes": sum(size for _, size, _, _ in entries),
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "writes": self.writes,
+                "removed": self.removed,
+            }
+
+
+def from_env():
+    """
+    Builds a PlotStore from PLOT_STORE_* environment variables.
+    """
+    return PlotStore(
+        os.getenv("PLOT_STORE_DIR") or os.path.join(tempfile.gettempdir(), "datanarrator_plots"),
+        max_bytes=int(os.getenv("PLOT_STORE_MAX_BYTES", 512 * 1024 * 1024)),
+        ttl_seconds=int(os.getenv("PLOT_STORE_TTL_SECONDS", DEFAULT_TTL_SECONDS)),
+        gc_interval_seconds=int(os.getenv("PLOT_STORE_GC_INTERVAL_SECONDS", 600)),
+    )
@@ -1,72 +1,342 @@
 import matplotlib
 matplotlib.use('Agg') # Non-interactive backend
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import seaborn as sns
+import logging
 import os
-import uuid
+import time
 import pandas as pd
 import numpy as np
+from concurrent.futures import wait
+from concurrent.futures.process import BrokenProcessPool
+from . import ingest, correlation, profiler, telemetry, workers
 
-def generate_plots(df, output_dir):
+logger = logging.getLogger(__name__)
+
+# Charts are rendered in separate processes so they run in parallel and a
+# crash or hang cannot take the API worker down. 0 renders in-process.
+PLOT_WORKERS = int(os.getenv("PLOT_WORKERS", min(4, os.cpu_count() or 1)))
+# Time allowed for all the charts of one request together
+PLOT_TIMEOUT = float(os.getenv("PLOT_TIMEOUT_SECONDS", 30))
+# Part of every chart's store key; bump when the renderers change so
+# charts rendered by older code are not reused
+STYLE_VERSION = 2
+
+# Chart data sizes: histogram bins (numpy's 'auto' rule, capped), KDE grid
+# points and category bars
+HIST_MAX_BINS = 50
+BIN_SAMPLE_SIZE = 100_000
+KDE_POINTS = 256
+TOP_CATEGORIES = 10
+# Significant digits kept in chart data sent to the browser
+CHART_DIGITS = 6
+
+_theme_set = False
+
+
+def _init_worker():
+    global _theme_set
+    if not _theme_set:
+        sns.set_theme(style="whitegrid")
+        _theme_set = True
+
+
+_pool = workers.WorkerPool(PLOT_WORKERS, initializer=_init_worker)
+
+
+# --- Chart data (JSON series the frontend draws; also input to the renderers) ---
+
+def _round_sig(values, digits=CHART_DIGITS):
+    """
+    values rounded to `digits` significant digits, as a list. Keeps the
+    JSON short without visibly changing a chart.
+    """
+    values = np.asarray(values, dtype='float64')
+    with np.errstate(divide='ignore', invalid='ignore'):
+        magnitude = np.floor(np.log10(np.abs(values)))
+    scale = 10.0 ** (digits - 1 - np.where(np.isfinite(magnitude), magnitude, 0))
+    return (np.round(values * scale) / scale).tolist()
+
+
+def _histogram(values, weights=None):
+    """
+    (counts, edges) from one fixed-width np.histogram pass. The bin
+    count follows numpy's 'auto' rule (the smaller of the Sturges and
+    Freedman-Diaconis widths), capped at HIST_MAX_BINS, with the IQR
+    taken from a strided sample instead of a full percentile pass.
+    weights (rows per sampled row) scale the counts of sampled data.
+    """
+    n = len(values)
+    lo, hi = values.min(), values.max()
+    if hi <= lo:
+        return np.histogram(values, bins=1, weights=weights)
+    sample = values[::max(1, n // BIN_SAMPLE_SIZE)]
+    q1, q3 = np.percentile(sample, [25, 75])
+    width = (hi - lo) / (np.log2(n) + 1)
+    if q3 > q1:
+        width = min(width, 2 * (q3 - q1) * n ** (-1 / 3))
+    bins = int(min(HIST_MAX_BINS, max(1, np.ceil((hi - lo) / width))))
+    return np.histogram(values, bins=bins, range=(lo, hi), weights=weights)
+
+
+def _kde(values, bin_width, weights=None):
+    """
+    Gaussian KDE (Scott's bandwidth, as seaborn) evaluated on a KDE_POINTS
+    grid: values are binned onto the grid and the bin counts convolved
+    with the kernel by FFT, so the cost does not grow with len(values)
+    beyond the binning pass. Scaled to histogram counts so the curve
+    overlays the bars (weighted, like the histogram, for sampled data).
+    None for fewer than two distinct values.
+    """
+    n = len(values)
+    std = values.std() if n > 1 else 0.0
+    if not std > 0:
+        return None
+    bandwidth = std * n ** -0.2
+    lo, hi = values.min() - 3 * bandwidth, values.max() + 3 * bandwidth
+    grid_counts, edges = np.histogram(values, bins=KDE_POINTS, range=(lo, hi), weights=weights)
+    total = grid_counts.sum()
+    dx = edges[1] - edges[0]
+    offsets = np.arange(-(KDE_POINTS - 1), KDE_POINTS) * dx
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2)
+    size = 1 << int(np.ceil(np.log2(3 * KDE_POINTS)))
+    smoothed = np.fft.irfft(np.fft.rfft(grid_counts, size) * np.fft.rfft(kernel, size), size)
+    density = smoothed[KDE_POINTS - 1:2 * KDE_POINTS - 1] / (total * bandwidth * np.sqrt(2 * np.pi))
+    return {
+        "x": _round_sig(edges[:-1] + dx / 2),
+        "y": _round_sig(np.clip(density, 0, None) * total * bin_width),
+    }
+
+
+def _distribution_data(values, col, weights=None):
+    finite = np.isfinite(values)
+    values = values[finite]
+    if len(values) == 0:
+        return None
+    if weights is not None:
+        weights = weights[finite]
+    counts, edges = _histogram(values, weights)
+    bin_width = edges[1] - edges[0] if len(edges) > 1 else 1.0
+    return {
+        "type": "distribution", "title": f"Distribution of {col}", "column": col,
+        "bins": {"edges": _round_sig(edges), "counts": np.rint(counts).astype('int64').tolist()},
+        "kde": _kde(values, bin_width, weights),
+    }
+
+
+def _top_counts(series, weights=None):
+    if weights is None:
+        return series.value_counts().head(TOP_CATEGORIES)
+    totals = pd.Series(weights, index=series.index).groupby(series, observed=True).sum()
+    return np.rint(totals.nlargest(TOP_CATEGORIES)).astype('int64')
+
+
+def _category_data(top_counts, col):
+    return {
+        "type": "category", "title": f"Top {TOP_CATEGORIES} Values: {col}", "column": col,
+        "labels": [str(label) for label in top_counts.index], "counts": top_counts.to_numpy().tolist(),
+    }
+
+
+def _correlation_data(corr):
+    return {
+        "type": "correlation", "title": "Correlation Matrix",
+        "columns": [str(col) for col in corr.columns],
+        "matrix": [[None if np.isnan(v) else v for v in row] for row in corr.to_numpy().round(3).tolist()],
+    }
+
+
+@telemetry.span("chart_data")
+def chart_data(data):
     """
-    Generates static plots from the DataFrame and saves them to output_dir.
-    Returns a list of filenames.
+    The charts for a Dataset or DataFrame as compact JSON series, in a
+    fixed order (heatmap, distributions, categories): the correlation
+    matrix of the most correlated numeric columns, histogram bins plus a
+    KDE curve for up to 3 numeric columns, and the top category counts
+    for up to 3 categorical columns. No image is rendered.
+    For a Dataset of sampled rows, counts are weighted to estimate the
+    whole dataset and each chart records the sample size.
     """
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    plot_paths = []
-    
-    # Set style
-    sns.set_theme(style="whitegrid")
-    
-    # 1. Correlation Heatmap (Numeric)
-    numeric_cols = df.select_dtypes(include=[np.number]).columns
+    df = ingest.as_frame(data)
+    profile = profiler.get_profile(data)
+    sample = getattr(data, 'sample', None)
+    weights = sample.weights if sample is not None else None
+    id_cols = set(profile.id_columns())
+    charts = []
+
+    def add(kind, build, *args):
+        start = time.perf_counter()
+        try:
+            chart = build(*args)
+            if chart is not None:
+                charts.append(chart)
+            telemetry.record("chart", time.perf_counter() - start, chart=kind)
+        except Exception as e:
+            logger.warning(f"Chart data for {kind} {args[-1]!r} failed: {e}")
+            telemetry.record("chart", time.perf_counter() - start, "error", chart=kind)
+
+    # 1. Correlation Heatmap (Numeric), limited to the most correlated columns
+    numeric_cols = profile.numeric_columns()
     if len(numeric_cols) > 1:
-        plt.figure(figsize=(10, 8))
-        corr = df[numeric_cols].corr()
-        sns.heatmap(corr, annot=True, cmap='coolwarm', fmt=".2f", linewidths=0.5)
-        plt.title('Correlation Matrix')
-        plt.tight_layout()
-        
-        filename = f"heatmap_{uuid.uuid4().hex[:8]}.png"
-        path = os.path.join(output_dir, filename)
-        plt.savefig(path)
-        plt.close()
-        plot_paths.append({"file": filename, "type": "correlation", "title": "Correlation Matrix"})
+        add("correlation", lambda cols: _correlation_data(correlation.matrix(df, correlation.top_columns(df, cols))),
+            numeric_cols)
 
     # 2. Distribution Plots (Top 3 Numeric)
-    # Filter out ID-like columns (too many unique values matches count) or low variance
-    for col in numeric_cols[:3]: # Limit to first 3 for now
-        plt.figure(figsize=(8, 6))
-        sns.histplot(df[col].dropna(), kde=True, color='skyblue')
-        plt.title(f'Distribution of {col}')
-        plt.xlabel(col)
-        plt.ylabel('Frequency')
-        plt.tight_layout()
-        
-        filename = f"dist_{col}_{uuid.uuid4().hex[:8]}.png".replace(' ', '_').replace('/', '_')
-        path = os.path.join(output_dir, filename)
-        plt.savefig(path)
-        plt.close()
-        plot_paths.append({"file": filename, "type": "distribution", "title": f"Distribution of {col}"})
+    # Filter out ID-like columns (every sampled value unique); their histograms are flat
+    for col in [c for c in numeric_cols if c not in id_cols][:3]: # Limit to first 3 for now
+        add("distribution", lambda col: _distribution_data(df[col].to_numpy(dtype='float64', na_value=np.nan), col, weights),
+            col)
 
     # 3. Categorical Bar Charts (Top 3 Object)
-    cat_cols = df.select_dtypes(include=['object', 'category']).columns
+    cat_cols = [c for c in profile.categorical_columns() if c not in id_cols]
     for col in cat_cols[:3]:
-        # Top 10 values
-        top_counts = df[col].value_counts().head(10)
-        
-        plt.figure(figsize=(10, 6))
-        sns.barplot(x=top_counts.values, y=top_counts.index, palette='viridis')
-        plt.title(f'Top 10 {col}')
-        plt.xlabel('Count')
-        plt.tight_layout()
-        
-        filename = f"cat_{col}_{uuid.uuid4().hex[:8]}.png".replace(' ', '_').replace('/', '_')
-        path = os.path.join(output_dir, filename)
-        plt.savefig(path)
-        plt.close()
-        plot_paths.append({"file": filename, "type": "category", "title": f"Top 10 Values: {col}"})
-
-    return plot_paths
+        add("category", lambda col: _category_data(_top_counts(profiler.restore_text(df[col], profile.columns.get(col)),
+                                                               weights), col), col)
+
+    if sample is not None:
+        for chart in charts:
+            chart["sample_rows"] = sample.rows
+    return charts
+
+
+# --- Renderers (run inside worker processes; only use the Figure API) ---
+
+def _render_heatmap(chart, path):
+    _init_worker()
+    fig = Figure(figsize=(10, 8))
+    ax = fig.subplots()
+    corr = pd.DataFrame(np.array(chart["matrix"], dtype='float64'), index=chart["columns"], columns=chart["columns"])
+    sns.heatmap(corr, annot=True, cmap='coolwarm', fmt=".2f", linewidths=0.5, ax=ax)
+    ax.set_title(chart["title"])
+    fig.tight_layout()
+    fig.savefig(path)
+
+
+def _render_distribution(chart, path):
+    _init_worker()
+    fig = Figure(figsize=(8, 6))
+    ax = fig.subplots()
+    edges = np.asarray(chart["bins"]["edges"])
+    ax.bar(edges[:-1], chart["bins"]["counts"], width=np.diff(edges), align='edge',
+           color='skyblue', edgecolor='white', alpha=0.8)
+    if chart.get("kde"):
+        ax.plot(chart["kde"]["x"], chart["kde"]["y"], color='steelblue', linewidth=2)
+    ax.set_title(chart["title"])
+    ax.set_xlabel(chart["column"])
+    ax.set_ylabel('Frequency')
+    fig.tight_layout()
+    fig.savefig(path)
+
+
+def _render_category(chart, path):
+    _init_worker()
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    labels = chart["labels"]
+    sns.barplot(x=chart["counts"], y=labels, hue=labels, palette='viridis', legend=False, ax=ax)
+    ax.set_title(f'Top {TOP_CATEGORIES} {chart["column"]}')
+    ax.set_xlabel('Count')
+    fig.tight_layout()
+    fig.savefig(path)
+
+
+RENDERERS = {
+    "correlation": ("heatmap", _render_heatmap),
+    "distribution": ("dist", _render_distribution),
+    "category": ("cat", _render_category),
+}
+
+
+def _timed_render(render, *args):
+    """
+    Runs a renderer and returns its duration, measured where it runs
+    (inside the worker process when charts render in a pool).
+    """
+    start = time.perf_counter()
+    render(*args)
+    return time.perf_counter() - start
+
+
+@telemetry.span("plots")
+def render_charts(charts, store):
+    """
+    Renders chart dicts from chart_data() to PNG files in a PlotStore.
+    Files are named by a hash of the chart data, so a chart already in
+    the store is reused instead of rendered again. The others render
+    concurrently in a process pool; together they get PLOT_TIMEOUT
+    seconds, and charts that fail or are not done by then are left out.
+    Returns plot metadata dicts ("type", "title", "file") in chart order.
+    """
+    entries = [] # (metadata, renderer or None when reused, chart)
+    for chart in charts:
+        prefix, render = RENDERERS[chart["type"]]
+        meta = {"type": chart["type"], "title": chart["title"],
+                "file": store.name(prefix, [STYLE_VERSION, chart], chart.get("column"))}
+        if store.exists(meta["file"]):
+            telemetry.record("plot", 0.0, "reused", chart=meta["type"])
+            entries.append((meta, None, chart))
+        else:
+            entries.append((meta, render, chart))
+
+    rendered = set()
+    if PLOT_WORKERS <= 0:
+        for meta, render, chart in entries:
+            if render is None:
+                continue
+            temp_path = store.temp_path(meta["file"])
+            start = time.perf_counter()
+            try:
+                render(chart, temp_path)
+                store.commit(temp_path, meta["file"])
+                rendered.add(meta["file"])
+                telemetry.record("plot", time.perf_counter() - start, chart=meta["type"])
+            except Exception as e:
+                logger.warning(f"Plot {meta['file']} failed: {e}")
+                store.discard(temp_path)
+                telemetry.record("plot", time.perf_counter() - start, "error", chart=meta["type"])
+    else:
+        futures = []
+        for meta, render, chart in entries:
+            if render is not None:
+                temp_path = store.temp_path(meta["file"])
+                futures.append((_pool.submit(_timed_render, render, chart, temp_path), temp_path, meta))
+
+        # One deadline for the whole request, however many charts it has
+        done, _ = wait([future for future, _, _ in futures], timeout=PLOT_TIMEOUT)
+        hung = []
+        for future, temp_path, meta in futures:
+            try:
+                if future not in done:
+                    # Charts still queued are dropped; running ones are hung
+                    if not future.cancel():
+                        hung.append(future)
+                    logger.warning(f"Plot {meta['file']} timed out after {PLOT_TIMEOUT}s")
+                    telemetry.record("plot", PLOT_TIMEOUT, "timeout", chart=meta["type"])
+                    continue
+                seconds = future.result()
+                store.commit(temp_path, meta["file"])
+                rendered.add(meta["file"])
+                telemetry.record("plot", seconds, chart=meta["type"])
+            except BrokenProcessPool as e:
+                logger.warning(f"Plot {meta['file']} failed, worker died: {e}")
+                telemetry.record("plot", 0.0, "error", chart=meta["type"])
+            except Exception as e:
+                logger.warning(f"Plot {meta['file']} failed: {e}")
+                telemetry.record("plot", 0.0, "error", chart=meta["type"])
+            finally:
+                if meta["file"] not in rendered:
+                    store.discard(temp_path)
+
+        if hung:
+            # Replaces the pool without cutting short other requests' charts
+            _pool.retire(hung)
+
+    return [meta for meta, render, _ in entries if render is None or meta["file"] in rendered]
+
+
+def generate_plots(data, store):
+    """
+    Computes the charts of a Dataset or DataFrame (chart_data) and renders
+    them as PNG files into a PlotStore (render_charts).
+    """
+    return render_charts(chart_data(data), store)
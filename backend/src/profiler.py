@@ -0,0 +1,247 @@
+import re
+import warnings
+import numpy as np
+import pandas as pd
+from . import ingest, telemetry
+
+# Non-null values inspected per column; profiling cost does not grow with row count
+SAMPLE_SIZE = 2000
+# Share of sampled values that must parse for a string column to count as dates/numbers
+PARSE_THRESHOLD = 0.8
+# Date detection tries each format on this many values first and parses
+# the whole sample only for formats that mostly fit them
+DATETIME_PROBE_SIZE = 20
+PROBE_THRESHOLD = 0.5
+# A string column with at most this many distinct sampled values is categorical
+MAX_CATEGORIES = 50
+
+DATETIME_FORMATS = [
+    '%Y-%m-%d',
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%Y/%m/%d',
+    '%d/%m/%Y',
+    '%m/%d/%Y',
+    '%d-%m-%Y',
+    '%d.%m.%Y',
+    '%d/%m/%Y %H:%M',
+    '%m/%d/%Y %H:%M',
+    '%b %d, %Y',
+    '%d %b %Y',
+    '%B %d, %Y',
+    '%d %B %Y',
+    '%Y-%m',
+]
+
+
+class ColumnProfile:
+    """
+    What a column looks like, inferred from a bounded sample.
+    kind is one of: numeric, datetime, categorical, id, text, boolean, empty.
+    """
+
+    def __init__(self, name, dtype, kind, datetime_format=None, numeric_in_string=False,
+                 sample_size=0, sample_unique=0):
+        self.name = name
+        self.dtype = dtype
+        self.kind = kind
+        self.datetime_format = datetime_format
+        self.numeric_in_string = numeric_in_string
+        self.sample_size = sample_size
+        self.sample_unique = sample_unique
+
+    def to_dict(self):
+        return {
+            "dtype": str(self.dtype),
+            "kind": self.kind,
+            "datetime_format": self.datetime_format,
+            "numeric_in_string": self.numeric_in_string,
+            "sample_size": self.sample_size,
+            "sample_unique": self.sample_unique,
+        }
+
+
+class DatasetProfile:
+    """
+    Column profiles for a whole dataset, plus the column groupings the
+    brain, analyst and plotter need.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def numeric_columns(self):
+        """
+        Columns with a numeric dtype (same set as select_dtypes(np.number)).
+        """
+        return [name for name, col in self.columns.items() if _is_numeric_dtype(col.dtype)]
+
+    def categorical_columns(self):
+        """
+        Columns with a string-like dtype (object, string or category),
+        including date columns parsed from text (see restore_text).
+        """
+        return [name for name, col in self.columns.items()
+                if _is_string_like_dtype(col.dtype) or _parsed_from_text(col)]
+
+    def datetime_columns(self):
+        return [name for name, col in self.columns.items() if col.kind == 'datetime']
+
+    def id_columns(self):
+        return [name for name, col in self.columns.items() if col.kind == 'id']
+
+    def to_dict(self):
+        return {name: col.to_dict() for name, col in self.columns.items()}
+
+
+def _is_numeric_dtype(dtype):
+    return pd.api.types.is_numeric_dtype(dtype) and not pd.api.types.is_bool_dtype(dtype)
+
+
+def _is_string_like_dtype(dtype):
+    return (isinstance(dtype, pd.CategoricalDtype)
+            or pd.api.types.is_object_dtype(dtype)
+            or pd.api.types.is_string_dtype(dtype))
+
+
+def _parsed_from_text(col_profile):
+    # analyst.optimize_dtypes only parses dates that format back exactly
+    return (col_profile is not None and col_profile.datetime_format is not None
+            and pd.api.types.is_datetime64_any_dtype(col_profile.dtype))
+
+
+def restore_text(series, col_profile):
+    """
+    A date column that analyst.optimize_dtypes parsed from text, formatted
+    back to that exact text (None for missing values), so summaries,
+    charts, previews and query labels do not depend on the optimisation.
+    Other columns are returned as they are.
+    """
+    if not _parsed_from_text(col_profile) or not pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return series
+    codes, uniques = pd.factorize(series)
+    # Code -1 (missing) picks the trailing None
+    labels = np.append(uniques.strftime(col_profile.datetime_format).to_numpy(dtype=object), None)
+    return pd.Series(labels[codes], index=series.index, name=series.name)
+
+
+def restore_frame(df, profile):
+    """
+    df with every column restore_text applies to formatted back to text
+    (df itself when there is none, or no profile).
+    """
+    if profile is None:
+        return df
+    parsed = [name for name in df.columns if _parsed_from_text(profile.columns.get(name))]
+    if not parsed:
+        return df
+    return df.assign(**{name: restore_text(df[name], profile.columns[name]) for name in parsed})
+
+
+def _looks_like_id(name):
+    # "id", "order_id", "Order ID", "PassengerId" but not "paid" or "valid"
+    return bool(re.search(r'(^|[_\s-])id$', str(name), re.IGNORECASE) or re.search(r'[a-z]Id$', str(name)))
+
+
+def _sample(series, sample_size):
+    """
+    Evenly spaced non-null values, so sorted or clustered files are
+    represented from start to end.
+    """
+    n = len(series)
+    if n > sample_size:
+        positions = np.unique(np.linspace(0, n - 1, sample_size).astype(np.int64))
+        series = series.iloc[positions]
+    return series.dropna()
+
+
+def detect_datetime_format(sample):
+    """
+    Returns (is_datetime, format) for a sample of string values.
+    format is None when the dates parse but match no single known format.
+    Formats are tried on a small probe of the sample first, so columns
+    that are clearly not dates cost a few tiny parses.
+    """
+    values = sample.astype(str)
+    probe = values.iloc[::max(1, len(values) // DATETIME_PROBE_SIZE)].iloc[:DATETIME_PROBE_SIZE]
+    # Every supported format has digits (a year or a day)
+    if probe.str.contains(r'\d', regex=True).mean() <= PROBE_THRESHOLD:
+        return False, None
+
+    def share(candidates, fmt):
+        try:
+            return pd.to_datetime(candidates, format=fmt, errors='coerce').notna().mean()
+        except (TypeError, ValueError):
+            return 0.0
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for fmt in DATETIME_FORMATS:
+            if share(probe, fmt) > PROBE_THRESHOLD and share(values, fmt) > PARSE_THRESHOLD:
+                return True, fmt
+        if share(probe, 'mixed') > PROBE_THRESHOLD and share(values, 'mixed') > PARSE_THRESHOLD:
+            return True, None
+    return False, None
+
+
+def profile_column(series, sample_size=SAMPLE_SIZE):
+    dtype = series.dtype
+    sample = _sample(series, sample_size)
+    size = int(len(sample))
+    if size == 0:
+        return ColumnProfile(series.name, dtype, 'empty')
+
+    try:
+        unique = int(sample.nunique())
+    except TypeError: # Unhashable cells (lists, dicts from JSON)
+        return ColumnProfile(series.name, dtype, 'text', sample_size=size, sample_unique=size)
+    profile = ColumnProfile(series.name, dtype, 'text', sample_size=size, sample_unique=unique)
+
+    if pd.api.types.is_bool_dtype(dtype):
+        profile.kind = 'boolean'
+    elif pd.api.types.is_datetime64_any_dtype(dtype):
+        profile.kind = 'datetime'
+    elif _is_numeric_dtype(dtype):
+        # Distinct integers that increase down the file (or are named like
+        # an ID) are row keys rather than measurements
+        is_id = (pd.api.types.is_integer_dtype(dtype) and unique == size and size > MAX_CATEGORIES
+                 and (sample.is_monotonic_increasing or _looks_like_id(series.name)))
+        profile.kind = 'id' if is_id else 'numeric'
+    elif _is_string_like_dtype(dtype):
+        if pd.to_numeric(sample, errors='coerce').notna().mean() > PARSE_THRESHOLD:
+            profile.kind = 'numeric'
+            profile.numeric_in_string = True
+        else:
+            is_datetime, fmt = detect_datetime_format(sample)
+            if is_datetime:
+                profile.kind = 'datetime'
+                profile.datetime_format = fmt
+            elif unique <= MAX_CATEGORIES and unique < size:
+                profile.kind = 'categorical'
+            elif unique == size and size > MAX_CATEGORIES:
+                profile.kind = 'id'
+    return profile
+
+
+@telemetry.span("profile")
+def profile_columns(df, sample_size=SAMPLE_SIZE):
+    """
+    Profiles every column of a DataFrame from bounded samples.
+    """
+    return DatasetProfile({col: profile_column(df[col], sample_size) for col in df.columns})
+
+
+def get_profile(data):
+    """
+    Returns the column profile for a Dataset (computed once and cached on
+    it) or a DataFrame (computed on every call).
+    """
+    if isinstance(data, ingest.Dataset):
+        if data.profile is None:
+            data.profile = profile_columns(data.df)
+        return data.profile
+    return profile_columns(data)
@@ -0,0 +1,229 @@
+import hashlib
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+
+# Rough Gemini tokenizer ratio for English text and numbers
+CHARS_PER_TOKEN = 4
+# Token budget for the serialised stats in a prompt
+STATS_TOKEN_BUDGET = int(os.getenv("PROMPT_STATS_TOKEN_BUDGET", 4000))
+# Token budget for a whole chat prompt (stats + conversation)
+CHAT_TOKEN_BUDGET = int(os.getenv("CHAT_TOKEN_BUDGET", 8000))
+# Most recent chat messages always sent verbatim
+CHAT_RECENT_MESSAGES = int(os.getenv("CHAT_RECENT_MESSAGES", 6))
+# Significant digits kept for floats
+FLOAT_DIGITS = 6
+# Characters of an older message kept when it is summarised
+SUMMARY_CHARS = 160
+
+PREFIX_CACHE_SIZE = 64
+
+# Progressively smaller renderings of the stats, tried in order until one
+# fits the budget. Low-value detail goes first: categorical columns whose
+# top values are all unique, then long top-value lists, then columns.
+TRIM_LEVELS = [
+    {},
+    {"skip_unique_categories": True},
+    {"skip_unique_categories": True, "top_values": 5},
+    {"skip_unique_categories": True, "top_values": 3, "max_columns": 50},
+    {"skip_unique_categories": True, "top_values": 3, "max_columns": 20, "skip_missing": True},
+    {"skip_unique_categories": True, "top_values": 1, "max_columns": 10, "skip_missing": True},
+]
+
+
+def estimate_tokens(text):
+    """
+    Cheap token estimate (no tokenizer call); errs slightly high.
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def format_value(value):
+    """
+    Short, stable text for a stats value: integral floats lose their ".0",
+    other floats keep FLOAT_DIGITS significant digits.
+    """
+    if value is None:
+        return "NA"
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        if math.isnan(value) or math.isinf(value):
+            return "NA"
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return f"{value:.{FLOAT_DIGITS}g}"
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{k}: {format_value(v)}" for k, v in value.items()) + "}"
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(format_value(v) for v in value) + "]"
+    return str(value)
+
+
+def _limit(items, limit):
+    items = list(items)
+    if limit is None or len(items) <= limit:
+        return items, 0
+    return items[:limit], len(items) - limit
+
+
+def compact_stats(stats, top_values=10, max_columns=None, skip_unique_categories=False, skip_missing=False):
+    """
+    Renders a generate_summary_v2 style stats dict as compact text.
+    Per-column numeric stats become table rows under a single header, so
+    stat names are not repeated for every column. Output only depends on
+    the input, never on time or memory addresses.
+    """
+    if not isinstance(stats, dict):
+        return str(stats)
+
+    lines = []
+    basic = stats.get("basic_info") or {}
+    if "rows" in basic:
+        lines.append(f"rows: {format_value(basic['rows'])}")
+    if basic.get("columns"):
+        shown, hidden = _limit(basic["columns"], max_columns)
+        more = f" (+{hidden} more)" if hidden else ""
+        lines.append(f"columns ({len(basic['columns'])}): {', '.join(map(str, shown))}{more}")
+    if not skip_missing and "missing_values" in basic:
+        missing = [f"{col}={format_value(n)}" for col, n in basic["missing_values"].items() if n]
+        lines.append(f"missing: {', '.join(missing) if missing else 'none'}")
+
+    numeric = stats.get("numeric_stats") or {}
+    if numeric:
+        fields = []
+        for col_stats in numeric.values():
+            for key in col_stats:
+                if key not in fields:
+                    fields.append(key)
+        shown, hidden = _limit(numeric.items(), max_columns)
+        lines.append(f"numeric (column: {' | '.join(fields)}):")
+        for col, col_stats in shown:
+            lines.append(f"{col}: " + " | ".join(format_value(col_stats.get(key)) for key in fields))
+        if hidden:
+            lines.append(f"(+{hidden} more numeric columns)")
+
+    corr = stats.get("correlation") or {}
+    if corr:
+        lines.append("correlation |r|: " + "; ".join(f"{pair} {format_value(r)}" for pair, r in corr.items()))
+
+    categorical = stats.get("categorical_stats") or {}
+    if skip_unique_categories:
+        categorical = {col: counts for col, counts in categorical.items()
+                       if any(n != 1 for n in counts.values())}
+    if categorical:
+        shown, hidden = _limit(categorical.items(), max_columns)
+        lines.append("categorical top values (value=count):")
+        for col, counts in shown:
+            values, more = _limit(counts.items(), top_values)
+            text = ", ".join(f"{value}={format_value(n)}" for value, n in values)
+            lines.append(f"{col}: {text}{f', +{more} more' if more else ''}")
+        if hidden:
+            lines.append(f"(+{hidden} more categorical columns)")
+
+    known = ("basic_info", "numeric_stats", "correlation", "categorical_stats")
+    for key, value in stats.items():
+        if key not in known:
+            lines.append(f"{key}: {format_value(value)}")
+
+    return "\n".join(lines)
+
+
+def fit_stats(stats, budget=STATS_TOKEN_BUDGET):
+    """
+    The most detailed compact_stats rendering that fits the token budget,
+    hard-truncated as a last resort.
+    """
+    for level in TRIM_LEVELS:
+        text = compact_stats(stats, **level)
+        if estimate_tokens(text) <= budget:
+            return text
+    return text[:budget * CHARS_PER_TOKEN]
+
+
+def fingerprint(stats):
+    """
+    Canonical hash of a stats dict: equal stats give equal fingerprints
+    regardless of key order.
+    """
+    canonical = json.dumps(stats, sort_keys=True, separators=(',', ':'), default=str, allow_nan=True)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+_prefix_cache = OrderedDict()
+_prefix_lock = threading.Lock()
+
+
+def stable_prefix(header, stats, budget=STATS_TOKEN_BUDGET):
+    """
+    header + serialised stats, memoised per (header, stats fingerprint,
+    budget). The text is byte-identical for every request about the same
+    data, and writer prompts put it first, so the model provider's prefix
+    caching can reuse it across reports and chat turns.
+    """
+    key = (hashlib.sha256(header.encode('utf-8')).hexdigest(), fingerprint(stats), budget)
+    with _prefix_lock:
+        if key in _prefix_cache:
+            _prefix_cache.move_to_end(key)
+            return _prefix_cache[key]
+
+    prefix = f"{header}\n\nDATA SUMMARY:\n{fit_stats(stats, budget)}"
+
+    with _prefix_lock:
+        _prefix_cache[key] = prefix
+        while len(_prefix_cache) > PREFIX_CACHE_SIZE:
+            _prefix_cache.popitem(last=False)
+    return prefix
+
+
+def _summarise(text, limit=SUMMARY_CHARS):
+    text = " ".join(str(text).split())
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + "..."
+
+
+def compact_history(history, budget, recent=CHAT_RECENT_MESSAGES):
+    """
+    Fits chat history into a token budget. Messages are kept verbatim
+    while they fit. Over budget, messages older than the last `recent`
+    are cut to a one-line summary, oldest first, and the oldest messages
+    are dropped if that is still too long. The latest message is always
+    kept.
+    Returns a list of "Role: text" lines.
+    """
+    def label(msg):
+        return "User" if msg.get('role') == 'user' else "Assistant"
+
+    lines = [f"{label(msg)}: {msg.get('content', '')}" for msg in history]
+    total = sum(estimate_tokens(line) + 1 for line in lines)
+    for i in range(max(len(history) - recent, 0)):
+        if total <= budget:
+            break
+        summary = f"{label(history[i])} (earlier, summarised): {_summarise(history[i].get('content', ''))}"
+        saved = estimate_tokens(lines[i]) - estimate_tokens(summary)
+        if saved > 0: # Short messages are cheaper left as they are
+            lines[i] = summary
+            total -= saved
+
+    dropped = 0
+    while len(lines) > 1 and total > budget:
+        total -= estimate_tokens(lines[0]) + 1
+        lines.pop(0)
+        dropped += 1
+    if dropped:
+        lines.insert(0, f"({dropped} earlier messages omitted)")
+    return lines
+
+
+def build_chat_prompt(system, history, stats, budget=CHAT_TOKEN_BUDGET):
+    """
+    Chat prompt within `budget` tokens: the stable system + stats prefix
+    (at most half the budget) followed by the compacted conversation.
+    """
+    prefix = stable_prefix(system, stats, min(STATS_TOKEN_BUDGET, budget // 2))
+    remaining = max(budget - estimate_tokens(prefix), budget // 4)
+    conversation = compact_history(history, remaining)
+    return f"System: {prefix}\n\n" + "\n\n".join(conversation) + "\nAssistant:"
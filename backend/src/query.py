@@ -0,0 +1,575 @@
+import json
+import math
+import threading
+import time
+import weakref
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from . import ingest, profiler
+
+# Group-by results are capped at this many groups per query
+MAX_GROUPS = 100_000
+# Rows returned per query unless the request asks for fewer
+DEFAULT_LIMIT = 1000
+RESULT_CACHE_SIZE = 128
+# Group keys are combined with bincount while the key space is this small
+DENSE_KEY_SPACE = 4 * 1024 * 1024
+
+AGGREGATIONS = ('count', 'sum', 'mean', 'min', 'max', 'median', 'quantile')
+FILTER_OPS = ('eq', 'ne', 'in', 'not_in', 'gt', 'gte', 'lt', 'lte', 'between', 'is_null', 'not_null')
+
+
+class Dimension:
+    """
+    A column dictionary-encoded for filtering and grouping: compact codes
+    (0 = missing, 1..k = sorted distinct values) plus a posting-list index
+    (row positions grouped by code) built on first use.
+    """
+
+    def __init__(self, series):
+        codes, uniques = pd.factorize(series, sort=True)
+        self.labels = list(uniques)
+        self.cardinality = len(self.labels) + 1
+        dtype = np.uint8 if self.cardinality <= 0xFF else np.uint16 if self.cardinality <= 0xFFFF else np.uint32
+        self.codes = (codes + 1).astype(dtype)
+        self._lookup = {}
+        for i, label in enumerate(self.labels, start=1):
+            self._lookup.setdefault(_label_key(label), i)
+            self._lookup.setdefault(str(label), i)
+        self._order = None
+        self._offsets = None
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        index = 0 if self._order is None else self._order.nbytes + self._offsets.nbytes
+        return self.codes.nbytes + index
+
+    def code(self, value):
+        """
+        Code for a filter value (matched exactly or by its text), or None.
+        """
+        if value is None:
+            return 0
+        found = self._lookup.get(_label_key(value))
+        return found if found is not None else self._lookup.get(str(value))
+
+    def build_index(self):
+        with self._lock:
+            if self._order is None:
+                # Radix sort for 8/16-bit codes: linear in the row count
+                position_type = np.int32 if len(self.codes) < 2 ** 31 else np.int64
+                self._order = np.argsort(self.codes, kind='stable').astype(position_type)
+                self._offsets = np.concatenate(
+                    [[0], np.cumsum(np.bincount(self.codes, minlength=self.cardinality))])
+
+    def rows(self, codes):
+        """
+        Sorted row positions holding any of the given codes.
+        """
+        self.build_index()
+        parts = [self._order[self._offsets[c]:self._offsets[c + 1]] for c in sorted(set(codes))]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return parts[0] if len(parts) == 1 else np.sort(np.concatenate(parts))
+
+    def label(self, code):
+        return None if code == 0 else self.labels[code - 1]
+
+
+def _label_key(value):
+    # Numbers compare by value (1 == 1.0) and timestamps by their text
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return str(pd.Timestamp(value))
+    if isinstance(value, (np.integer, np.floating)):
+        return value.item()
+    return value
+
+
+def _json_value(value):
+    if value is None:
+        return None
+    if isinstance(value, (np.integer,)):
+        return int(value)
+    if isinstance(value, (float, np.floating)):
+        return None if math.isnan(value) or math.isinf(value) else float(value)
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return str(value)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    return value
+
+
+class QueryEngine:
+    """
+    Filters, group-bys and aggregations over one dataset.
+    Low-cardinality columns are dictionary-encoded up front (see
+    build_indexes); other columns are encoded or converted the first time
+    a query needs them. Results are kept in an LRU cache keyed by the
+    normalised query.
+    """
+
+    def __init__(self, df, profile, cache_size=RESULT_CACHE_SIZE):
+        self.df = df
+        self.profile = profile
+        self.rows = len(df)
+        self.cache_size = cache_size
+        self._dimensions = {}
+        self._values = {}
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def default_dimensions(self):
+        return [name for name, col in self.profile.columns.items() if col.kind in ('categorical', 'boolean')]
+
+    def build_indexes(self):
+        """
+        Encodes and indexes the categorical columns ahead of the first query.
+        """
+        for col in self.default_dimensions():
+            self.dimension(col).build_index()
+
+    def dimension(self, col):
+        self._check_column(col)
+        with self._lock:
+            dim = self._dimensions.get(col)
+        if dim is None:
+            try:
+                # Parsed date columns filter and group on their original text
+                dim = Dimension(profiler.restore_text(self.df[col], self.profile.columns.get(col)))
+            except TypeError: # Unhashable cells (lists, dicts from JSON)
+                raise ValueError(f"Column '{col}' cannot be used to filter or group.")
+            with self._lock:
+                dim = self._dimensions.setdefault(col, dim)
+        return dim
+
+    def values(self, col):
+        """
+        The column as float64 (NaN for missing); raises ValueError for
+        non-numeric columns.
+        """
+        self._check_column(col)
+        with self._lock:
+            values = self._values.get(col)
+        if values is None:
+            series = self.df[col]
+            if not profiler._is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+                raise ValueError(f"Column '{col}' is not numeric.")
+            values = series.to_numpy(dtype='float64', na_value=np.nan)
+            with self._lock:
+                values = self._values.setdefault(col, values)
+        return values
+
+    def present(self, col):
+        """
+        Boolean mask of the rows where the column has a value; works for
+        any column type.
+        """
+        if self._is_numeric(col) or pd.api.types.is_bool_dtype(self.df[col].dtype):
+            return ~np.isnan(self.values(col))
+        self._check_column(col)
+        with self._lock:
+            dim = self._dimensions.get(col)
+        if dim is not None:
+            return dim.codes != 0
+        return self.df[col].notna().to_numpy()
+
+    def _check_column(self, col):
+        if col not in self.df.columns:
+            raise ValueError(f"Unknown column '{col}'.")
+
+    def _is_numeric(self, col):
+        return col in self.profile.columns and profiler._is_numeric_dtype(self.profile[col].dtype)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "rows": self.rows,
+                "dimensions": {col: dim.cardinality - 1 for col, dim in self._dimensions.items()},
+                "index_bytes": sum(dim.nbytes for dim in self._dimensions.values()),
+                "cached_results": len(self._results),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    # --- Query execution ---
+
+    def run(self, spec):
+        """
+        Runs a query spec:
+          filters:      [{"column", "op", "value"}], op in FILTER_OPS
+          group_by:     [column, ...]
+          aggregations: [{"func", "column", "q"}], func in AGGREGATIONS
+                        (default: count)
+          order_by:     output column name; descending: bool
+          limit:        max rows returned
+        Returns {"columns", "rows", "matched_rows", "groups", "truncated",
+        "cached", "seconds"}. Raises ValueError for invalid specs.
+        """
+        start = time.perf_counter()
+        spec = normalise(spec)
+        key = json.dumps(spec, sort_keys=True, default=str)
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+        if cached is not None:
+            return dict(cached, cached=True, seconds=round(time.perf_counter() - start, 4))
+
+        result = self._execute(spec)
+        with self._lock:
+            self.misses += 1
+            self._results[key] = result
+            while len(self._results) > self.cache_size:
+                self._results.popitem(last=False)
+        return dict(result, cached=False, seconds=round(time.perf_counter() - start, 4))
+
+    def _select(self, filters):
+        """
+        Row positions matching every filter (None = all rows).
+        Equality filters on encoded columns use the posting lists; the most
+        selective one seeds the selection and the rest are checked on the
+        remaining rows only.
+        """
+        indexed, other = [], []
+        for f in filters:
+            col, op = f["column"], f["op"]
+            if op in ('eq', 'in') and not self._is_numeric(col):
+                dim = self.dimension(col)
+                codes = [c for c in (dim.code(v) for v in f["value"]) if c is not None]
+                dim.build_index()
+                size = sum(int(dim._offsets[c + 1] - dim._offsets[c]) for c in set(codes))
+                indexed.append((size, dim, codes))
+            else:
+                other.append(f)
+
+        rows = None
+        if indexed:
+            indexed.sort(key=lambda item: item[0])
+            _, dim, codes = indexed[0]
+            rows = dim.rows(codes)
+            for _, dim, codes in indexed[1:]:
+                rows = rows[np.isin(dim.codes[rows], codes)]
+
+        for f in other:
+            mask = self._filter_mask(f, rows)
+            rows = np.flatnonzero(mask) if rows is None else rows[mask]
+        return rows
+
+    def _filter_mask(self, f, rows):
+        col, op, value = f["column"], f["op"], f["value"]
+        if self._is_numeric(col):
+            values = self.values(col)
+            values = values if rows is None else values[rows]
+            with np.errstate(invalid='ignore'):
+                if op == 'is_null':
+                    return np.isnan(values)
+                if op == 'not_null':
+                    return ~np.isnan(values)
+                try:
+                    numbers = [float(v) for v in value if v is not None]
+                except (TypeError, ValueError):
+                    raise ValueError(f"Filter '{op}' on '{col}' needs numeric values.")
+                if op in ('eq', 'ne', 'in', 'not_in'):
+                    # A null in an in/not_in list stands for missing values
+                    mask = np.isin(values, numbers)
+                    if None in value:
+                        mask |= np.isnan(values)
+                    return mask if op in ('eq', 'in') else ~mask
+                if op == 'between':
+                    return (values >= numbers[0]) & (values <= numbers[1])
+                compare = {'gt': np.greater, 'gte': np.greater_equal, 'lt': np.less, 'lte': np.less_equal}[op]
+                return compare(values, numbers[0])
+
+        dim = self.dimension(col)
+        codes = dim.codes if rows is None else dim.codes[rows]
+        if op == 'is_null':
+            return codes == 0
+        if op == 'not_null':
+            return codes != 0
+        wanted = [c for c in (dim.code(v) for v in value) if c is not None]
+        if op in ('eq', 'in'):
+            return np.isin(codes, wanted)
+        if op in ('ne', 'not_in'):
+            return ~np.isin(codes, wanted)
+        # Range filters on text/dates compare the sorted dictionary codes
+        bounds = [self._bound(dim, v) for v in value]
+        if op == 'between':
+            return (codes >= bounds[0][0]) & (codes <= bounds[1][1]) & (codes != 0)
+        low, high = bounds[0]
+        if op == 'gt':
+            return codes > high
+        if op == 'gte':
+            return codes >= low
+        if op == 'lt':
+            return (codes < low) & (codes != 0)
+        return (codes <= high) & (codes != 0)
+
+    @staticmethod
+    def _bound(dim, value):
+        """
+        (first code >= value, last code <= value) in the sorted dictionary.
+        """
+        try:
+            if dim.labels and isinstance(dim.labels[0], pd.Timestamp):
+                value = pd.Timestamp(value)
+            position = int(np.searchsorted(np.asarray(dim.labels, dtype=object), value, side='left'))
+            exact = position < len(dim.labels) and dim.labels[position] == value
+        except (TypeError, ValueError):
+            raise ValueError(f"Cannot compare '{value}' with the values of this column.")
+        return position + 1, position + (1 if exact else 0)
+
+    def _groups(self, group_by, rows):
+        """
+        Returns (group id per selected row, number of groups, key codes per
+        group as a list of arrays, one per group_by column).
+        """
+        dims = [self.dimension(col) for col in group_by]
+        codes = [dim.codes if rows is None else dim.codes[rows] for dim in dims]
+        space = 1
+        for dim in dims:
+            space *= dim.cardinality
+        key = np.zeros(len(codes[0]), dtype=np.int64)
+        for dim, c in zip(dims, codes):
+            key = key * dim.cardinality + c
+
+        if space <= DENSE_KEY_SPACE:
+            present = np.flatnonzero(np.bincount(key, minlength=space))
+            remap = np.empty(space, dtype=np.int64)
+            remap[present] = np.arange(len(present))
+            group_ids, keys = remap[key], present
+        else:
+            keys, group_ids = np.unique(key, return_inverse=True)
+
+        if len(keys) > MAX_GROUPS:
+            raise ValueError(f"Group-by produces {len(keys)} groups; the limit is {MAX_GROUPS}.")
+
+        key_codes = []
+        for dim in reversed(dims):
+            key_codes.append(keys % dim.cardinality)
+            keys = keys // dim.cardinality
+        return group_ids, len(key_codes[0]) if key_codes else 0, key_codes[::-1]
+
+    def _aggregate(self, agg, rows, group_ids, n_groups):
+        """
+        One aggregate per group as an array (int64 for counts, else
+        float64). group_ids is None when there is no group-by.
+        """
+        func = agg["func"]
+        if func == 'count':
+            # Counts work on any column: rows where it has a value
+            if agg["column"] is None:
+                if group_ids is None:
+                    return np.array([self.rows if rows is None else len(rows)])
+                return np.bincount(group_ids, minlength=n_groups)
+            present = self.present(agg["column"])
+            present = present if rows is None else present[rows]
+            if group_ids is None:
+                return np.array([int(present.sum())])
+            return np.bincount(group_ids[present], minlength=n_groups)
+
+        values = self.values(agg["column"])
+        values = values if rows is None else values[rows]
+        valid = ~np.isnan(values)
+        values = values[valid]
+        if group_ids is None:
+            return np.array([_ungrouped(func, values, agg["q"])])
+
+        group_ids = group_ids[valid]
+        counts = np.bincount(group_ids, minlength=n_groups)
+        if func in ('sum', 'mean'):
+            sums = np.bincount(group_ids, weights=values, minlength=n_groups)
+            if func == 'sum':
+                return sums
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return np.where(counts > 0, sums / counts, np.nan)
+
+        # Order statistics: bring each group's values together (radix sort
+        # on the group ids), then reduce or partition segment by segment
+        small = np.uint16 if n_groups <= 0xFFFF else np.int64
+        grouped = values[np.argsort(group_ids.astype(small), kind='stable')]
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        result = np.full(n_groups, np.nan)
+        has = counts > 0
+        if func == 'min':
+            result[has] = np.minimum.reduceat(grouped, starts[has])
+        elif func == 'max':
+            result[has] = np.maximum.reduceat(grouped, starts[has])
+        else:
+            q = 0.5 if func == 'median' else agg["q"]
+            for g in np.flatnonzero(has):
+                result[g] = np.quantile(grouped[starts[g]:starts[g] + counts[g]], q)
+        return result
+
+    def _execute(self, spec):
+        rows = self._select(spec["filters"])
+        matched = self.rows if rows is None else int(len(rows))
+
+        if spec["group_by"]:
+            group_ids, n_groups, key_codes = self._groups(spec["group_by"], rows)
+        else:
+            group_ids, n_groups, key_codes = None, 1, []
+
+        names = list(spec["group_by"])
+        columns = []
+        for agg in spec["aggregations"]:
+            names.append(agg["name"])
+            columns.append(self._aggregate(agg, rows, group_ids, n_groups))
+
+        order = np.arange(n_groups)
+        if spec["order_by"] is not None:
+            if spec["order_by"] not in names:
+                raise ValueError(f"order_by must be one of {names}.")
+            index = names.index(spec["order_by"])
+            if index < len(spec["group_by"]):
+                sort_key = key_codes[index]
+            else:
+                # Missing aggregates sort last either way
+                sort_key = np.nan_to_num(columns[index - len(spec["group_by"])],
+                                         nan=-np.inf if spec["descending"] else np.inf)
+            order = np.argsort(sort_key, kind='stable')
+            if spec["descending"]:
+                order = order[::-1]
+
+        truncated = len(order) > spec["limit"]
+        order = order[:spec["limit"]]
+        dims = [self.dimension(col) for col in spec["group_by"]]
+        result_rows = []
+        for g in order:
+            row = [_json_value(dim.label(int(codes[g]))) for dim, codes in zip(dims, key_codes)]
+            row += [_json_value(col[g]) for col in columns]
+            result_rows.append(row)
+
+        return {
+            "columns": names,
+            "rows": result_rows,
+            "matched_rows": matched,
+            "groups": int(n_groups),
+            "truncated": bool(truncated),
+        }
+
+
+def _ungrouped(func, values, q=None):
+    if func == 'sum':
+        return float(values.sum())
+    if len(values) == 0:
+        return np.nan
+    if func == 'mean':
+        return float(values.mean())
+    if func == 'min':
+        return float(values.min())
+    if func == 'max':
+        return float(values.max())
+    return float(np.quantile(values, 0.5 if func == 'median' else q))
+
+
+def normalise(spec):
+    """
+    Validates a query spec and fills in defaults, so equal queries share
+    one cache entry. Raises ValueError.
+    """
+    if not isinstance(spec, dict):
+        raise ValueError("Query must be a JSON object.")
+
+    filters = []
+    for f in spec.get("filters") or []:
+        if not isinstance(f, dict) or "column" not in f:
+            raise ValueError("Each filter needs a 'column'.")
+        op = f.get("op", "eq")
+        if op not in FILTER_OPS:
+            raise ValueError(f"Unsupported filter op '{op}'. Use one of {FILTER_OPS}.")
+        value = f.get("value")
+        if value is None and op in ('eq', 'ne'):
+            # Equality with null means "is missing"
+            op = 'is_null' if op == 'eq' else 'not_null'
+        if op in ('is_null', 'not_null'):
+            value = []
+        elif op in ('in', 'not_in'):
+            if not isinstance(value, list):
+                raise ValueError(f"Filter '{op}' on '{f['column']}' needs a list value.")
+        elif op == 'between':
+            if not isinstance(value, list) or len(value) != 2:
+                raise ValueError(f"Filter 'between' on '{f['column']}' needs [low, high].")
+        else:
+            value = [value]
+        if op not in ('in', 'not_in') and None in value:
+            raise ValueError(f"Filter '{op}' on '{f['column']}' cannot compare with null; "
+                             "use 'is_null' or 'not_null'.")
+        filters.append({"column": f["column"], "op": op, "value": value})
+
+    group_by = spec.get("group_by") or []
+    if isinstance(group_by, str):
+        group_by = [group_by]
+
+    aggregations = []
+    for agg in spec.get("aggregations") or [{"func": "count"}]:
+        if isinstance(agg, str):
+            agg = {"func": agg}
+        func = agg.get("func")
+        if func not in AGGREGATIONS:
+            raise ValueError(f"Unsupported aggregation '{func}'. Use one of {AGGREGATIONS}.")
+        column = agg.get("column")
+        if column is None and func != 'count':
+            raise ValueError(f"Aggregation '{func}' needs a 'column'.")
+        q = None
+        if func == 'quantile':
+            q = agg.get("q")
+            if not isinstance(q, (int, float)) or not 0 <= q <= 1:
+                raise ValueError("Aggregation 'quantile' needs 'q' between 0 and 1.")
+            q = float(q)
+        name = agg.get("name") or ("count" if column is None else
+                                   f"{column}_{func}" + (f"_{q:g}" if q is not None else ""))
+        aggregations.append({"func": func, "column": column, "q": q, "name": name})
+
+    limit = spec.get("limit", DEFAULT_LIMIT)
+    if not isinstance(limit, int) or limit < 1:
+        raise ValueError("limit must be a positive integer.")
+
+    return {
+        "filters": filters,
+        "group_by": list(group_by),
+        "aggregations": aggregations,
+        "order_by": spec.get("order_by"),
+        "descending": bool(spec.get("descending", False)),
+        "limit": min(limit, MAX_GROUPS),
+    }
+
+
+def referenced_columns(spec):
+    """
+    The columns a query spec filters, groups or aggregates on, in first
+    use order. Raises ValueError for invalid specs.
+    """
+    spec = normalise(spec)
+    names = [f["column"] for f in spec["filters"]] + spec["group_by"]
+    names += [agg["column"] for agg in spec["aggregations"] if agg["column"] is not None]
+    return list(dict.fromkeys(names))
+
+
+_build_locks = weakref.WeakKeyDictionary()
+_build_locks_guard = threading.Lock()
+
+
+def get_engine(data, build_indexes=False):
+    """
+    Returns the QueryEngine for a Dataset (built once and cached on it,
+    like its profile) or a new one for a DataFrame.
+    """
+    if not isinstance(data, ingest.Dataset):
+        engine = QueryEngine(data, profiler.get_profile(data))
+        if build_indexes:
+            engine.build_indexes()
+        return engine
+
+    with _build_locks_guard:
+        lock = _build_locks.setdefault(data, threading.Lock())
+    with lock:
+        if data.query_engine is None:
+            data.query_engine = QueryEngine(data.df, profiler.get_profile(data))
+    if build_indexes:
+        data.query_engine.build_indexes()
+    return data.query_engine
@@ -0,0 +1,446 @@
+import io
+import logging
+import math
+import os
+from statistics import NormalDist
+import numpy as np
+import pandas as pd
+from . import ingest, telemetry
+
+logger = logging.getLogger(__name__)
+
+# Rows analysed when an upload is answered from a sample
+SAMPLE_ROWS = int(os.getenv("SAMPLE_ROWS", 100_000))
+# Every stratum keeps at least this many rows (or all of them), so rare
+# groups still show up in stratified stats and charts
+MIN_PER_STRATUM = int(os.getenv("SAMPLE_MIN_PER_STRATUM", 200))
+# Values of the stratification column beyond this many share one stratum
+MAX_STRATA = 200
+# Leading rows parsed to validate a file and build its preview
+HEAD_ROWS = 1000
+# Block sampling reads at least this many blocks, of at most BLOCK_BYTES
+MIN_BLOCKS = 32
+BLOCK_BYTES = 64 * 1024
+# Error bounds are two-sided intervals at this confidence level
+CONFIDENCE = 0.95
+_Z = NormalDist().inv_cdf((1 + CONFIDENCE) / 2)
+
+
+class Sample:
+    """
+    Rows drawn from a larger dataset, plus what is needed to scale stats
+    back to it. weights holds the number of dataset rows each sampled row
+    stands for. strata and clusters (arrays of ids, or None) describe how
+    the rows were drawn and are used for the error bounds: clusters are
+    rows drawn together, e.g. the lines of one file block.
+    """
+
+    def __init__(self, df, population_rows, method, weights=None, strata=None, clusters=None,
+                 stratify=None, rows_margin=None):
+        self.df = df.reset_index(drop=True)
+        self.population_rows = int(round(population_rows))
+        self.method = method
+        n = len(self.df)
+        self.weights = weights if weights is not None else np.full(n, population_rows / n if n else 0.0)
+        self.strata = strata
+        self.clusters = clusters
+        self.stratify = stratify
+        # Set when the row count is estimated rather than counted
+        self.rows_margin = rows_margin
+
+    @property
+    def rows(self):
+        return len(self.df)
+
+    @property
+    def complete(self):
+        """
+        True if the sample holds every row of the dataset.
+        """
+        return self.rows_margin is None and self.rows >= self.population_rows
+
+    def info(self):
+        info = {
+            "method": self.method,
+            "sample_rows": self.rows,
+            "population_rows": self.population_rows,
+            "fraction": round(self.rows / self.population_rows, 6) if self.population_rows else 1.0,
+            "rows_estimated": self.rows_margin is not None,
+            "confidence": CONFIDENCE,
+        }
+        if self.stratify is not None:
+            info["stratify"] = self.stratify
+            info["strata"] = int(len(np.unique(self.strata)))
+        return info
+
+    def __repr__(self):
+        return f"<Sample {self.method} {self.rows} of {self.population_rows} rows>"
+
+
+def _smallest(keys, n):
+    """
+    Positions of the n smallest keys (all of them if there are fewer).
+    """
+    if len(keys) <= n:
+        return np.arange(len(keys))
+    if n <= 0:
+        return np.arange(0)
+    return np.argpartition(keys, n - 1)[:n]
+
+
+class Reservoir:
+    """
+    Uniform random sample of up to `size` rows from DataFrame chunks seen
+    one at a time (e.g. while a file is parsed), in bounded memory.
+    Every row gets a random key and the rows with the smallest keys are
+    kept, so a chunk costs one vectorised selection instead of a draw per
+    row, and the kept rows are a simple random sample of all rows seen.
+    """
+
+    method = 'reservoir'
+
+    def __init__(self, size=SAMPLE_ROWS, seed=0):
+        self.size = size
+        self.rows = 0
+        self._rng = np.random.default_rng(seed)
+        self._frame = None
+        self._keys = np.empty(0)
+        self._positions = np.empty(0, dtype='int64')
+        self._labels = np.empty(0, dtype='int64')
+
+    def _label(self, chunk):
+        """
+        Stratum id of each row of chunk.
+        """
+        return np.zeros(len(chunk), dtype='int64')
+
+    def _select(self, keys, labels):
+        """
+        Positions of the rows to keep.
+        """
+        return _smallest(keys, self.size)
+
+    def update(self, chunk):
+        keys = self._rng.random(len(chunk))
+        positions = np.arange(self.rows, self.rows + len(chunk))
+        labels = self._label(chunk)
+        self.rows += len(chunk)
+
+        pick = self._select(keys, labels)
+        frame, keys, positions, labels = chunk.iloc[pick], keys[pick], positions[pick], labels[pick]
+        if self._frame is not None:
+            frame = pd.concat([self._frame, frame])
+            keys = np.concatenate([self._keys, keys])
+            positions = np.concatenate([self._positions, positions])
+            labels = np.concatenate([self._labels, labels])
+            pick = self._select(keys, labels)
+            frame, keys, positions, labels = frame.iloc[pick], keys[pick], positions[pick], labels[pick]
+        self._frame, self._keys, self._positions, self._labels = frame, keys, positions, labels
+        return self
+
+    def _ordered(self):
+        """
+        The kept rows in file order, with their stratum ids.
+        """
+        if self._frame is None:
+            return pd.DataFrame(), self._labels
+        order = np.argsort(self._positions, kind='stable')
+        return self._frame.iloc[order], self._labels[order]
+
+    def sample(self):
+        frame, _ = self._ordered()
+        return Sample(frame, self.rows, self.method)
+
+
+class StratifiedReservoir(Reservoir):
+    """
+    Reservoir that also keeps at least min_per_stratum rows (or all of
+    them) for every value of `column`. Within a stratum the kept rows are
+    still the ones with the smallest keys, so each stratum is a uniform
+    sample of its own rows and is weighted by how many rows it has.
+    Missing values form a stratum; values first seen once MAX_STRATA
+    strata exist share one.
+    """
+
+    method = 'stratified'
+
+    def __init__(self, column, size=SAMPLE_ROWS, min_per_stratum=MIN_PER_STRATUM, seed=0):
+        super().__init__(size, seed)
+        self.column = column
+        self.min_per_stratum = min_per_stratum
+        self._codes = {}
+        self._counts = np.zeros(MAX_STRATA + 1, dtype='int64')
+
+    def _label(self, chunk):
+        if self.column not in chunk.columns:
+            raise ValueError(f"Cannot stratify by '{self.column}': no such column.")
+        codes, uniques = pd.factorize(chunk[self.column], use_na_sentinel=False)
+        lookup = np.empty(len(uniques), dtype='int64')
+        for i, value in enumerate(uniques):
+            # Strata are numbered as first seen; the last id pools the overflow
+            key = None if pd.isna(value) else value
+            if key not in self._codes and len(self._codes) < MAX_STRATA:
+                self._codes[key] = len(self._codes)
+            lookup[i] = self._codes.get(key, MAX_STRATA)
+        labels = lookup[codes]
+        self._counts += np.bincount(labels, minlength=MAX_STRATA + 1)
+        return labels
+
+    def _select(self, keys, labels):
+        keep = np.zeros(len(keys), dtype=bool)
+        keep[_smallest(keys, self.size)] = True
+        # Rank of each key within its stratum
+        order = np.lexsort((keys, labels))
+        ordered = labels[order]
+        starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+        ranks = np.empty(len(keys), dtype='int64')
+        ranks[order] = np.arange(len(keys)) - np.repeat(starts, np.diff(np.r_[starts, len(keys)]))
+        keep |= ranks < self.min_per_stratum
+        return np.flatnonzero(keep)
+
+    def sample(self):
+        frame, strata = self._ordered()
+        # Each row stands for (rows in its stratum) / (sampled rows of it)
+        sampled = np.bincount(strata, minlength=MAX_STRATA + 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            per_row = np.where(sampled > 0, self._counts / sampled, 0.0)
+        return Sample(frame, self.rows, self.method, weights=per_row[strata],
+                      strata=strata, stratify=self.column)
+
+
+def sampler(size=SAMPLE_ROWS, stratify=None, seed=0):
+    """
+    A Reservoir, or a StratifiedReservoir when stratify names a column.
+    """
+    if stratify:
+        return StratifiedReservoir(stratify, size, seed=seed)
+    return Reservoir(size, seed)
+
+
+@telemetry.span("sample", method="frame")
+def sample_frame(df, size=SAMPLE_ROWS, stratify=None, seed=0):
+    """
+    Sample of an already parsed DataFrame.
+    """
+    return sampler(size, stratify, seed).update(df).sample()
+
+
+@telemetry.span("sample", method="chunks")
+def sample_chunks(chunks, size=SAMPLE_ROWS, stratify=None, seed=0):
+    """
+    Sample drawn while DataFrame chunks are parsed (see ingest.iter_chunks),
+    without keeping more than the sample in memory.
+    """
+    reservoir = sampler(size, stratify, seed)
+    for chunk in chunks:
+        reservoir.update(chunk)
+    return reservoir.sample()
+
+
+def _line_block(file, offset, window, first):
+    """
+    The complete lines starting in [offset, offset + window) of a binary
+    file. A line starts at offset only if the byte before it is a line
+    break, so one byte before the window is read too (unless first).
+    """
+    if first:
+        file.seek(offset)
+        data = file.read(window)
+    else:
+        file.seek(offset - 1)
+        data = file.read(window + 1)
+        data = data[data.find(b'\n') + 1:] if b'\n' in data else b''
+    # Finish the last line that started inside the window
+    while data and not data.endswith(b'\n'):
+        more = file.read(BLOCK_BYTES)
+        if not more:
+            data += b'\n'
+            break
+        end = more.find(b'\n')
+        data += more if end < 0 else more[:end + 1]
+    return data
+
+
+def _count_lines(data):
+    return sum(1 for line in data.split(b'\n') if line.strip())
+
+
+@telemetry.span("sample", method="blocks")
+def sample_blocks(file, size=SAMPLE_ROWS, seed=0):
+    """
+    Samples a CSV or JSON-lines upload by parsing blocks at random offsets
+    instead of the whole file, so the time taken depends on size and not
+    on the file. The file is cut into equal segments and one window is
+    read from a random offset in each; a window holds the lines that start
+    inside it, so every line has the same chance of being drawn whatever
+    its length. The row count is estimated from the lines per window.
+    Returns None when the file is too small to be worth sampling or
+    cannot be split at line breaks (quoted newlines, UTF-16), in which
+    case it has to be read in full.
+    """
+    file_format = ingest.detect_format(file.filename)
+    if file_format not in ('csv', 'jsonl'):
+        return None
+    total = ingest.file_size(file)
+    try:
+        head = file.read(min(total, 4 * BLOCK_BYTES))
+        if isinstance(head, str) or b'\x00' in head[:ingest.SAMPLE_SIZE]:
+            return None
+        encoding = ingest.detect_encoding(head[:ingest.SAMPLE_SIZE])
+
+        start = head.find(b'\n') + 1 if file_format == 'csv' else 0
+        header = head[:start]
+        if file_format == 'csv' and not start:
+            return None
+        lines = head[start:head.rfind(b'\n') + 1]
+        line_count = _count_lines(lines)
+        if not line_count:
+            return None
+        bytes_per_row = len(lines) / line_count
+        data_bytes = total - start
+
+        wanted = size * bytes_per_row
+        if 2 * wanted >= data_bytes:
+            return None # Reading everything costs about as much
+        count = max(MIN_BLOCKS, math.ceil(wanted / BLOCK_BYTES))
+        window = max(1, math.ceil(wanted / count))
+        segment = data_bytes / count
+
+        rng = np.random.default_rng(seed)
+        blocks, rows = [], []
+        for i in range(count):
+            offset = start + int(i * segment + rng.random() * (segment - window))
+            block = _line_block(file, offset, window, first=offset == start)
+            blocks.append(block)
+            rows.append(_count_lines(block))
+
+        data = io.BytesIO(header + b''.join(blocks))
+        if file_format == 'csv':
+            df = pd.read_csv(data, encoding=encoding, encoding_errors='replace')
+        else:
+            df = pd.read_json(io.TextIOWrapper(data, encoding=encoding, errors='replace'), lines=True)
+    except (ValueError, pd.errors.ParserError) as e:
+        logger.warning(f"Block sampling of '{file.filename}' failed ({e}), reading it in full")
+        return None
+    finally:
+        file.seek(0)
+
+    rows = np.asarray(rows, dtype='float64')
+    if len(df) != rows.sum():
+        # Records spanning lines were cut apart; only a full parse is reliable
+        logger.warning(f"Block sampling of '{file.filename}' found multi-line records, reading it in full")
+        return None
+
+    # Each line had a window/segment chance of being read. Neighbouring
+    # segments are paired as strata, so sorted files (where blocks differ
+    # systematically) get bounds from the differences within each pair.
+    expansion = segment / window
+    blocks = np.repeat(np.arange(count), rows.astype('int64'))
+    sample = Sample(df, rows.sum() * expansion, 'blocks', weights=np.full(len(df), expansion),
+                    strata=np.minimum(blocks // 2, count // 2 - 1), clusters=blocks)
+    sample.rows_margin = float(_Z * np.sqrt(_variance(sample, sample.weights[:, None]))[0])
+    return sample
+
+
+# --- Estimates with error bounds ---
+
+def _variance(sample, z):
+    """
+    Design-based variance of a total, given each sampled row's linearised
+    contribution z (n x k): contributions are summed per cluster, and the
+    spread of cluster sums within each stratum gives the variance, with a
+    finite population correction per stratum. For a plain random sample
+    this is the familiar (1 - n/N) s^2 / n.
+    """
+    n = len(z)
+    if n < 2:
+        return np.zeros(z.shape[1])
+    if sample.strata is None and sample.clusters is None:
+        fpc = max(0.0, 1 - n / sample.population_rows) if sample.population_rows else 0.0
+        return fpc * n * z.var(axis=0, ddof=1)
+
+    strata = sample.strata if sample.strata is not None else np.zeros(n, dtype='int64')
+    clusters = sample.clusters if sample.clusters is not None else np.arange(n)
+    frame = pd.DataFrame(z)
+    totals = frame.groupby([strata, clusters]).sum()
+    by_stratum = totals.groupby(level=0)
+    # n_h / (n_h - 1) * sum of squared deviations = n_h * var(ddof=1)
+    spread = by_stratum.var(ddof=1).mul(by_stratum.size(), axis=0).fillna(0.0)
+    if sample.clusters is None:
+        weights = pd.Series(sample.weights).groupby(strata).sum()
+        fpc = (1 - pd.Series(1.0, index=range(n)).groupby(strata).sum() / weights).clip(lower=0)
+        spread = spread.mul(fpc.reindex(spread.index).fillna(0), axis=0)
+    return spread.sum().to_numpy()
+
+
+def estimate_means(sample, values):
+    """
+    Weighted means of the columns of values (n x k float array, NaN for
+    missing) and the margin of error of each at CONFIDENCE.
+    """
+    values = np.asarray(values, dtype='float64')
+    mask = ~np.isnan(values)
+    w = sample.weights[:, None] * mask
+    total = w.sum(axis=0)
+    filled = np.where(mask, values, 0.0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = (w * filled).sum(axis=0) / total
+        z = w * (filled - np.nan_to_num(means)) / np.where(total > 0, total, 1.0)
+    margins = _Z * np.sqrt(_variance(sample, z))
+    margins[total == 0] = np.nan
+    return means, margins
+
+
+def estimate_totals(sample, indicators):
+    """
+    Estimated dataset-wide counts for 0/1 indicator columns (n x k) and
+    their margins of error.
+    """
+    z = sample.weights[:, None] * np.asarray(indicators, dtype='float64')
+    return z.sum(axis=0), _Z * np.sqrt(_variance(sample, z))
+
+
+def weighted_std(sample, values, means):
+    values = np.asarray(values, dtype='float64')
+    mask = ~np.isnan(values)
+    w = sample.weights[:, None] * mask
+    total = w.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        var = (w * np.where(mask, values - means, 0.0) ** 2).sum(axis=0) / total
+        # Bessel's correction with the number of sampled values
+        count = mask.sum(axis=0)
+        var = var * count / (count - 1)
+    var[count < 2] = np.nan
+    return np.sqrt(var)
+
+
+def _weighted_quantiles(ordered, cumulative, q):
+    """
+    The q-quantile of each column (q: a scalar or one per column), given
+    the column-sorted values and their cumulative weights.
+    """
+    idx = np.minimum((cumulative < q * cumulative[-1]).sum(axis=0), len(ordered) - 1)
+    return ordered[idx, np.arange(ordered.shape[1])]
+
+
+def estimate_medians(sample, values):
+    """
+    Weighted medians of the columns of values with Woodruff intervals at
+    CONFIDENCE: the error of the share of rows below the median, mapped
+    back through the sample's quantiles. All columns are sorted in one
+    call. Returns (medians, lows, highs).
+    """
+    values = np.asarray(values, dtype='float64')
+    if len(values) == 0:
+        return tuple(np.full(values.shape[1], np.nan) for _ in range(3))
+    order = np.argsort(values, axis=0) # NaNs sort last
+    ordered = np.take_along_axis(values, order, axis=0)
+    cumulative = np.cumsum(np.where(np.isnan(ordered), 0.0, sample.weights[order]), axis=0)
+    medians = _weighted_quantiles(ordered, cumulative, 0.5)
+
+    with np.errstate(invalid='ignore'):
+        below = np.where(np.isnan(values), np.nan, values <= medians)
+    margins = np.nan_to_num(estimate_means(sample, below)[1])
+    lows = _weighted_quantiles(ordered, cumulative, np.clip(0.5 - margins, 0, 1))
+    highs = _weighted_quantiles(ordered, cumulative, np.clip(0.5 + margins, 0, 1))
+    return medians, lows, highs
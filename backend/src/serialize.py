@@ -0,0 +1,199 @@
+import datetime
+import decimal
+import gzip
+import json
+import math
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+except ImportError: # Optional dependency; the standard json module is used without it
+    orjson = None
+
+try:
+    import brotli
+except ImportError: # Optional dependency; responses are gzipped without it
+    brotli = None
+
+# Compress JSON/text responses for clients that accept it
+COMPRESSION = os.getenv("RESPONSE_COMPRESSION", "1").lower() in ("1", "true", "yes")
+# Smaller bodies are sent as is; compressing them costs more than it saves
+COMPRESSION_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESSION_MIN_BYTES", 1024))
+GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", 4))
+
+# Preferred first
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain', 'text/html', 'text/csv')
+
+_ORJSON_OPTIONS = ((orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS
+                    | orjson.OPT_PASSTHROUGH_DATETIME) if orjson is not None else 0)
+_PLAIN = (str, int, bool, type(None))
+
+
+def _default(obj):
+    """
+    Encodes the values neither JSON encoder knows about.
+    """
+    if obj is pd.NaT or obj is pd.NA:
+        return None
+    if isinstance(obj, (datetime.date, datetime.time, pd.Timedelta)):
+        return obj.isoformat()
+    if isinstance(obj, np.generic):
+        return clean(obj.item())
+    if isinstance(obj, (np.ndarray, pd.Series, pd.Index)):
+        return clean_array(obj)
+    if isinstance(obj, decimal.Decimal):
+        return clean(float(obj))
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """
+    JSON text of obj, with orjson when installed. NaN/inf become null,
+    NumPy scalars and arrays are encoded natively, dates as ISO strings.
+    Keys are sorted, as with Flask's default provider.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS).decode('utf-8')
+    return json.dumps(clean(obj), default=_default, sort_keys=True, separators=(',', ':'))
+
+
+def loads(text):
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def clean(obj):
+    """
+    A JSON-safe copy of obj: NaN/inf/NaT/NA become None, NumPy scalars
+    Python values, dates ISO strings. Arrays and Series are converted in
+    bulk (see clean_array); plain Python values are returned by a type
+    lookup instead of a chain of isinstance/pd.isna checks.
+    """
+    kind = type(obj)
+    if kind in _PLAIN:
+        return obj
+    if kind is float:
+        return obj if math.isfinite(obj) else None
+    if kind is dict:
+        return {k: clean(v) for k, v in obj.items()}
+    if kind is list or kind is tuple:
+        return [clean(v) for v in obj]
+    if isinstance(obj, np.ndarray) and obj.ndim > 1:
+        return [clean(row) for row in obj]
+    if isinstance(obj, (np.ndarray, pd.Series, pd.Index)):
+        return clean_array(obj)
+    if isinstance(obj, dict):
+        return {k: clean(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple, set)):
+        return [clean(v) for v in obj]
+    if isinstance(obj, (float, np.floating)):
+        return float(obj) if math.isfinite(obj) else None
+    if isinstance(obj, np.datetime64):
+        return clean(pd.Timestamp(obj))
+    try:
+        return _default(obj)
+    except TypeError:
+        return obj
+
+
+def clean_array(values):
+    """
+    JSON-safe Python list from a 1-D array, Series or Index. The missing
+    mask is computed once for the whole array, and numeric arrays are
+    converted with a single tolist() call.
+    """
+    series = values if isinstance(values, pd.Series) else pd.Series(values, copy=False)
+    dtype = series.dtype
+    if isinstance(dtype, np.dtype) and dtype.kind in 'biu':
+        return series.to_numpy().tolist() # Cannot hold missing values
+    if dtype.kind == 'f':
+        arr = series.to_numpy(dtype='float64', na_value=np.nan)
+        out = arr.tolist()
+        for i in np.flatnonzero(~np.isfinite(arr)):
+            out[i] = None
+        return out
+
+    missing = series.isna().to_numpy()
+    if dtype.kind in 'mM':
+        out = [None if m else v.isoformat() for v, m in zip(series, missing)]
+        return out
+    out = series.to_numpy(dtype=object).tolist()
+    for i in np.flatnonzero(missing):
+        out[i] = None
+    if dtype.kind == 'O' and not isinstance(dtype, pd.StringDtype):
+        # Object columns can hold anything (numbers, dates, nested JSON)
+        out = [v if type(v) in _PLAIN else clean(v) for v in out]
+    return out
+
+
+def preview(df, rows=5):
+    """
+    The first rows of df as a list of records, built column-oriented
+    instead of with DataFrame.to_dict() plus a cleanup pass. NumPy
+    columns of one dtype, and all other non-date columns, are each
+    converted as a single 2-D block, so wide tables cost a few array
+    operations rather than several per column.
+    """
+    head = df.head(rows)
+    columns = [None] * head.shape[1]
+    blocks = {}
+    for i, dtype in enumerate(head.dtypes):
+        if dtype.kind in 'mM':
+            columns[i] = clean_array(head.iloc[:, i])
+        else:
+            key = dtype if isinstance(dtype, np.dtype) and dtype.kind in 'biuf' else object
+            blocks.setdefault(key, []).append(i)
+
+    for key, positions in blocks.items():
+        block = head.iloc[:, positions].to_numpy(dtype=key).T
+        values = block.tolist()
+        if key is object:
+            missing = pd.isna(block)
+        elif key.kind == 'f':
+            missing = ~np.isfinite(block)
+        else:
+            missing = None
+        if missing is not None:
+            for c, r in zip(*np.nonzero(missing)):
+                values[c][r] = None
+        if key is object:
+            # Object columns can hold anything (numbers, dates, nested JSON)
+            values = [[v if type(v) in _PLAIN else clean(v) for v in column] for column in values]
+        for i, column in zip(positions, values):
+            columns[i] = column
+
+    names = list(head.columns)
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+def choose_encoding(accept):
+    """
+    The best content encoding the client accepts, or None. accept maps an
+    encoding to its quality (e.g. werkzeug's request.accept_encodings).
+    """
+    if not COMPRESSION:
+        return None
+    for encoding in ENCODINGS:
+        if accept[encoding] > 0:
+            return encoding
+    return None
+
+
+def compress(data, encoding):
+    """
+    data (bytes) encoded with 'br' or 'gzip'.
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    raise ValueError(f"Unsupported content encoding '{encoding}'")
@@ -0,0 +1,357 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+import pandas as pd
+from . import ingest, profiler
+
+logger = logging.getLogger(__name__)
+
+
+class SharedData:
+    """
+    A parsed Dataset shared by every session of the same content (by
+    digest), with its cached profile. The DataFrame may be spilled to
+    disk under memory pressure and is reloaded on use. It is dropped when
+    the last session using it is removed.
+    """
+
+    def __init__(self, dataset, digest=None, filename=None, file_format=None):
+        self.id = uuid.uuid4().hex
+        self.digest = digest
+        self.filename = filename
+        self.dataset = dataset
+        self.nbytes = int(dataset.df.memory_usage(deep=True).sum()) if dataset is not None else 0
+        # Kept to rebuild the Dataset after a spill
+        self.format = getattr(dataset, 'format', None) or file_format
+        self.profile = None
+        self.spill_path = None
+        # A copy of the data exists in the columnar store (under digest)
+        self.in_columnar = False
+        self.sessions = set()
+        self._spilling = False
+
+    @property
+    def has_data(self):
+        return self.dataset is not None or self.spill_path is not None or self.in_columnar
+
+
+class Session:
+    """
+    Server-side state for one analysed upload: the stats, the plot
+    metadata and (through SharedData) the parsed Dataset. Every upload
+    gets its own session, even when the content was uploaded before.
+    """
+
+    def __init__(self, stats, plots=None, report_type=None, digest=None, filename=None):
+        self.id = uuid.uuid4().hex
+        self.digest = digest
+        self.filename = filename
+        self.stats = stats
+        self.plots = plots or []
+        self.report_type = report_type
+        self.created_at = time.time()
+        self.last_access = self.created_at
+        self.data = None
+
+    @property
+    def has_data(self):
+        return self.data is not None and self.data.has_data
+
+    def to_dict(self):
+        data = self.data
+        in_memory = data is not None and data.dataset is not None
+        return {
+            "session_id": self.id,
+            "filename": self.filename,
+            "report_type": self.report_type,
+            "has_data": self.has_data,
+            "in_memory": in_memory,
+            "spilled": self.has_data and not in_memory,
+            "bytes": data.nbytes if data is not None else 0,
+            "created_at": self.created_at,
+            "last_access": self.last_access,
+        }
+
+
+class SessionStore:
+    """
+    Sessions, plus the DataFrames they use in LRU order under a global
+    memory cap. Uploads of identical content get separate sessions that
+    share one SharedData, so deleting or expiring one session never
+    affects another.
+    When the DataFrames held in memory exceed max_bytes, the least recently
+    used ones are spilled: to the columnar store when one is given (shared
+    by content hash and memory-mapped on reload), else to spill_dir, else
+    dropped. Stats and plots always stay in memory. Sessions idle for longer than
+    ttl_seconds are removed.
+    """
+
+    def __init__(self, max_bytes=1024 * 1024 * 1024, ttl_seconds=3600, spill_dir=None, columnar=None):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.spill_dir = spill_dir
+        self.columnar = columnar
+        self._sessions = {}
+        self._data = OrderedDict() # SharedData.id -> SharedData, least recently used first
+        self._by_digest = {} # digest -> SharedData.id
+        self._memory = 0
+        self._lock = threading.Lock()
+
+        self.spills = 0
+        self.reloads = 0
+        self.drops = 0
+        self.expired = 0
+
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    def create(self, dataset, stats, plots=None, report_type=None, digest=None, filename=None):
+        """
+        Stores a new session and returns it. dataset may be None when only
+        stats are available; the session then still uses the data of
+        earlier uploads of the same content, if any is held.
+        """
+        digest = digest if digest is not None else getattr(dataset, 'digest', None)
+        filename = filename if filename is not None else getattr(dataset, 'filename', None)
+        session = Session(stats, plots, report_type, digest, filename)
+        in_columnar = self.columnar is not None and digest is not None and self.columnar.has(digest)
+        with self._lock:
+            self._prune()
+            self._sessions[session.id] = session
+            self._attach(session, dataset, in_columnar)
+        self._enforce_limit()
+        return session
+
+    def _attach(self, session, dataset, in_columnar=False):
+        """
+        Links session to the SharedData of its content, creating it (or
+        giving it dataset) if needed. Caller holds the lock.
+        """
+        data = self._data.get(self._by_digest.get(session.digest)) if session.digest is not None else None
+        if data is None:
+            if dataset is None and not in_columnar:
+                return
+            file_format = ingest.detect_format(session.filename) if session.filename else None
+            data = SharedData(dataset, session.digest, session.filename, file_format)
+            data.in_columnar = in_columnar
+            self._data[data.id] = data
+            if data.digest is not None:
+                self._by_digest[data.digest] = data.id
+            self._memory += data.nbytes if dataset is not None else 0
+        elif dataset is not None and not data.has_data:
+            data.dataset = dataset
+            data.nbytes = int(dataset.df.memory_usage(deep=True).sum())
+            data.format = dataset.format
+            self._memory += data.nbytes
+        data.sessions.add(session.id)
+        session.data = data
+
+    def update(self, session_id, stats, plots, dataset=None):
+        """
+        Replaces a live session's stats and plots, e.g. with exact results
+        that follow a sampled first answer, and gives it dataset if it
+        held no data. Returns the session, or None if it has expired.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            session.stats = stats
+            session.plots = plots or []
+            if dataset is not None and not session.has_data:
+                if session.data is not None:
+                    self._release(session)
+                self._attach(session, dataset)
+        self._enforce_limit()
+        return session
+
+    def get(self, session_id):
+        """
+        Returns the session (marking it recently used), or None if unknown
+        or expired.
+        """
+        with self._lock:
+            self._prune()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_access = time.time()
+                if session.data is not None:
+                    self._data.move_to_end(session.data.id)
+            return session
+
+    def dataset(self, session_id, columns=None):
+        """
+        Returns the session's Dataset, reloading it from disk if it was
+        spilled, or None if the session is unknown or holds no data.
+        With `columns`, a spilled dataset is only partially loaded from the
+        columnar store and not kept in memory.
+        """
+        session = self.get(session_id)
+        if session is None or session.data is None:
+            return None
+        data = session.data
+        with self._lock:
+            if data.dataset is not None:
+                return data.dataset
+            spill_path = data.spill_path
+        from_columnar = spill_path is None and data.in_columnar and self.columnar is not None
+        if not from_columnar and spill_path is None:
+            return None
+
+        if from_columnar:
+            if columns is not None:
+                # Unknown names are left for the caller to report
+                stored = self.columnar.columns(data.digest) or []
+                columns = [col for col in columns if col in stored]
+            df = self.columnar.read(data.digest, columns)
+            if df is None:
+                return None
+            if columns is not None:
+                dataset = ingest.Dataset(df, data.filename, data.format)
+                dataset.digest = data.digest
+                return dataset
+            if data.nbytes == 0:
+                # Stats-only data loading for the first time
+                data.nbytes = int(df.memory_usage(deep=True).sum())
+        else:
+            try:
+                df = pd.read_pickle(spill_path)
+            except FileNotFoundError: # Data removed meanwhile
+                return None
+        with self._lock:
+            if data.dataset is None:
+                dataset = ingest.Dataset(df, data.filename, data.format)
+                dataset.digest = data.digest
+                dataset.profile = data.profile
+                data.dataset = dataset
+                if data.id in self._data:
+                    self._memory += data.nbytes
+                self.reloads += 1
+            dataset = data.dataset
+        self._enforce_limit()
+        return dataset
+
+    def delete(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return False
+            self._remove(session)
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "datasets": len(self._data),
+                "in_memory": sum(1 for d in self._data.values() if d.dataset is not None),
+                "memory_bytes": self._memory,
+                "max_bytes": self.max_bytes,
+                "spills": self.spills,
+                "reloads": self.reloads,
+                "drops": self.drops,
+                "expired": self.expired,
+                "spill_enabled": bool(self.spill_dir),
+            }
+
+    def _enforce_limit(self):
+        """
+        Spills least recently used DataFrames until memory is under the
+        cap. Disk writes happen outside the lock.
+        """
+        while True:
+            with self._lock:
+                if self._memory <= self.max_bytes:
+                    return
+                victim = next((d for d in self._data.values()
+                               if d.dataset is not None and not d._spilling), None)
+                if victim is None:
+                    return
+                victim._spilling = True
+            self._spill(victim)
+
+    def _spill(self, data):
+        dataset = data.dataset
+        path = None
+        if self.columnar is not None and data.digest is not None and not data.in_columnar:
+            # Parsed dates as text: a later upload of the same content loads this copy
+            data.in_columnar = self.columnar.write(data.digest, profiler.restore_frame(dataset.df, dataset.profile))
+        if self.spill_dir and data.spill_path is None and not data.in_columnar:
+            path = os.path.join(self.spill_dir, f"{data.id}.pkl")
+            try:
+                dataset.df.to_pickle(path)
+            except Exception as e:
+                logger.warning(f"Could not spill dataset {data.id}: {e}")
+                path = None
+        with self._lock:
+            data.profile = dataset.profile
+            if path is not None:
+                data.spill_path = path
+            if data.spill_path is not None or data.in_columnar:
+                self.spills += 1
+            else:
+                self.drops += 1
+            data.dataset = None
+            data._spilling = False
+            self._memory -= data.nbytes
+            if data.id not in self._data:
+                # Released while spilling
+                self._delete_spill(data)
+
+    def _remove(self, session):
+        # Caller holds the lock
+        self._sessions.pop(session.id, None)
+        self._release(session)
+
+    def _release(self, session):
+        """
+        Unlinks session from its SharedData, dropping the data when no
+        other session uses it. Caller holds the lock.
+        """
+        data, session.data = session.data, None
+        if data is None:
+            return
+        data.sessions.discard(session.id)
+        if data.sessions:
+            return
+        self._data.pop(data.id, None)
+        if self._by_digest.get(data.digest) == data.id:
+            del self._by_digest[data.digest]
+        if data.dataset is not None and not data._spilling:
+            self._memory -= data.nbytes
+            data.dataset = None
+        if not data._spilling:
+            self._delete_spill(data)
+
+    def _delete_spill(self, data):
+        if data.spill_path is not None:
+            try:
+                os.remove(data.spill_path)
+            except OSError:
+                pass
+            data.spill_path = None
+
+    def _prune(self):
+        # Caller holds the lock
+        cutoff = time.time() - self.ttl_seconds
+        for session in [s for s in self._sessions.values() if s.last_access < cutoff]:
+            self._remove(session)
+            self.expired += 1
+
+
+def from_env(columnar=None):
+    """
+    Builds a SessionStore configured from SESSION_* environment variables,
+    spilling to `columnar` (a columnar.ColumnarStore) when given.
+    """
+    spill_dir = os.getenv("SESSION_SPILL_DIR", os.path.join(tempfile.gettempdir(), "datanarrator_sessions"))
+    return SessionStore(
+        max_bytes=int(os.getenv("SESSION_MAX_BYTES", 1024 * 1024 * 1024)),
+        ttl_seconds=int(os.getenv("SESSION_TTL_SECONDS", 3600)),
+        spill_dir=spill_dir or None,
+        columnar=columnar,
+    )
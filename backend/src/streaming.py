@@ -0,0 +1,357 @@
+import copy
+import numpy as np
+import pandas as pd
+from . import correlation
+
+
+class NumericMoments:
+    """
+    Per-column count, mean, M2 (Welford/Chan), min and max for a block of
+    numeric columns.
+    """
+
+    def __init__(self, k):
+        self.count = np.zeros(k)
+        self.mean = np.zeros(k)
+        self.m2 = np.zeros(k)
+        self.min = [None] * k
+        self.max = [None] * k
+
+    def update(self, block):
+        """
+        block: DataFrame holding only the tracked numeric columns.
+        """
+        values = block.to_numpy(dtype='float64', na_value=np.nan)
+        mask = ~np.isnan(values)
+        n_b = mask.sum(axis=0).astype('float64')
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_b = np.where(mask, values, 0.0).sum(axis=0) / n_b
+            m2_b = np.where(mask, (values - mean_b) ** 2, 0.0).sum(axis=0)
+        mean_b = np.nan_to_num(mean_b)
+        self._combine(n_b, mean_b, m2_b)
+        # min/max stay Python scalars so integer columns remain exact
+        self._combine_extremes(block.min().tolist(), block.max().tolist())
+
+    def merge(self, other):
+        self._combine(other.count, other.mean, other.m2)
+        self._combine_extremes(other.min, other.max)
+
+    def _combine(self, n_b, mean_b, m2_b):
+        n_a = self.count
+        n = n_a + n_b
+        with np.errstate(invalid='ignore', divide='ignore'):
+            delta = mean_b - self.mean
+            self.mean = np.where(n > 0, self.mean + delta * n_b / n, 0.0)
+            self.m2 = np.where(n > 0, self.m2 + m2_b + delta ** 2 * n_a * n_b / n, 0.0)
+        self.count = n
+
+    def _combine_extremes(self, mins, maxs):
+        for i, (lo, hi) in enumerate(zip(mins, maxs)):
+            if lo is not None and not pd.isna(lo):
+                self.min[i] = lo if self.min[i] is None else min(self.min[i], lo)
+            if hi is not None and not pd.isna(hi):
+                self.max[i] = hi if self.max[i] is None else max(self.max[i], hi)
+
+    def std(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, np.sqrt(self.m2 / (self.count - 1)), np.nan)
+
+    def means(self):
+        return np.where(self.count > 0, self.mean, np.nan)
+
+
+class QuantileSketch:
+    """
+    Compact, mergeable quantile sketch (a simplified KLL).
+    Exact while fewer than `capacity` values have been seen; after that,
+    sorted levels are compacted by keeping every other item and doubling
+    its weight, which bounds memory to O(capacity * log n).
+    """
+
+    def __init__(self, capacity=4096, seed=0):
+        self.capacity = capacity
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    @property
+    def count(self):
+        return int(sum(len(level) << i for i, level in enumerate(self.levels)))
+
+    def update(self, values):
+        values = np.asarray(values, dtype='float64')
+        values = values[~np.isnan(values)]
+        if len(values):
+            self.levels[0] = np.concatenate([self.levels[0], values])
+            self._compress()
+
+    def merge(self, other):
+        for i, level in enumerate(other.levels):
+            if i >= len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[i] = np.concatenate([self.levels[i], level])
+        self._compress()
+
+    def _compress(self):
+        i = 0
+        while i < len(self.levels):
+            level = self.levels[i]
+            if len(level) > self.capacity:
+                level = np.sort(level)
+                # Odd leftovers stay behind so the total weight is preserved
+                keep = level[-1:] if len(level) % 2 else level[:0]
+                pairs = level[:len(level) - len(keep)]
+                offset = int(self._rng.integers(2))
+                promoted = pairs[offset::2]
+                self.levels[i] = keep
+                if i + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[i + 1] = np.concatenate([self.levels[i + 1], promoted])
+            i += 1
+
+    def quantile(self, q):
+        if len(self.levels) == 1 or all(len(level) == 0 for level in self.levels[1:]):
+            if len(self.levels[0]) == 0:
+                return np.nan
+            return float(np.quantile(self.levels[0], q))
+
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 1 << i) for i, level in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        values, weights = values[order], weights[order]
+        cumulative = np.cumsum(weights)
+        idx = int(np.searchsorted(cumulative, q * cumulative[-1]))
+        return float(values[min(idx, len(values) - 1)])
+
+
+class SpaceSaving:
+    """
+    Batched space-saving heavy-hitter summary.
+    Keeps at most `capacity` counters. Values first seen while the table
+    is full inherit the smallest tracked count (the space-saving
+    overestimate) and remember it as their error, so `count - error` is a
+    guaranteed lower bound. Exact while the number of distinct values stays
+    within capacity.
+    """
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = pd.Series(dtype='float64')
+        self.errors = pd.Series(dtype='float64')
+        self.floor = 0.0
+
+    def update(self, series):
+        self._add(series.value_counts(dropna=True).astype('float64'))
+
+    def merge(self, other):
+        self._add(other.counts, other.errors)
+
+    def _add(self, counts, errors=None):
+        if counts.empty:
+            return
+        errors = pd.Series(0.0, index=counts.index) if errors is None else errors
+        if self.floor:
+            new = ~counts.index.isin(self.counts.index)
+            counts = counts.where(~new, counts + self.floor)
+            errors = errors.where(~new, errors + self.floor)
+        combined = self.counts.add(counts, fill_value=0)
+        combined_errors = self.errors.add(errors, fill_value=0)
+        if len(combined) > self.capacity:
+            combined = combined.nlargest(self.capacity, keep='first')
+            self.floor = float(combined.iloc[-1])
+        self.counts = combined
+        self.errors = combined_errors.reindex(combined.index)
+
+    def top(self, n=10):
+        """
+        Returns the n most frequent values with their guaranteed counts.
+        """
+        guaranteed = (self.counts - self.errors).sort_values(ascending=False, kind='stable')
+        return {k: int(v) for k, v in guaranteed.head(n).items()}
+
+
+class CrossProducts:
+    """
+    Running sums needed for pairwise-complete Pearson correlation:
+    per pair, the co-observed count, sums, sums of squares and
+    cross-products. Values are shifted by a per-column reference (the
+    first chunk's mean) to keep the sums numerically stable.
+    """
+
+    def __init__(self, k):
+        self.shift = None
+        self.n = np.zeros((k, k))
+        self.s = np.zeros((k, k))
+        self.q = np.zeros((k, k))
+        self.p = np.zeros((k, k))
+
+    def update(self, block):
+        values = block.to_numpy(dtype='float64', na_value=np.nan)
+        mask = ~np.isnan(values)
+        if self.shift is None:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                self.shift = np.nan_to_num(np.where(mask, values, 0.0).sum(axis=0) / mask.sum(axis=0))
+        y = np.where(mask, values - self.shift, 0.0)
+        m = mask.astype('float64')
+        self.n += m.T @ m
+        self.s += y.T @ m
+        self.q += (y * y).T @ m
+        self.p += y.T @ y
+
+    def merge(self, other):
+        if other.shift is None:
+            return
+        if self.shift is None:
+            self.shift = other.shift.copy()
+        d = other.shift - self.shift
+        s, n = other.s, other.n
+        self.n += n
+        self.s += s + d[:, None] * n
+        self.q += other.q + 2 * d[:, None] * s + (d ** 2)[:, None] * n
+        self.p += other.p + d[None, :] * s + d[:, None] * s.T + np.outer(d, d) * n
+
+    def matrix(self):
+        n, s, q, p = self.n, self.s, self.q, self.p
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = n * p - s * s.T
+            var = (n * q - s * s) * (n * q.T - s.T * s.T)
+            corr = cov / np.sqrt(var)
+        corr[(n < 2) | ~np.isfinite(corr)] = np.nan
+        return np.clip(corr, -1.0, 1.0)
+
+
+class SummaryAccumulator:
+    """
+    Streams DataFrame chunks into the mergeable accumulators above and
+    produces the same schema as analyst.generate_summary_v2.
+    Memory depends on the number of columns, never on the number of rows,
+    and accumulators built over disjoint parts of a file can be merged.
+    The column layout is taken from the first chunk; later chunks coerce
+    numeric columns with to_numeric, so unparsable cells count as missing.
+    """
+
+    def __init__(self, sketch_capacity=4096, top_k_capacity=1000, max_corr_columns=300):
+        self.sketch_capacity = sketch_capacity
+        self.top_k_capacity = top_k_capacity
+        self.max_corr_columns = max_corr_columns
+        self.columns = None
+        self.rows = 0
+
+    def _init_schema(self, chunk):
+        self._schema = chunk.iloc[:0]
+        self.columns = list(chunk.columns)
+        self.numeric_cols = list(chunk.select_dtypes(include=[np.number]).columns)
+        self.categorical_cols = list(chunk.select_dtypes(include=['object', 'category']).columns)
+        self.missing = np.zeros(len(self.columns), dtype='int64')
+        self.moments = NumericMoments(len(self.numeric_cols))
+        self.sketches = [QuantileSketch(self.sketch_capacity, seed=i) for i in range(len(self.numeric_cols))]
+        self.top_values = [SpaceSaving(self.top_k_capacity) for _ in self.categorical_cols]
+        self.corr_cols = self.numeric_cols[:self.max_corr_columns]
+        self.cross = CrossProducts(len(self.corr_cols))
+
+    def spawn(self):
+        """
+        Returns an empty accumulator with the same column layout, used to
+        summarise chunks in parallel before merging them back.
+        """
+        partial = SummaryAccumulator(self.sketch_capacity, self.top_k_capacity, self.max_corr_columns)
+        if self.columns is not None:
+            partial._init_schema(self._schema)
+        return partial
+
+    def update(self, chunk):
+        if self.columns is None:
+            self._init_schema(chunk)
+        chunk = chunk.reindex(columns=self.columns)
+
+        self.rows += len(chunk)
+        self.missing += chunk.isnull().sum().to_numpy(dtype='int64')
+
+        numeric = chunk[self.numeric_cols]
+        non_numeric = [c for c in self.numeric_cols if not pd.api.types.is_numeric_dtype(numeric[c])]
+        if non_numeric:
+            numeric = numeric.copy()
+            for col in non_numeric:
+                numeric[col] = pd.to_numeric(numeric[col], errors='coerce')
+
+        if self.numeric_cols:
+            self.moments.update(numeric)
+            values = numeric.to_numpy(dtype='float64', na_value=np.nan)
+            for i, sketch in enumerate(self.sketches):
+                sketch.update(values[:, i])
+        if len(self.corr_cols) > 1:
+            self.cross.update(numeric[self.corr_cols])
+
+        for col, summary in zip(self.categorical_cols, self.top_values):
+            summary.update(chunk[col])
+        return self
+
+    def merge(self, other):
+        """
+        Folds another accumulator (built over a disjoint part of the same
+        file) into this one.
+        """
+        if other.columns is None:
+            return self
+        if self.columns is None:
+            self.__dict__.update(copy.deepcopy(other.__dict__))
+            return self
+        if other.columns != self.columns:
+            raise ValueError("Cannot merge summaries of files with different columns.")
+
+        self.rows += other.rows
+        self.missing += other.missing
+        self.moments.merge(other.moments)
+        for mine, theirs in zip(self.sketches, other.sketches):
+            mine.merge(theirs)
+        for mine, theirs in zip(self.top_values, other.top_values):
+            mine.merge(theirs)
+        if len(self.corr_cols) > 1:
+            self.cross.merge(other.cross)
+        return self
+
+    def result(self, top_corr=None):
+        """
+        Returns the summary dict in the generate_summary_v2 schema.
+        """
+        if self.columns is None:
+            return {"basic_info": {"rows": 0, "columns": [], "missing_values": {}},
+                    "numeric_stats": {}, "correlation": {}, "categorical_stats": {}}
+
+        def clean_val(val):
+            if val is None or pd.isna(val) or np.isinf(val):
+                return None
+            if isinstance(val, (np.integer, int)):
+                return int(val)
+            if isinstance(val, (np.floating, float)):
+                return float(val)
+            return val
+
+        summary = {
+            "basic_info": {
+                "rows": int(self.rows),
+                "columns": self.columns,
+                "missing_values": {col: int(v) for col, v in zip(self.columns, self.missing)}
+            },
+            "numeric_stats": {},
+            "correlation": {}
+        }
+
+        means, stds = self.moments.means(), self.moments.std()
+        for i, col in enumerate(self.numeric_cols):
+            summary["numeric_stats"][col] = {
+                "mean": clean_val(round(means[i], 2)),
+                "median": clean_val(round(self.sketches[i].quantile(0.5), 2)),
+                "max": clean_val(self.moments.max[i]),
+                "min": clean_val(self.moments.min[i]),
+                "std_dev": clean_val(round(stds[i], 2))
+            }
+
+        summary["categorical_stats"] = {
+            col: top.top(10) for col, top in zip(self.categorical_cols, self.top_values)
+        }
+
+        if len(self.corr_cols) > 1:
+            pairs = correlation.top_pairs_from_matrix(self.cross.matrix(), self.corr_cols, top_corr)
+            summary["correlation"] = {f"{a} vs {b}": clean_val(round(abs(r), 2)) for a, b, r in pairs}
+
+        return summary
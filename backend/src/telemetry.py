@@ -0,0 +1,492 @@
+import contextvars
+import cProfile
+import logging
+import math
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Sampling period of the per-request peak memory tracker (0 disables it)
+MEMORY_INTERVAL = float(os.getenv("TELEMETRY_MEMORY_INTERVAL_SECONDS", 0.05))
+# Share of requests run under cProfile; profiles are kept for slow ones only
+PROFILE_RATE = float(os.getenv("TELEMETRY_PROFILE_RATE", 0))
+PROFILE_DIR = os.getenv("TELEMETRY_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "datanarrator_profiles"))
+PROFILE_MAX_FILES = int(os.getenv("TELEMETRY_PROFILE_MAX_FILES", 50))
+SLOW_SECONDS = float(os.getenv("TELEMETRY_SLOW_SECONDS", 2))
+# Finished traces kept for /api/traces
+TRACE_HISTORY = int(os.getenv("TELEMETRY_TRACE_HISTORY", 100))
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = tuple(2 ** p for p in range(20, 35, 2)) # 1 MiB .. 16 GiB
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_number(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines += self._render_values(items)
+        return lines
+
+    def _render_values(self, items):
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_number(value)}" for key, value in items]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that is set directly, or read from `fn` at scrape time.
+    """
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), fn=None):
+        super().__init__(name, help_text, labels)
+        self.fn = fn
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        if self.fn is not None:
+            try:
+                value = self.fn()
+            except Exception as e:
+                logger.warning(f"Gauge {self.name} failed: {e}")
+                value = None
+            if value is None:
+                return []
+            with self._lock:
+                self._values[()] = value
+        return super().render()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=SECONDS_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += 1
+            state[2] += value
+
+    def _render_values(self, items):
+        lines = []
+        for key, (counts, count, total) in items:
+            for bound, n in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', _format_number(float(bound)))])} {n}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_number(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+class Registry:
+    """
+    The metrics exposed at /metrics, rendered in the Prometheus text
+    exposition format (no client library needed).
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        if not re.match(r'^[a-zA-Z_:][a-zA-Z0-9_:]*$', metric.name):
+            raise ValueError(f"Invalid metric name '{metric.name}'")
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=(), fn=None):
+        return self._add(Gauge(name, help_text, labels, fn))
+
+    def histogram(self, name, help_text, labels=(), buckets=SECONDS_BUCKETS):
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "datanarrator_stage_seconds", "Time spent in pipeline stages.", ("stage", "outcome"))
+REQUEST_SECONDS = REGISTRY.histogram(
+    "datanarrator_http_request_seconds", "HTTP request latency.", ("method", "endpoint", "status"))
+REQUEST_MEMORY = REGISTRY.histogram(
+    "datanarrator_http_request_memory_growth_bytes",
+    "Peak resident memory during a request, above the level at its start.", ("endpoint",), BYTES_BUCKETS)
+LLM_ATTEMPTS = REGISTRY.counter(
+    "datanarrator_llm_attempts_total", "LLM calls per model and outcome.", ("model", "outcome"))
+LLM_SECONDS = REGISTRY.histogram(
+    "datanarrator_llm_attempt_seconds", "LLM call latency per model and outcome.", ("model", "outcome"))
+LLM_TTFT = REGISTRY.histogram(
+    "datanarrator_llm_time_to_first_token_seconds", "Time to first streamed token per model.", ("model",))
+LLM_PROMPT_TOKENS = REGISTRY.histogram(
+    "datanarrator_llm_prompt_tokens", "Estimated prompt size per LLM call.", ("model",), TOKEN_BUCKETS)
+PROFILES = REGISTRY.counter(
+    "datanarrator_profiles_total", "Sampled request profiles, by whether they were saved.", ("saved",))
+
+
+def rss_bytes():
+    """
+    Current resident set size of this process, or None if unavailable.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except Exception: # psutil is optional
+        return None
+
+
+REGISTRY.gauge("datanarrator_process_resident_memory_bytes", "Resident memory of the server process.", fn=rss_bytes)
+
+
+# --- Traces ---
+
+class Trace:
+    """
+    Spans recorded while handling one request or background job.
+    """
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.seconds = None
+        self.status = None
+        self.spans = []
+        self.rss_start = rss_bytes()
+        self.rss_peak = self.rss_start
+        self.profile_path = None
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def offset(self):
+        return time.perf_counter() - self._start
+
+    def sample_memory(self, rss):
+        if rss is not None and (self.rss_peak is None or rss > self.rss_peak):
+            self.rss_peak = rss
+
+    @property
+    def memory_growth(self):
+        if self.rss_start is None or self.rss_peak is None:
+            return None
+        return self.rss_peak - self.rss_start
+
+    def to_dict(self):
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "trace_id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "started_at": self.started_at,
+            "seconds": self.seconds,
+            "rss_start_bytes": self.rss_start,
+            "rss_peak_bytes": self.rss_peak,
+            "memory_growth_bytes": self.memory_growth,
+            "profile": self.profile_path,
+            "spans": spans,
+        }
+
+
+_current = contextvars.ContextVar("datanarrator_trace", default=None)
+_history = deque(maxlen=TRACE_HISTORY)
+_history_lock = threading.Lock()
+
+
+def current_trace():
+    return _current.get()
+
+
+def bind(fn):
+    """
+    Wraps fn to run in the caller's context, so spans recorded on a pool
+    thread still land in the caller's trace.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+def record(name, seconds, outcome="ok", **attrs):
+    """
+    Records a span measured elsewhere (e.g. in a worker process).
+    """
+    STAGE_SECONDS.observe(seconds, stage=name, outcome=outcome)
+    trace = _current.get()
+    if trace is not None:
+        span = {"name": name, "start": round(trace.offset() - seconds, 4),
+                "seconds": round(seconds, 4), "outcome": outcome}
+        if attrs:
+            span["attrs"] = attrs
+        trace.add(span)
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Times a block as a pipeline stage. attrs are attached to the span in
+    the current trace; the yielded dict can be used to add more.
+    """
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield attrs
+    except BaseException as e:
+        outcome = "cancelled" if isinstance(e, GeneratorExit) or type(e).__name__ == 'JobCancelled' else "error"
+        raise
+    finally:
+        record(name, time.perf_counter() - start, outcome, **attrs)
+
+
+def llm_attempt(model, seconds, outcome, prompt_tokens=None, ttft=None):
+    """
+    Records one call to one model: latency, outcome, prompt size and
+    (for streams) time to first token.
+    """
+    LLM_ATTEMPTS.inc(model=model, outcome=outcome)
+    LLM_SECONDS.observe(seconds, model=model, outcome=outcome)
+    if prompt_tokens is not None:
+        LLM_PROMPT_TOKENS.observe(prompt_tokens, model=model)
+    if ttft is not None:
+        LLM_TTFT.observe(ttft, model=model)
+    attrs = {"model": model}
+    if prompt_tokens is not None:
+        attrs["prompt_tokens"] = prompt_tokens
+    if ttft is not None:
+        attrs["ttft"] = round(ttft, 4)
+    record("llm", seconds, outcome, **attrs)
+
+
+# --- Peak memory sampling ---
+
+class MemorySampler:
+    """
+    Samples process RSS every `interval` seconds while any trace is open
+    and raises each open trace's peak. Sleeps when nothing is traced.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._traces = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, trace):
+        with self._lock:
+            self._traces.add(trace)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="memory-sampler", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def remove(self, trace):
+        with self._lock:
+            self._traces.discard(trace)
+        trace.sample_memory(rss_bytes())
+
+    def _run(self):
+        while True:
+            with self._lock:
+                traces = list(self._traces)
+                if not traces:
+                    self._wake.clear()
+            if not traces:
+                self._wake.wait()
+                continue
+            rss = rss_bytes()
+            for trace in traces:
+                trace.sample_memory(rss)
+            time.sleep(self.interval)
+
+
+_sampler = MemorySampler(MEMORY_INTERVAL) if MEMORY_INTERVAL > 0 and rss_bytes() is not None else None
+# cProfile can only profile one request at a time
+_profile_lock = threading.Lock()
+
+
+def _save_profile(profiler, trace):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    safe_name = re.sub(r'[^A-Za-z0-9_.-]+', '_', trace.name).strip('_')
+    path = os.path.join(PROFILE_DIR, f"{int(trace.started_at)}_{safe_name}_{int(trace.seconds * 1000)}ms.prof")
+    profiler.dump_stats(path)
+    files = sorted((os.path.join(PROFILE_DIR, f) for f in os.listdir(PROFILE_DIR) if f.endswith('.prof')),
+                   key=os.path.getmtime)
+    for old in files[:-PROFILE_MAX_FILES] if PROFILE_MAX_FILES > 0 else []:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+    return path
+
+
+def start_trace(name):
+    """
+    Opens a trace for the current context. Returns a token for end_trace.
+    For code that cannot wrap a request in a with block (Flask hooks).
+    """
+    trace = Trace(name)
+    profiler = None
+    if PROFILE_RATE > 0 and random.random() < PROFILE_RATE and _profile_lock.acquire(blocking=False):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError: # Another profiler is active in this thread
+            _profile_lock.release()
+            profiler = None
+    if _sampler is not None:
+        _sampler.add(trace)
+    return trace, profiler, _current.set(trace)
+
+
+def end_trace(token, status="ok"):
+    """
+    Closes a trace opened by start_trace and returns it. Slow sampled
+    requests have their cProfile stats written to PROFILE_DIR.
+    """
+    trace, profiler, context_token = token
+    trace.seconds = round(trace.offset(), 4)
+    trace.status = status
+    if profiler is not None:
+        profiler.disable()
+        _profile_lock.release()
+        saved = trace.seconds >= SLOW_SECONDS
+        if saved:
+            try:
+                trace.profile_path = _save_profile(profiler, trace)
+                logger.info(f"Saved profile of slow request {trace.name} ({trace.seconds}s) to {trace.profile_path}")
+            except OSError as e:
+                logger.warning(f"Could not save profile: {e}")
+        PROFILES.inc(saved=str(saved).lower())
+    if _sampler is not None:
+        _sampler.remove(trace)
+    try:
+        _current.reset(context_token)
+    except ValueError: # Ended from a different context
+        _current.set(None)
+    with _history_lock:
+        _history.append(trace)
+    return trace
+
+
+@contextmanager
+def trace(name):
+    """
+    Traces a block (e.g. a background job) like a request.
+    """
+    token = start_trace(name)
+    status = "ok"
+    try:
+        yield token[0]
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        end_trace(token, status)
+
+
+@contextmanager
+def attach(trace):
+    """
+    Makes `trace` current for a block running outside the context that
+    started it (e.g. a streamed response body).
+    """
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            _current.set(None)
+
+
+def recent_traces(limit=None, min_seconds=0):
+    """
+    Finished traces, newest first.
+    """
+    with _history_lock:
+        traces = list(_history)
+    traces = [t.to_dict() for t in reversed(traces) if (t.seconds or 0) >= min_seconds]
+    return traces[:limit] if limit else traces
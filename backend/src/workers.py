@@ -0,0 +1,96 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class WorkerPool:
+    """
+    A process pool shared by concurrent requests, where one request
+    giving up on a hung task does not kill the others' work.
+    retire() takes the executor running the hung tasks out of service:
+    new tasks go to a fresh executor, and the old one's processes are
+    killed once the only tasks left running in it are hung ones.
+    """
+
+    def __init__(self, workers, initializer=None):
+        self.workers = workers
+        self.initializer = initializer
+        self._executor = None
+        self._state = {} # executor -> {"running", "hung", "retired"}
+        self._owner = {} # unfinished future -> its executor
+        self._lock = threading.Lock()
+        self.retired = 0
+
+    def _new_executor(self):
+        # spawn: safe alongside the server's threads, and the only
+        # start method available on Windows
+        executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=self.initializer
+        )
+        self._state[executor] = {"running": set(), "hung": set(), "retired": False}
+        return executor
+
+    def submit(self, fn, *args):
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._new_executor()
+            executor = self._executor
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool: # A worker died; its executor is unusable
+                self._state.pop(executor, None)
+                executor = self._executor = self._new_executor()
+                future = executor.submit(fn, *args)
+            self._state[executor]["running"].add(future)
+            self._owner[future] = executor
+        future.add_done_callback(lambda f: self._done(executor, f))
+        return future
+
+    def retire(self, hung):
+        """
+        Gives up on the (still running) futures in hung and retires the
+        executors running them.
+        """
+        idle = []
+        with self._lock:
+            for future in hung:
+                executor = self._owner.get(future)
+                state = self._state.get(executor)
+                if state is None:
+                    continue
+                state["hung"].add(future)
+                if not state["retired"]:
+                    state["retired"] = True
+                    self.retired += 1
+                if self._executor is executor:
+                    self._executor = None
+            for executor, state in list(self._state.items()):
+                if state["retired"] and state["running"] <= state["hung"]:
+                    del self._state[executor]
+                    idle.append(executor)
+        for executor in idle:
+            _kill(executor)
+
+    def _done(self, executor, future):
+        with self._lock:
+            self._owner.pop(future, None)
+            state = self._state.get(executor)
+            if state is None:
+                return
+            state["running"].discard(future)
+            state["hung"].discard(future)
+            if not state["retired"] or not state["running"] <= state["hung"]:
+                return
+            del self._state[executor]
+        # Done callbacks can run on the executor's own management thread,
+        # which must not shut itself down
+        threading.Thread(target=_kill, args=(executor,), daemon=True).start()
+
+
+def _kill(executor):
+    for process in list((getattr(executor, '_processes', None) or {}).values()):
+        process.terminate()
+    executor.shutdown(wait=False, cancel_futures=True)
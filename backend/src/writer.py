@@ -1,138 +1,232 @@
-import google.generativeai as genai
-import os
+import hashlib
+import json
+import logging
+import textwrap
+from . import llm, llm_cache, prompting
 
-def generate_narrative(summary_stats, instruction=""):
+logger = logging.getLogger(__name__)
+
+# Priority: 2.5 Flash Lite -> Flash Lite Latest -> Exp 1206 -> 2.0 Lite
+# Prioritizing "Lite" models which have separate quotas from main Flash/Pro models.
+# The router skips models whose circuit breaker is open.
+NARRATIVE_MODELS = [
+    'gemini-2.5-flash-lite',
+    'gemini-flash-lite-latest',
+    'gemini-exp-1206',
+    'gemini-2.0-flash-lite-preview-02-05',
+    'gemini-2.0-flash-exp'
+]
+
+# List of models to try in order of preference/cost/speed
+CHAT_MODELS = [
+    'gemini-2.5-flash-lite',
+    'gemini-flash-lite-latest',
+    'gemini-exp-1206',
+    'gemini-2.0-flash-lite-preview-02-05'
+]
+
+
+NARRATIVE_INSTRUCTIONS = textwrap.dedent("""
+    You are a Top-Tier Data Analyst & Business Consultant.
+    
+    OBJECTIVE:
+    Write a professional, comprehensive data intelligence report. 
+    Your goal is to uncover "hidden gems", identify strategic opportunities, and provide a 360-degree view of the data.
+    
+    STRUCTURED OUTPUT:
+    
+    # Report
+    
+    ## 1. Executive Briefing
+    - High-level summary of the dataset's core purpose and scope.
+    - The "Big Picture" take-away.
+    
+    ## 2. Deep Dive: Metrics & Distributions
+    *Important*: For each key metric, provide a "Visual Analysis" description as if describing the chart to a stakeholder.
+    
+    - **Numeric Trends**: Describe the shape of the distribution (Normal, Skewed? Long tail?). Mention mean vs median.
+    - **Categorical Patterns**: Describe the dominance of top categories. (e.g., "The chart shows a clear preference for X...").
+    - **Key Callouts**: Highlight "Superstars" (outliers) vs "Long Tail".
+    
+    ## 3. Correlation & Logic Analysis
+    - Interpret the correlations shown in the matrix.
+    - Explain *why* these variables might be related.
+    
+    ## 4. Strategic Implications & Opportunities
+    - **Crucial Section**: What does this mean for a business or creator?
+    - Suggest actionable next steps (e.g., "Focus on X category", "Expand to Y region").
+    
+    STRICT RULES:
+    - Do NOT use conversational fillers.
+    - Do NOT invent numbers.
+    - Do NOT simply list headers like "Distribution of X" without text. Write full sentences or bullet points analyzing the data.
+    - Assume the user can see the charts; your job is to explain *what they show*.
+""").strip()
+
+CHAT_INSTRUCTIONS = textwrap.dedent("""
+    You are a helpful Data Analyst Assistant.
+    You have already analyzed the dataset summary below.
+    
+    The user is asking follow-up questions about this data.
+    Answer strictly based on the provided stats. If you don't know, say so.
+    Keep answers concise and conversational.
+""").strip()
+
+
+# Cached responses are only reused while the prompt template and budgets
+# that produced them are unchanged
+NARRATIVE_VERSION = hashlib.sha256(
+    f"{NARRATIVE_INSTRUCTIONS}|{prompting.STATS_TOKEN_BUDGET}".encode('utf-8')).hexdigest()[:16]
+CHAT_VERSION = hashlib.sha256(
+    f"{CHAT_INSTRUCTIONS}|{prompting.STATS_TOKEN_BUDGET}|{prompting.CHAT_TOKEN_BUDGET}|{prompting.CHAT_RECENT_MESSAGES}".encode('utf-8')
+).hexdigest()[:16]
+
+
+def _narrative_prompt(summary_stats, instruction=""):
+    # Fixed instructions and stats first (shared by every report on the
+    # same data), the per-request instruction last
+    prefix = prompting.stable_prefix(NARRATIVE_INSTRUCTIONS, summary_stats)
+    return f"{prefix}\n\nUSER INSTRUCTION:\n{instruction}"
+
+
+def _history_key(history):
+    return json.dumps([[msg.get('role'), msg.get('content')] for msg in history], separators=(',', ':'))
+
+
+def _cached(kind, stats, key_text, models, version, use_cache):
+    """
+    Cached (text, model) for this request, or None.
+    """
+    cache = llm_cache.get_cache() if use_cache else None
+    if cache is None:
+        return None
+    return cache.lookup(kind, stats, key_text, models, version, llm.backend_name())
+
+
+def _remember(kind, stats, key_text, model, text, version, use_cache):
+    cache = llm_cache.get_cache() if use_cache else None
+    if cache is not None and text:
+        cache.store(kind, stats, key_text, model, text, version, llm.backend_name())
+
+
+def generate_narrative(summary_stats, instruction="", use_cache=True):
     """
     Generates a narrative report based on summary statistics using Google Gemini.
+    Repeat requests for the same stats and instruction are answered from
+    the response cache unless use_cache is False.
     """
-    # Check for API Key
-    api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-    if not api_key:
+    hit = _cached('narrative', summary_stats, instruction, NARRATIVE_MODELS, NARRATIVE_VERSION, use_cache)
+    if hit is not None:
+        logger.info(f"Narrative served from cache ({hit[1]})")
+        return hit[0]
+
+    try:
+        router = llm.get_router()
+    except llm.MissingAPIKey:
         return "Error: Google API Key not found. Please set 'GEMINI_API_KEY' in your .env file."
 
     try:
-        genai.configure(api_key=api_key)
-        
-        # Priority: 2.5 Flash Lite -> Flash Lite Latest -> Exp 1206 -> 2.0 Lite
-        # Prioritizing "Lite" models which have separate quotas from main Flash/Pro models.
-        models_to_try = [
-            'gemini-2.5-flash-lite',
-            'gemini-flash-lite-latest',
-            'gemini-exp-1206',
-            'gemini-2.0-flash-lite-preview-02-05',
-            'gemini-2.0-flash-exp'
-        ]
-        
-        prompt = f"""
-        You are a Top-Tier Data Analyst & Business Consultant.
-        
-        DATA SUMMARY:
-        {summary_stats}
-        
-        USER INSTRUCTION: 
-        {instruction}
-        
-        OBJECTIVE:
-        Write a professional, comprehensive data intelligence report. 
-        Your goal is to uncover "hidden gems", identify strategic opportunities, and provide a 360-degree view of the data.
-        
-        STRUCTURED OUTPUT:
-        
-        # Report
-        
-        ## 1. Executive Briefing
-        - High-level summary of the dataset's core purpose and scope.
-        - The "Big Picture" take-away.
-        
-        ## 2. Deep Dive: Metrics & Distributions
-        *Important*: For each key metric, provide a "Visual Analysis" description as if describing the chart to a stakeholder.
-        
-        - **Numeric Trends**: Describe the shape of the distribution (Normal, Skewed? Long tail?). Mention mean vs median.
-        - **Categorical Patterns**: Describe the dominance of top categories. (e.g., "The chart shows a clear preference for X...").
-        - **Key Callouts**: Highlight "Superstars" (outliers) vs "Long Tail".
-        
-        ## 3. Correlation & Logic Analysis
-        - Interpret the correlations shown in the matrix.
-        - Explain *why* these variables might be related.
-        
-        ## 4. Strategic Implications & Opportunities
-        - **Crucial Section**: What does this mean for a business or creator?
-        - Suggest actionable next steps (e.g., "Focus on X category", "Expand to Y region").
-        
-        STRICT RULES:
-        - Do NOT use conversational fillers.
-        - Do NOT invent numbers.
-        - Do NOT simply list headers like "Distribution of X" without text. Write full sentences or bullet points analyzing the data.
-        - Assume the user can see the charts; your job is to explain *what they show*.
-        """
-        last_error = None
-        for model_name in models_to_try:
-            try:
-                print(f"DEBUG: Trying generation with model: {model_name}")
-                model = genai.GenerativeModel(model_name)
-                response = model.generate_content(prompt)
-                return response.text
-                return response.text
-            except Exception as e:
-                print(f"DEBUG: Model {model_name} failed: {e}")
-                last_error = e
-                import time
-                time.sleep(1) # Brief pause to help with rate limits
-                continue
-        
-        return f"Error: All available Gemini models failed. Last error: {str(last_error)}. Please check your API key and quotas."
+        prompt = _narrative_prompt(summary_stats, instruction)
+        text, model = router.generate(prompt, NARRATIVE_MODELS)
+        _remember('narrative', summary_stats, instruction, model, text, NARRATIVE_VERSION, use_cache)
+        return text
+    except llm.AllModelsFailed as e:
+        return f"Error: All available Gemini models failed. Last error: {str(e.last_error)}. Please check your API key and quotas."
     except Exception as e:
         return f"Error generating narrative: {e}"
 
-def chat_with_data(history, stats):
+
+def _chat_prompt(history, stats):
+    # Stateless prompt for robustness; older turns are summarised or
+    # dropped to stay within the chat token budget
+    return prompting.build_chat_prompt(CHAT_INSTRUCTIONS, history, stats)
+
+
+def chat_with_data(history, stats, use_cache=True):
     """
     Handles follow-up chat turns.
+    Replies are cached by the full conversation, so only an identical
+    conversation about identical stats is answered from the cache.
     """
-    api_key = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
-    if not api_key:
+    history_key = _history_key(history)
+    hit = _cached('chat', stats, history_key, CHAT_MODELS, CHAT_VERSION, use_cache)
+    if hit is not None:
+        return hit[0]
+
+    try:
+        router = llm.get_router()
+    except llm.MissingAPIKey:
         return "Error: API Key missing."
 
-    # List of models to try in order of preference/cost/speed
-    models_to_try = [
-        'gemini-2.5-flash-lite',
-        'gemini-flash-lite-latest',
-        'gemini-exp-1206',
-        'gemini-2.0-flash-lite-preview-02-05'
-    ]
-    
-    last_error = None
-    import time
-    
-    for model_name in models_to_try:
-        try:
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel(model_name)
-            
-            system_context = f"""
-            You are a helpful Data Analyst Assistant.
-            You have already analyzed the following dataset summary:
-            {stats}
-            
-            The user is asking follow-up questions about this data.
-            Answer strictly based on the provided stats. If you don't know, say so.
-            Keep answers concise and conversational.
-            """
-            
-            # Construct stateless prompt for robustness
-            conversation = [f"System: {system_context}"]
-            for msg in history:
-                role_label = "User" if msg['role'] == 'user' else "Assistant"
-                conversation.append(f"{role_label}: {msg['content']}")
-                
-            full_prompt = "\n\n".join(conversation) + "\nAssistant:"
-            
-            response = model.generate_content(full_prompt)
-            return response.text
-            
-        except Exception as e:
-            print(f"DEBUG: Chat model {model_name} failed: {str(e)}")
-            last_error = e
-            time.sleep(1) # Wait a bit before trying next model
-            continue
+    full_prompt = _chat_prompt(history, stats)
+
+    try:
+        text, model = router.generate(full_prompt, CHAT_MODELS)
+        _remember('chat', stats, history_key, model, text, CHAT_VERSION, use_cache)
+        return text
+    except llm.AllModelsFailed as e:
+        last_error = e.last_error
 
     return f"Sorry, I am currently overloaded (Rate Limit). Please try again in 5-10 seconds. (Error: {str(last_error)})"
+
+
+def _stream(kind, stats, key_text, version, use_cache, prompt, models, error_message):
+    """
+    Yields router stream events; failures end the stream with an
+    {"type": "error"} event carrying the same text the blocking calls return.
+    A cached response is sent as a single token; a fully streamed response
+    is cached.
+    """
+    hit = _cached(kind, stats, key_text, models, version, use_cache)
+    if hit is not None:
+        yield {"type": "model", "model": hit[1], "ttft": 0.0, "cached": True}
+        yield {"type": "token", "text": hit[0]}
+        yield {"type": "done", "cached": True}
+        return
+
+    try:
+        router = llm.get_router()
+    except llm.MissingAPIKey as e:
+        yield {"type": "error", "message": f"Error: {e}"}
+        return
+
+    model, parts = None, []
+    try:
+        for event in router.stream(prompt(), models):
+            if event["type"] == "model":
+                model = event["model"]
+            elif event["type"] == "token":
+                parts.append(event["text"])
+            elif event["type"] == "reset":
+                parts = []
+            yield event
+    except llm.AllModelsFailed as e:
+        yield {"type": "error", "message": error_message.format(error=e.last_error)}
+        return
+    _remember(kind, stats, key_text, model, "".join(parts), version, use_cache)
+    yield {"type": "done"}
+
+
+def stream_narrative(summary_stats, instruction="", use_cache=True):
+    """
+    Streaming version of generate_narrative. Yields event dicts
+    (model, token, reset, done, error); see llm.ModelRouter.stream.
+    """
+    return _stream(
+        'narrative', summary_stats, instruction, NARRATIVE_VERSION, use_cache,
+        lambda: _narrative_prompt(summary_stats, instruction),
+        NARRATIVE_MODELS,
+        "Error: All available Gemini models failed. Last error: {error}. Please check your API key and quotas."
+    )
+
+
+def stream_chat(history, stats, use_cache=True):
+    """
+    Streaming version of chat_with_data.
+    """
+    return _stream(
+        'chat', stats, _history_key(history), CHAT_VERSION, use_cache,
+        lambda: _chat_prompt(history, stats),
+        CHAT_MODELS,
+        "Sorry, I am currently overloaded (Rate Limit). Please try again in 5-10 seconds. (Error: {error})"
+    )
@@ -1,19 +1,34 @@
-import { useState } from 'react'
+import { useRef, useState } from 'react'
 import axios from 'axios'
 import { Upload, FileText, CheckCircle, AlertCircle, Loader2, BarChart3, Sparkles, Download } from 'lucide-react'
-import Visualizations from './Visualizations'
+import Visualizations, { ChartView } from './Visualizations'
 import ChatInterface from './ChatInterface'
+import { postEventStream } from './sse'
 import ReactMarkdown from 'react-markdown'
 
+// Files up to this size are hashed before a streaming upload, so a repeat
+// upload is answered from the server's cache without being parsed again
+const HASH_MAX_BYTES = 256 * 1024 * 1024
+
+const sha256Hex = async (file) => {
+    if (!window.crypto?.subtle || file.size > HASH_MAX_BYTES) return null
+    const digest = await window.crypto.subtle.digest('SHA-256', await file.arrayBuffer())
+    return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, '0')).join('')
+}
+
 function App() {
     const [file, setFile] = useState(null)
     const [status, setStatus] = useState('idle') // idle, uploading, analyzed, generating, done, error
     const [stats, setStats] = useState(null)
+    const [sessionId, setSessionId] = useState(null)
     const [plots, setPlots] = useState([])
     const [report, setReport] = useState("")
     const [reportType, setReportType] = useState("")
     const [instruction, setInstruction] = useState("")
     const [errorMsg, setErrorMsg] = useState("")
+    const [exporting, setExporting] = useState(null) // format being exported
+    // Session of the latest upload; exact results for an older one are ignored
+    const currentSession = useRef(null)
 
     const handleFileChange = (e) => {
         if (e.target.files) {
@@ -23,24 +38,60 @@ function App() {
         }
     }
 
+    // Sampled uploads are followed by a job computing the exact stats and charts
+    const waitForRefine = (jobId, session) => {
+        const events = new EventSource(`http://127.0.0.1:5000/api/jobs/${jobId}/events`)
+        events.addEventListener('done', async () => {
+            events.close()
+            try {
+                const res = await axios.get(`http://127.0.0.1:5000/api/jobs/${jobId}/result`)
+                if (currentSession.current !== session) return
+                setStats(res.data.stats)
+                setPlots(res.data.plots)
+            } catch (err) {
+                console.error("Refinement failed:", err)
+            }
+        })
+        events.addEventListener('failed', () => events.close())
+        events.addEventListener('cancelled', () => events.close())
+        events.onerror = () => events.close()
+    }
+
     const handleUpload = async () => {
         if (!file) return;
         setStatus('uploading')
         setErrorMsg("")
 
-        const formData = new FormData()
-        formData.append('file', file)
-
         try {
-            const res = await axios.post('http://127.0.0.1:5000/api/upload', formData, {
-                headers: { 'Content-Type': 'multipart/form-data' }
-            })
+            // CSV and JSON-lines bodies are parsed by the server while they upload
+            const streamable = /\.(csv|jsonl|ndjson)$/i.test(file.name)
+            let res
+            if (streamable) {
+                const headers = { 'Content-Type': 'application/octet-stream' }
+                const hash = await sha256Hex(file)
+                if (hash) headers['X-Content-SHA256'] = hash
+                res = await axios.post('http://127.0.0.1:5000/api/upload/stream', file, {
+                    params: { filename: file.name },
+                    headers
+                })
+            } else {
+                const formData = new FormData()
+                formData.append('file', file)
+                res = await axios.post('http://127.0.0.1:5000/api/upload', formData, {
+                    headers: { 'Content-Type': 'multipart/form-data' }
+                })
+            }
             console.log("Upload response:", res.data)
 
             setStats(res.data.stats)
+            setSessionId(res.data.session_id)
             setReportType(res.data.report_type)
             setPlots(res.data.plots)
             setStatus('analyzed')
+            currentSession.current = res.data.session_id
+            if (res.data.refine_job_id) {
+                waitForRefine(res.data.refine_job_id, res.data.session_id)
+            }
         } catch (err) {
             console.error(err)
             const errMsg = err.response?.data?.error || "Upload failed"
@@ -51,27 +102,49 @@ function App() {
     }
 
     const handleGenerate = async () => {
-        if (!stats) return;
+        if (!sessionId) return;
         setStatus('generating')
+        setReport("")
         try {
-            const res = await axios.post('http://127.0.0.1:5000/api/generate', {
-                stats: stats,
+            // Stream the report so text appears as soon as the model starts writing
+            let streamError = null
+            await postEventStream('http://127.0.0.1:5000/api/generate/stream', {
+                session_id: sessionId, // Stats stay on the server
                 instruction: instruction
+            }, (type, data) => {
+                if (type === 'token') setReport(prev => prev + data.text)
+                else if (type === 'reset') setReport("") // Model failed mid-stream; the next one starts over
+                else if (type === 'error') streamError = data.message
             })
-            setReport(res.data.report)
+            if (streamError) throw new Error(streamError)
             setStatus('done')
         } catch (err) {
             console.error("Generate Error:", err)
-            const msg = err.response?.data?.error || "Generation failed"
+            const msg = err.message || "Generation failed"
             setErrorMsg(msg)
             alert("Error: " + msg)
             setStatus('error')
         }
     }
 
-    // Native browser print for vector-quality PDF
-    const handleDownloadPDF = () => {
-        window.print();
+    // The server renders the report and charts as a PDF or HTML file;
+    // the browser's print dialog remains the fallback for PDF
+    const handleExport = async (format) => {
+        setExporting(format)
+        try {
+            const res = await axios.post('http://127.0.0.1:5000/api/export', {
+                session_id: sessionId,
+                report: report,
+                format: format
+            })
+            window.location.href = res.data.url
+        } catch (err) {
+            console.error("Export Error:", err)
+            if (format === 'pdf') window.print()
+            else alert("Error: " + (err.response?.data?.error || err.message))
+        } finally {
+            setExporting(null)
+        }
     }
 
     return (
@@ -189,7 +262,10 @@ function App() {
                                 <div className="grid grid-cols-2 sm:grid-cols-4 gap-4 animate-slide-up print:hidden">
                                     <div className="bg-white/70 backdrop-blur-md p-4 rounded-2xl shadow-sm border border-white/50">
                                         <p className="text-xs font-semibold text-gray-500 uppercase tracking-wider">Rows</p>
-                                        <p className="text-2xl font-bold text-gray-800">{stats.basic_info.rows}</p>
+                                        <p className="text-2xl font-bold text-gray-800">{stats.sampling ? '≈ ' : ''}{stats.basic_info.rows}</p>
+                                        {stats.sampling && (
+                                            <p className="text-xs text-gray-500">Sample of {stats.sampling.sample_rows.toLocaleString()} rows</p>
+                                        )}
                                     </div>
                                     <div className="bg-white/70 backdrop-blur-md p-4 rounded-2xl shadow-sm border border-white/50">
                                         <p className="text-xs font-semibold text-gray-500 uppercase tracking-wider">Cols</p>
@@ -218,20 +294,22 @@ function App() {
                                         Report
                                     </h2>
                                     <div id="report-buttons" className="flex gap-2 print:hidden">
-                                        {status === 'done' && (
+                                        {status === 'done' && ['pdf', 'html'].map(format => (
                                             <button
-                                                onClick={handleDownloadPDF}
-                                                className="bg-purple-50 text-purple-700 px-4 py-2 rounded-lg text-sm font-bold hover:bg-purple-100 transition-colors flex items-center gap-2"
+                                                key={format}
+                                                onClick={() => handleExport(format)}
+                                                disabled={exporting !== null}
+                                                className="bg-purple-50 text-purple-700 px-4 py-2 rounded-lg text-sm font-bold hover:bg-purple-100 transition-colors flex items-center gap-2 disabled:opacity-50"
                                             >
-                                                <Download className="w-4 h-4" />
-                                                Download PDF
+                                                {exporting === format ? <Loader2 className="w-4 h-4 animate-spin" /> : <Download className="w-4 h-4" />}
+                                                Download {format.toUpperCase()}
                                             </button>
-                                        )}
+                                        ))}
                                         {status === 'done' && <span className="bg-green-100 text-green-700 px-3 py-1 rounded-full text-xs font-bold uppercase tracking-wide flex items-center">Completed</span>}
                                     </div>
                                 </div>
 
-                                {status === 'generating' ? (
+                                {status === 'generating' && !report ? (
                                     <div className="space-y-4 animate-pulse print:hidden">
                                         <div className="h-4 bg-gray-100 rounded w-3/4"></div>
                                         <div className="h-4 bg-gray-100 rounded w-full"></div>
@@ -242,14 +320,26 @@ function App() {
                                     <div className="prose prose-purple prose-lg max-w-none text-gray-800 leading-relaxed bg-white p-4 rounded-xl print:text-black print:p-0 print:prose-p:text-black print:prose-headings:text-black print:prose-strong:text-black print:prose-li:text-black print:max-w-full">
                                         <ReactMarkdown
                                             components={{
-                                                img: ({ node, ...props }) => (
-                                                    <img {...props} className="w-full h-auto rounded-xl shadow-md my-4 border border-gray-100" />
-                                                )
+                                                // Chart data from the backend is drawn in place of "#chart-<index>" images
+                                                img: ({ node, ...props }) => {
+                                                    const match = /^#chart-(\d+)$/.exec(props.src || '')
+                                                    if (match && plots[match[1]]) {
+                                                        return <ChartView plot={plots[match[1]]} />
+                                                    }
+                                                    return <img {...props} className="w-full h-auto rounded-xl shadow-md my-4 border border-gray-100" />
+                                                },
+                                                // Charts are blocks, so paragraphs holding one become divs
+                                                p: ({ node, ...props }) =>
+                                                    node.children.some(child => child.tagName === 'img' && child.properties?.src?.startsWith('#chart-'))
+                                                        ? <div {...props} />
+                                                        : <p {...props} />
                                             }}
                                         >
                                             {(() => {
                                                 if (!report || !plots) return report;
                                                 let injectedReport = report;
+                                                // Rendered images have a URL; chart data is drawn by ChartView
+                                                const chartSrc = (p) => p.url || `#chart-${plots.indexOf(p)}`;
 
                                                 // 1. Inject Correlation Matrix (After Header 3)
                                                 // Capture full line (.*) to avoid breaking headers like "## 3. Correlation & Logic"
@@ -257,14 +347,14 @@ function App() {
                                                 if (corrPlot) {
                                                     injectedReport = injectedReport.replace(
                                                         /(##\s*3\.\s*Correlation.*)/i,
-                                                        `$1\n\n![Correlation Matrix](${corrPlot.url})\n\n`
+                                                        `$1\n\n![Correlation Matrix](${chartSrc(corrPlot)})\n\n`
                                                     );
                                                 }
 
                                                 // 2. Inject Distribution Plots (After Header 2 - Start of Deep Dive)
                                                 const distPlots = plots.filter(p => p.type === 'distribution');
                                                 if (distPlots.length > 0) {
-                                                    const imgs = distPlots.map(p => `![${p.title}](${p.url})`).join('\n\n');
+                                                    const imgs = distPlots.map(p => `![${p.title}](${chartSrc(p)})`).join('\n\n');
                                                     injectedReport = injectedReport.replace(
                                                         /(##\s*2\.\s*Deep Dive.*)/i,
                                                         `$1\n\n${imgs}\n\n`
@@ -275,7 +365,7 @@ function App() {
                                                 // This places them at the bottom of the "Deep Dive" section, creating better flow
                                                 const catPlots = plots.filter(p => p.type === 'category');
                                                 if (catPlots.length > 0) {
-                                                    const imgs = catPlots.map(p => `![${p.title}](${p.url})`).join('\n\n');
+                                                    const imgs = catPlots.map(p => `![${p.title}](${chartSrc(p)})`).join('\n\n');
                                                     // Look for Header 3 again to insert *before* it
                                                     // If Header 3 is missing, fall back to appending to Header 2
                                                     if (injectedReport.match(/##\s*3\.\s*Correlation/i)) {
@@ -301,9 +391,9 @@ function App() {
                         )}
 
                         {/* Chat Interface - Only show when we have stats/report */}
-                        {status === 'done' && stats && (
+                        {status === 'done' && sessionId && (
                             <div className="print:hidden">
-                                <ChatInterface stats={stats} />
+                                <ChatInterface sessionId={sessionId} />
                             </div>
                         )}
 
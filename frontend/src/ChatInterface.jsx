@@ -1,8 +1,9 @@
 import React, { useState, useRef, useEffect } from 'react';
 import { Send, MessageSquare, Bot, User } from 'lucide-react';
 import ReactMarkdown from 'react-markdown';
+import { postEventStream } from './sse';
 
-const ChatInterface = ({ stats }) => {
+const ChatInterface = ({ sessionId }) => {
     const [messages, setMessages] = useState([]);
     const [input, setInput] = useState('');
     const [isLoading, setIsLoading] = useState(false);
@@ -17,37 +18,42 @@ const ChatInterface = ({ stats }) => {
     }, [messages]);
 
     const handleSend = async () => {
-        if (!input.trim() || !stats) return;
+        if (!input.trim() || !sessionId) return;
 
         const userMessage = { role: 'user', content: input };
         setMessages(prev => [...prev, userMessage]);
         setInput('');
         setIsLoading(true);
 
+        // Stream the reply into a placeholder message as it arrives
+        setMessages(prev => [...prev, { role: 'assistant', content: '' }]);
+        const setReply = (update) => setMessages(prev => {
+            const next = [...prev];
+            next[next.length - 1] = { role: 'assistant', content: update(next[next.length - 1].content) };
+            return next;
+        });
+
         try {
             // Prepare history for backend (excluding current message as it's added in backend prompt logic or we send it here)
             // Let's send the full history including the new user message for simplicity if backend expects it
             // Backend logic I wrote expects: history list of {role, content}
 
             const payload = {
-                stats: stats,
+                session_id: sessionId,
                 history: [...messages, userMessage]
             };
 
-            const response = await fetch('http://127.0.0.1:5000/api/chat', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(payload)
+            let streamError = null;
+            await postEventStream('http://127.0.0.1:5000/api/chat/stream', payload, (type, data) => {
+                if (type === 'token') setReply(content => content + data.text);
+                else if (type === 'reset') setReply(() => '');
+                else if (type === 'error') streamError = data.message;
             });
 
-            const data = await response.json();
-
-            if (data.error) throw new Error(data.error);
-
-            setMessages(prev => [...prev, { role: 'assistant', content: data.response }]);
+            if (streamError) setReply(() => streamError);
         } catch (error) {
             console.error(error);
-            setMessages(prev => [...prev, { role: 'assistant', content: "Sorry, I encountered an error answering that." }]);
+            setReply(() => "Sorry, I encountered an error answering that.");
         } finally {
             setIsLoading(false);
         }
@@ -14,20 +14,130 @@ import {
 } from 'recharts';
 import { TrendingUp, BarChart3 } from 'lucide-react';
 
+const tooltipStyle = { borderRadius: '12px', border: 'none', boxShadow: '0 4px 12px rgba(0,0,0,0.1)' };
+
+const formatNumber = (value) =>
+    Math.abs(value) >= 1000 || (value !== 0 && Math.abs(value) < 0.01)
+        ? value.toPrecision(3)
+        : Number(value.toFixed(2)).toString();
+
+// Diverging blue-white-red scale for correlations in [-1, 1] (like matplotlib's coolwarm)
+const heatColor = (value) => {
+    if (value === null || value === undefined) return '#f3f4f6';
+    const t = Math.min(1, Math.abs(value));
+    const [r, g, b] = value >= 0 ? [180, 4, 38] : [59, 76, 192];
+    const mix = (c) => Math.round(255 + (c - 255) * t);
+    return `rgb(${mix(r)}, ${mix(g)}, ${mix(b)})`;
+};
+
+// Histogram bars (as a step area over the bin edges) with the KDE curve on top
+const DistributionChart = ({ plot }) => {
+    const { edges, counts } = plot.bins;
+    const rows = [
+        ...counts.map((count, i) => ({ x: edges[i], count })),
+        { x: edges[edges.length - 1], count: counts[counts.length - 1] },
+        ...(plot.kde ? plot.kde.x.map((x, i) => ({ x, kde: plot.kde.y[i] })) : []),
+    ].sort((a, b) => a.x - b.x);
+
+    return (
+        <ResponsiveContainer width="100%" height={300}>
+            <ComposedChart data={rows} margin={{ top: 5, right: 20, left: 0, bottom: 5 }}>
+                <CartesianGrid stroke="#f5f5f5" />
+                <XAxis dataKey="x" type="number" domain={['dataMin', 'dataMax']} tickFormatter={formatNumber} />
+                <YAxis />
+                <Tooltip contentStyle={tooltipStyle} labelFormatter={formatNumber} formatter={formatNumber} />
+                <Area type="stepAfter" dataKey="count" fill="#bae6fd" stroke="#38bdf8" name="Frequency"
+                    connectNulls isAnimationActive={false} />
+                {plot.kde && (
+                    <Line type="monotone" dataKey="kde" stroke="#0369a1" strokeWidth={2} dot={false} name="Density"
+                        connectNulls isAnimationActive={false} />
+                )}
+            </ComposedChart>
+        </ResponsiveContainer>
+    );
+};
+
+const CategoryChart = ({ plot }) => {
+    const rows = plot.labels.map((name, i) => ({ name, count: plot.counts[i] }));
+    return (
+        <ResponsiveContainer width="100%" height={Math.max(200, rows.length * 32)}>
+            <BarChart data={rows} layout="vertical" margin={{ top: 5, right: 30, left: 40, bottom: 5 }}>
+                <CartesianGrid strokeDasharray="3 3" horizontal={false} />
+                <XAxis type="number" />
+                <YAxis dataKey="name" type="category" width={100} tick={{ fontSize: 11 }} />
+                <Tooltip contentStyle={tooltipStyle} />
+                <Bar dataKey="count" fill="#8b5cf6" name="Count" radius={[0, 4, 4, 0]} isAnimationActive={false} />
+            </BarChart>
+        </ResponsiveContainer>
+    );
+};
+
+const CorrelationHeatmap = ({ plot }) => (
+    <div className="overflow-x-auto">
+        <table className="text-xs border-separate" style={{ borderSpacing: 2 }}>
+            <thead>
+                <tr>
+                    <th></th>
+                    {plot.columns.map(col => (
+                        <th key={col} className="font-medium text-gray-600 px-1 max-w-[6rem] truncate" title={col}>{col}</th>
+                    ))}
+                </tr>
+            </thead>
+            <tbody>
+                {plot.matrix.map((row, i) => (
+                    <tr key={plot.columns[i]}>
+                        <th className="font-medium text-gray-600 text-right pr-2 max-w-[8rem] truncate" title={plot.columns[i]}>
+                            {plot.columns[i]}
+                        </th>
+                        {row.map((value, j) => (
+                            <td key={j} className="w-12 h-9 text-center rounded"
+                                style={{ background: heatColor(value), color: value !== null && Math.abs(value) > 0.6 ? 'white' : '#1f2937' }}>
+                                {value === null ? '' : value.toFixed(2)}
+                            </td>
+                        ))}
+                    </tr>
+                ))}
+            </tbody>
+        </table>
+    </div>
+);
+
+const CHARTS = {
+    distribution: DistributionChart,
+    category: CategoryChart,
+    correlation: CorrelationHeatmap,
+};
+
+// One chart from /api/upload: a rendered image (PLOT_MODE=image) or chart data drawn here
+export const ChartView = ({ plot }) => {
+    if (plot.url) {
+        return <img src={plot.url} alt={plot.title} className="w-full h-auto rounded-xl shadow-md my-4 border border-gray-100" />;
+    }
+    const Chart = CHARTS[plot.type];
+    if (!Chart) return null;
+    return (
+        <figure className="bg-white p-4 my-4 rounded-xl shadow-md border border-gray-100 not-prose">
+            <figcaption className="text-sm font-semibold text-gray-700 mb-3">
+                {plot.title}
+                {plot.sample_rows && (
+                    <span className="ml-2 text-xs font-normal text-gray-400">estimated from {formatNumber(plot.sample_rows)} sampled rows</span>
+                )}
+            </figcaption>
+            <Chart plot={plot} />
+        </figure>
+    );
+};
+
 const Visualizations = ({ stats, plots }) => {
     if (!stats) return null;
 
-    // Use Plot URLs from backend if available
+    // Use the charts from the backend if available
     if (plots && plots.length > 0) {
         return (
             <div className="grid grid-cols-1 md:grid-cols-2 gap-6 mb-8 animate-slide-up">
-                {plots.map((url, index) => (
+                {plots.map((plot, index) => (
                     <div key={index} className="bg-white p-4 rounded-3xl shadow-sm border border-purple-50 hover:shadow-md transition-shadow">
-                        <img
-                            src={url}
-                            alt={`Chart ${index + 1}`}
-                            className="w-full h-auto rounded-xl"
-                        />
+                        <ChartView plot={plot} />
                     </div>
                 ))}
             </div>
@@ -74,9 +184,7 @@ const Visualizations = ({ stats, plots }) => {
                                 <CartesianGrid strokeDasharray="3 3" horizontal={false} />
                                 <XAxis type="number" domain={[-1, 1]} />
                                 <YAxis dataKey="name" type="category" width={100} tick={{ fontSize: 10 }} />
-                                <Tooltip
-                                    contentStyle={{ borderRadius: '12px', border: 'none', boxShadow: '0 4px 12px rgba(0,0,0,0.1)' }}
-                                />
+                                <Tooltip contentStyle={tooltipStyle} />
                                 <Legend />
                                 <Bar dataKey="value" fill="#8884d8" name="Correlation Coefficient" radius={[0, 4, 4, 0]}>
                                     {
@@ -105,9 +213,7 @@ const Visualizations = ({ stats, plots }) => {
                                 <CartesianGrid stroke="#f5f5f5" />
                                 <XAxis dataKey="name" scale="band" />
                                 <YAxis />
-                                <Tooltip
-                                    contentStyle={{ borderRadius: '12px', border: 'none', boxShadow: '0 4px 12px rgba(0,0,0,0.1)' }}
-                                />
+                                <Tooltip contentStyle={tooltipStyle} />
                                 <Legend />
                                 <Area type="monotone" dataKey="mean" fill="#bfdbfe" stroke="#3b82f6" name="Average" />
                                 <Bar dataKey="max" barSize={20} fill="#1e40af" name="Max Value" radius={[4, 4, 0, 0]} />